@@ -6,6 +6,7 @@ import os.path
 import logging
 
 from . import settings
+from .catalogue import parse_exposure
 
 logger = logging.getLogger(__name__)
 
@@ -26,14 +27,45 @@ def get_target_fl(distance, resolution):
     return focal_length        
 
 
+class CameraState:
+    """
+    What the camera is known to be set to, None where it is unknown
+    """
+
+    __slots__ = ('mf', 'focus', 'zoom')
+
+    def __init__(self):
+        self.invalidate()
+
+    def invalidate(self):
+        self.mf = None
+        self.focus = None
+        self.zoom = None
+
+
+def zoom_step(ret):
+    """
+    Zoom step from b"1:return:3" of =return get_zoom()
+    """
+    try:
+        return int(ret.decode().strip().split(':')[-1])
+    except ValueError:
+        return None
+
+
 class Camera:
     """
-    Camera control for Canon S100/S110 using CHDK and chdkptp
+    Camera control for Canon S100/S110 using CHDK and chdkptp.
+
+    self.state mirrors manual focus, focus distance and zoom as set through
+    this class, commands which wouldn't change them are not sent and the
+    zoom is read from the camera only once per connection.
     """
 
     def __init__(self):
         self.proc = None
         self.counter = 0
+        self.state = CameraState()
 
     async def send_command(self, cmd, single_read=True, fin=False):
         self.proc.stdin.write(cmd.encode() + b'\n')
@@ -61,6 +93,7 @@ class Camera:
             stderr=subprocess.PIPE)
 
         logger.info("Chkptp subprocess started with pid: %s", self.proc.pid)
+        self.state.invalidate()
         await self.send_command("set usb_reset_on_close=true")
         await asyncio.sleep(0.1)
         res = await self.send_command("connect", single_read=False)
@@ -78,22 +111,26 @@ class Camera:
         self.proc.terminate()
 
     async def capture(self, params):
+        """
+        Shoot, return the image path and the exposure reported by shoot.lua
+        """
         fname = self.make_fname(self.counter)
 
         focus_distance = params.get('focus_distance')
-        if params.get('focus_mode') == 'MF':
-            ret = await self.send_command('=set_mf(1)')
-            await asyncio.sleep(0.1)
-            if focus_distance:
-                ret = await self.send_command('=set_focus({})'.format(focus_distance))
-                await asyncio.sleep(0.1)
-        else:
-            ret = await self.send_command('=set_mf(0)')
+        mf = 1 if params.get('focus_mode') == 'MF' else 0
+        if self.state.mf != mf:
+            await self.send_command('=set_mf({})'.format(mf))
+            self.state.mf = mf
+            self.state.focus = None
+        if mf and focus_distance and self.state.focus != focus_distance:
+            await self.send_command('=set_focus({})'.format(focus_distance))
+            self.state.focus = focus_distance
 
         cmd_params = "-script={}".format(SHOOT_SCRIPT_PATH)
 
         cmd = 'rs {} {}\n'.format(fname, cmd_params)
         ret = await self.send_command(cmd, single_read=False, fin=True)
+        exposure = parse_exposure(ret)
 
         wfname = "{}/{}.{}".format(fname.parts[-2], fname.parts[-1], 'jpg')
         tmr = 100
@@ -102,14 +139,21 @@ class Camera:
             await asyncio.sleep(0.1)  # TODO:  add wait timeout
             tmr -= 1
         self.counter += 1
-        return wfname
+        return wfname, exposure
 
     async def set_zoom(self, value):
+        if self.state.zoom == value:
+            return
         await self.send_command('=set_zoom({})'.format(value))
+        self.state.zoom = value
 
     async def get_zoom(self):
-        zoom = await self.send_command('=return get_zoom()', single_read=False)
-        return zoom.decode()
+        """
+        Zoom step, asked from the camera only if it isn't known
+        """
+        if self.state.zoom is None:
+            self.state.zoom = zoom_step(await self.send_command('=return get_zoom()', single_read=False))
+        return self.state.zoom
 
     def make_fname(self, n):
         fname = CAPTURE_PATH / 'image_{}'.format(n)
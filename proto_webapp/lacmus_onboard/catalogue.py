@@ -0,0 +1,240 @@
+# catalogue.py
+"""
+SQLite catalogue of captured images.
+
+A row is written once per capture, the gallery pages query it instead of
+opening every JPEG. The database runs in WAL mode, so the backfill import
+can write while the web app reads.
+
+Backfill existing capture folders:
+
+    python -m lacmus_onboard.catalogue captures/ [more folders] [--workers N]
+"""
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import pathlib
+import re
+import sqlite3
+
+from . import settings
+from .fast_exif import read_tags
+
+logger = logging.getLogger(__name__)
+
+
+CATALOGUE_PATH = settings.BASE_DIR / 'catalogue.sqlite'
+CROP_1_7 = 4.5
+PAGE_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    capture_index INTEGER,
+    timestamp REAL NOT NULL,
+    exposure_time REAL,
+    f_number REAL,
+    iso INTEGER,
+    focal_length REAL,
+    lat REAL,
+    lon REAL,
+    alt REAL,
+    detections INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS captures_timestamp ON captures (timestamp, id);
+"""
+
+FIELDS = ('path', 'capture_index', 'timestamp', 'exposure_time', 'f_number', 'iso', 'focal_length',
+          'lat', 'lon', 'alt', 'detections')
+
+INDEX_RE = re.compile(r'image_(\d+)')
+
+
+def capture_index(path):
+    match = INDEX_RE.search(pathlib.Path(path).stem)
+    return int(match.group(1)) if match else None
+
+
+def parse_exposure(text):
+    """
+    {"status":1,"tv":...,"av":...,"sv":...} result of shoot.lua from the
+    rs output, None if there is none
+    """
+    if isinstance(text, bytes):
+        text = text.decode(errors='replace')
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+
+def apex_exposure(result):
+    """
+    Exposure time, f-number and ISO from the APEX96 values of shoot.lua
+    """
+    exposure = {}
+    if result.get('tv') is not None:
+        exposure['exposure_time'] = 2 ** (-result['tv'] / 96)
+    if result.get('av') is not None:
+        exposure['f_number'] = round(2 ** (result['av'] / 192), 1)
+    if result.get('sv') is not None:
+        # shoot.lua works with real sv96, Canon market ISO is 69/96 EV higher
+        exposure['iso'] = int(round(3.125 * 2 ** ((result['sv'] + 69) / 96)))
+    return exposure
+
+
+def dms_to_degrees(dms, ref):
+    degrees = dms[0] + dms[1] / 60 + dms[2] / 3600
+    return -degrees if ref in ('S', 'W') else degrees
+
+
+EXIF_TAGS = ('exposure_time', 'f_number', 'photographic_sensitivity', 'focal_length', 'datetime_original',
+             'gps_latitude', 'gps_latitude_ref', 'gps_longitude', 'gps_longitude_ref', 'gps_altitude')
+
+
+def read_exif(path):
+    """
+    Catalogue fields from the EXIF of an image, missing tags are left out
+    """
+    tags = read_tags(path, EXIF_TAGS)
+    record = {}
+    for name, tag in (('exposure_time', 'exposure_time'), ('f_number', 'f_number'),
+                      ('iso', 'photographic_sensitivity'), ('focal_length', 'focal_length')):
+        value = tags.get(tag)
+        if value is not None:
+            record[name] = float(value)
+    taken = tags.get('datetime_original')
+    if taken:
+        try:
+            record['timestamp'] = datetime.datetime.strptime(taken, '%Y:%m:%d %H:%M:%S').timestamp()
+        except ValueError:
+            pass
+    if tags.get('gps_latitude') is not None and tags.get('gps_longitude') is not None:
+        record['lat'] = dms_to_degrees(tags['gps_latitude'], tags.get('gps_latitude_ref'))
+        record['lon'] = dms_to_degrees(tags['gps_longitude'], tags.get('gps_longitude_ref'))
+        if tags.get('gps_altitude') is not None:
+            record['alt'] = float(tags['gps_altitude'])
+    return record
+
+
+def make_record(path, exposure=None, pose=None, detections=0):
+    """
+    Catalogue row of a capture: exposure from the shoot.lua result if there
+    is one, the rest from EXIF and the file. FileNotFoundError if there is
+    no such file, e.g. the capture failed
+    """
+    path = pathlib.Path(path).resolve()
+    mtime = path.stat().st_mtime
+    record = {'path': str(path), 'capture_index': capture_index(path), 'detections': detections}
+    try:
+        record.update(read_exif(path))
+    except Exception as e:
+        logger.warning("Failed to read EXIF of %s: %s", path, e)
+    record.setdefault('timestamp', mtime)
+    if exposure:
+        record.update(apex_exposure(exposure))
+    if pose:
+        record.update({name: pose[name] for name in ('lat', 'lon', 'alt') if name in pose})
+    return record
+
+
+class Catalogue:
+
+    def __init__(self, path=CATALOGUE_PATH):
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), timeout=10)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, records):
+        """
+        Insert or replace records (dicts with FIELDS), in one transaction
+        """
+        rows = [tuple(record.get(name, 0 if name == 'detections' else None) for name in FIELDS)
+                for record in records]
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO captures ({}) VALUES ({})'.format(
+                    ', '.join(FIELDS), ', '.join('?' * len(FIELDS))),
+                rows)
+
+    def set_detections(self, path, count):
+        with self.conn:
+            self.conn.execute('UPDATE captures SET detections = ? WHERE path = ?', (count, str(path)))
+
+    def paths(self):
+        return {row[0] for row in self.conn.execute('SELECT path FROM captures')}
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM captures').fetchone()[0]
+
+    def page(self, page=0, page_size=PAGE_SIZE):
+        """
+        Captures of a gallery page, newest first
+        """
+        rows = self.conn.execute(
+            'SELECT * FROM captures ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+            (page_size, page * page_size))
+        return [dict(row) for row in rows]
+
+
+def backfill(catalogue, folders, workers=None, batch_size=500):
+    """
+    Add JPEGs of the folders which are not in the catalogue yet, EXIF is
+    read by a pool of processes
+    """
+    known = catalogue.paths()
+    paths = sorted(str(path) for folder in folders for path in pathlib.Path(folder).resolve().glob('*.jpg')
+                   if str(path) not in known)
+    logger.info("Importing %s images with %s workers", len(paths), workers or os.cpu_count())
+    batch = []
+    added = 0
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for record in pool.map(make_record, paths, chunksize=16):
+            batch.append(record)
+            if len(batch) >= batch_size:
+                catalogue.add(batch)
+                added += len(batch)
+                batch = []
+    catalogue.add(batch)
+    return added + len(batch)
+
+
+async def catalogue_init(app):
+    app['catalogue'] = Catalogue()
+
+
+async def catalogue_close(app):
+    app['catalogue'].close()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Import existing captures into the catalogue')
+    ap.add_argument('folders', nargs='+', help='Capture folders')
+    ap.add_argument('--catalogue', default=CATALOGUE_PATH, help='Catalogue database')
+    ap.add_argument('--workers', type=int, help='EXIF reader processes, number of CPUs by default')
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    catalogue = Catalogue(args.catalogue)
+    try:
+        added = backfill(catalogue, args.folders, args.workers)
+        logger.info("Imported %s images, %s in the catalogue", added, catalogue.count())
+    finally:
+        catalogue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# fast_exif.py
+"""
+Minimal EXIF reader for the handful of tags the gallery needs.
+
+exif.Image parses the whole file object to get at a few tags. read_tags()
+maps the JPEG, walks the segment headers to APP1 and decodes only the
+requested tags of the TIFF structure in it, the image data is never
+touched. Results are memoised by (path, mtime, size), so a replaced file
+is read again.
+
+Compare with exif.Image on a folder of captures:
+
+    python -m lacmus_onboard.fast_exif captures/
+"""
+import argparse
+import functools
+import mmap
+import os
+import pathlib
+import struct
+import time
+
+CACHE_SIZE = 4096
+
+# tag: (name, IFD) as the exif package calls them
+TAGS = {
+    0x829A: ('exposure_time', 'exif'),
+    0x829D: ('f_number', 'exif'),
+    0x8827: ('photographic_sensitivity', 'exif'),
+    0x9003: ('datetime_original', 'exif'),
+    0x920A: ('focal_length', 'exif'),
+    0x0001: ('gps_latitude_ref', 'gps'),
+    0x0002: ('gps_latitude', 'gps'),
+    0x0003: ('gps_longitude_ref', 'gps'),
+    0x0004: ('gps_longitude', 'gps'),
+    0x0006: ('gps_altitude', 'gps'),
+}
+NAMES = {name: (tag, ifd) for tag, (name, ifd) in TAGS.items()}
+DEFAULT_TAGS = ('exposure_time', 'f_number', 'photographic_sensitivity', 'focal_length')
+
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+
+# TIFF type: (struct format, size)
+TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8),
+         7: ('B', 1), 9: ('i', 4), 10: ('ii', 8)}
+
+SOI = b'\xff\xd8'
+APP1 = 0xE1
+SOS = 0xDA
+
+
+class ExifError(ValueError):
+    pass
+
+
+def find_app1(data):
+    """
+    (offset, length) of the TIFF structure in the Exif APP1 segment
+    """
+    if data[:2] != SOI:
+        raise ExifError("Not a JPEG")
+    offset = 2
+    size = len(data)
+    while offset + 4 <= size:
+        if data[offset] != 0xFF:
+            raise ExifError("Bad JPEG segment at {}".format(offset))
+        marker = data[offset + 1]
+        if marker == 0xFF:  # fill byte
+            offset += 1
+            continue
+        if marker == SOS:
+            break
+        length = struct.unpack_from('>H', data, offset + 2)[0]
+        if marker == APP1 and data[offset + 4:offset + 10] == b'Exif\0\0':
+            return offset + 10, length - 8
+        offset += 2 + length
+    return None
+
+
+def decode_value(data, base, byte_order, entry):
+    tag, type_, count, value_offset = entry
+    fmt, size = TYPES.get(type_, (None, 0))
+    if fmt is None:
+        return None
+    total = size * count
+    if total <= 4:
+        start = None  # value is in the entry itself
+    else:
+        start = base + value_offset
+    if type_ == 2:
+        raw = value_offset.to_bytes(4, 'little' if byte_order == '<' else 'big')[:count] if start is None \
+            else bytes(data[start:start + count])
+        return raw.split(b'\0', 1)[0].decode(errors='replace').strip()
+    if start is None:
+        raw = value_offset.to_bytes(4, 'little' if byte_order == '<' else 'big')
+        values = struct.unpack_from(byte_order + fmt * count, raw)
+    else:
+        values = struct.unpack_from(byte_order + fmt * count, data, start)
+    if type_ in (5, 10):
+        values = tuple(numerator / denominator if denominator else 0.0
+                       for numerator, denominator in zip(values[::2], values[1::2]))
+    return values[0] if len(values) == 1 else values
+
+
+def read_ifd(data, base, byte_order, offset):
+    """
+    {tag: (tag, type, count, value or offset)} of the IFD at offset
+    """
+    start = base + offset
+    count = struct.unpack_from(byte_order + 'H', data, start)[0]
+    entries = {}
+    for n in range(count):
+        entry = struct.unpack_from(byte_order + 'HHII', data, start + 2 + 12 * n)
+        entries[entry[0]] = entry
+    return entries
+
+
+def parse_tags(data, names):
+    location = find_app1(data)
+    if location is None:
+        return {}
+    base, length = location
+    byte_order = {b'II': '<', b'MM': '>'}.get(bytes(data[base:base + 2]))
+    if byte_order is None:
+        raise ExifError("Bad TIFF header")
+    ifd0_offset = struct.unpack_from(byte_order + 'I', data, base + 4)[0]
+    ifd0 = read_ifd(data, base, byte_order, ifd0_offset)
+    ifds = {'ifd0': ifd0}
+    wanted = {NAMES[name][1] for name in names}
+    for ifd, pointer in (('exif', EXIF_IFD_POINTER), ('gps', GPS_IFD_POINTER)):
+        if ifd in wanted and pointer in ifd0:
+            ifds[ifd] = read_ifd(data, base, byte_order, ifd0[pointer][3])
+    tags = {}
+    for name in names:
+        tag, ifd = NAMES[name]
+        entry = ifds.get(ifd, {}).get(tag)
+        if entry is not None:
+            tags[name] = decode_value(data, base, byte_order, entry)
+    return tags
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _read_tags(path, mtime_ns, size, names):
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            try:
+                return parse_tags(data, names)
+            except (struct.error, IndexError) as e:
+                raise ExifError("Bad EXIF in {}: {}".format(path, e))
+
+
+def read_tags(path, names=DEFAULT_TAGS):
+    """
+    {name: value} of the requested tags (exif package names) found in the
+    image, cached by path, mtime and size. The dict is shared by the
+    callers, don't modify it.
+    """
+    for name in names:
+        if name not in NAMES:
+            raise KeyError("Unsupported tag {}".format(name))
+    stat = os.stat(path)
+    return _read_tags(str(path), stat.st_mtime_ns, stat.st_size, tuple(names))
+
+
+cache_info = _read_tags.cache_info
+cache_clear = _read_tags.cache_clear
+
+
+def benchmark(folder, names=DEFAULT_TAGS):
+    import exif
+
+    paths = sorted(pathlib.Path(folder).glob('*.jpg'))
+    if not paths:
+        raise SystemExit("No images in {}".format(folder))
+
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, 'rb') as f:
+            image = exif.Image(f)
+            [image.get(name) for name in names]
+    exif_time = time.perf_counter() - start
+
+    cache_clear()
+    start = time.perf_counter()
+    for path in paths:
+        read_tags(path, names)
+    cold_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for path in paths:
+        read_tags(path, names)
+    cached_time = time.perf_counter() - start
+
+    for name, total in (('exif.Image', exif_time), ('read_tags', cold_time), ('read_tags cached', cached_time)):
+        print("{:18} {:8.3f} ms/image".format(name, total * 1000 / len(paths)))
+    return exif_time, cold_time, cached_time
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Compare read_tags with exif.Image')
+    ap.add_argument('folder', help='Folder with JPEGs')
+    args = ap.parse_args(argv)
+    benchmark(args.folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,7 @@ from lacmus_onboard.middlewares import setup_middlewares
 from lacmus_onboard.routes import setup_routes
 from lacmus_onboard.settings import get_config
 from lacmus_onboard.camera import camera_init, camera_close
+from lacmus_onboard.catalogue import catalogue_init, catalogue_close
 
 
 async def init_app(argv=None):
@@ -23,8 +24,10 @@ async def init_app(argv=None):
         app, loader=jinja2.PackageLoader('lacmus_onboard', 'templates'))
 
     # create db connection on startup, shutdown on exit
+    app.on_startup.append(catalogue_init)
     app.on_startup.append(camera_init)
     app.on_cleanup.append(camera_close)
+    app.on_cleanup.append(catalogue_close)
 
     # setup views and routes
     setup_routes(app)
@@ -162,4 +162,5 @@ retval = {}
 retval["status"] = 1
 retval["tv"] = tv96setpoint
 retval["av"] = av96setpoint
+retval["sv"] = sv96setpoint
 return to_json(retval)
\ No newline at end of file
@@ -1,11 +1,14 @@
 # views.py
 import aiohttp_jinja2
 from aiohttp import web
-import glob
-import exif
+import asyncio
 import fractions
+import logging
+import pathlib
 
-from . import settings
+from .catalogue import CROP_1_7, PAGE_SIZE, make_record
+
+logger = logging.getLogger(__name__)
 
 
 """
@@ -38,40 +41,45 @@ Out[11]: 0.001
 
 """
 
-CROP_1_7 = 4.5
-
-
 @aiohttp_jinja2.template('index.html')
 async def index(request):
-    search_path = settings.BASE_DIR / 'captures'
+    catalogue = request.app['catalogue']
+    try:
+        page = max(0, int(request.query.get('page', 0)))
+    except ValueError:
+        raise web.HTTPBadRequest(text='page must be a number')
     images = []
-    for img_path in search_path.glob('*.jpg'):
-        im_data = {
-            "url" : '/' + '/'.join(img_path.parts[-2:])
-        }
-        with open(img_path, 'rb') as f:
-            exif_img = exif.Image(f)
-            im_data['f_number'] = exif_img.f_number
-            im_data['focal_length'] = exif_img.focal_length
-            im_data['focal_length_35'] = exif_img.focal_length * CROP_1_7
-            im_data['iso'] = exif_img.photographic_sensitivity
-            im_data['tv'] = fractions.Fraction(exif_img.exposure_time).limit_denominator()
+    for record in catalogue.page(page):
+        img_path = pathlib.Path(record['path'])
+        im_data = dict(record, url='/' + '/'.join(img_path.parts[-2:]))
+        if record['focal_length'] is not None:
+            im_data['focal_length_35'] = record['focal_length'] * CROP_1_7
+        if record['exposure_time']:
+            im_data['tv'] = fractions.Fraction(record['exposure_time']).limit_denominator()
         images.append(im_data)
-    return {'images': images}
+    pages = (catalogue.count() + PAGE_SIZE - 1) // PAGE_SIZE
+    return {'images': images, 'page': page, 'pages': pages}
 
 
 @aiohttp_jinja2.template('capture.html')
 async def capture(request):
     camera = request.app['camera']
+    # from the state mirror, the camera is asked only once per connection
     zoom = await camera.get_zoom()
-    zoom = zoom.split(':')[-1]
     return {'zoom': zoom}
 
 
 async def do_capture(request):
     data = await request.post()
     camera = request.app['camera']
-    img_path = await camera.capture(data)
+    img_path, exposure = await camera.capture(data)
+    # catalogue the capture once, the gallery doesn't open the files
+    try:
+        record = await asyncio.get_event_loop().run_in_executor(None, make_record, img_path, exposure)
+    except FileNotFoundError:
+        logger.warning("Capture %s failed, no image to catalogue", img_path)
+    else:
+        request.app['catalogue'].add([record])
     router = request.app.router
     url = '/' + img_path
     return web.HTTPFound(location=url)
@@ -80,7 +88,10 @@ async def do_capture(request):
 async def set_zoom(request):
     data = await request.post()
     camera = request.app['camera']
-    await camera.set_zoom(data['zoom'])
+    try:
+        await camera.set_zoom(int(data['zoom']))
+    except ValueError:
+        raise web.HTTPBadRequest(text='zoom must be a number')
     router = request.app.router
     url = router['capture'].url_for()
     return web.HTTPFound(location=url)
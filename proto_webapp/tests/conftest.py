@@ -1,3 +1,5 @@
+import struct
+
 import pytest
 
 from lacmus_onboard.main import init_app
@@ -34,3 +36,81 @@ def tables_and_data():
     sample_data()
     yield
     drop_tables()
+
+
+# TIFF types of the tags the tests write
+ASCII, SHORT, LONG, RATIONAL = 2, 3, 4, 5
+
+
+def tiff_value(byte_order, type_, value):
+    if type_ == ASCII:
+        return value.encode() + b'\0'
+    if type_ == RATIONAL:
+        return b''.join(struct.pack(byte_order + 'II', *pair) for pair in value)
+    return struct.pack(byte_order + ('H' if type_ == SHORT else 'I') * len(value), *value)
+
+
+def tiff_ifd(byte_order, entries, data_offset):
+    """
+    IFD of (tag, type, value) entries, values longer than 4 bytes
+    go to the data area at data_offset. Return (ifd, data)
+    """
+    ifd = struct.pack(byte_order + 'H', len(entries))
+    data = b''
+    for tag, type_, value in sorted(entries):
+        raw = tiff_value(byte_order, type_, value)
+        size = {ASCII: 1, SHORT: 2, LONG: 4, RATIONAL: 8}[type_]
+        count = len(raw) // size
+        if len(raw) <= 4:
+            field = raw.ljust(4, b'\0')
+        else:
+            field = struct.pack(byte_order + 'I', data_offset + len(data))
+            data += raw + b'\0' * (len(raw) % 2)
+        ifd += struct.pack(byte_order + 'HHI', tag, type_, count) + field
+    return ifd + b'\0' * 4, data
+
+
+def make_jpeg(path, exif=None, gps=None, byte_order='<'):
+    """
+    Small JPEG with an Exif APP1 segment holding the exif and gps IFD
+    entries, without APP1 if both are None
+    """
+    segments = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0'
+    if exif is not None or gps is not None:
+        sub_ifds = [(0x8769, exif or []), (0x8825, gps or [])]
+        ifd_size = lambda entries: 2 + 12 * len(entries) + 4
+        ifd0_entries = [(tag, LONG, (0,)) for tag, entries in sub_ifds]
+        offset = 8 + ifd_size(ifd0_entries)
+        offsets = []
+        for tag, entries in sub_ifds:
+            offsets.append(offset)
+            offset += ifd_size(entries)
+        ifd0_entries = [(tag, LONG, (ifd_offset,)) for (tag, entries), ifd_offset in zip(sub_ifds, offsets)]
+        tiff = (b'II' if byte_order == '<' else b'MM') + struct.pack(byte_order + 'HI', 42, 8)
+        tiff += tiff_ifd(byte_order, ifd0_entries, offset)[0]
+        data = b''
+        for tag, entries in sub_ifds:
+            ifd, ifd_data = tiff_ifd(byte_order, entries, offset + len(data))
+            tiff += ifd
+            data += ifd_data
+        tiff += data
+        segments += b'\xff\xe1' + struct.pack('>H', 8 + len(tiff)) + b'Exif\0\0' + tiff
+    # start of scan with some entropy coded bytes, end of image
+    path.write_bytes(b'\xff\xd8' + segments + b'\xff\xda\0\x08\x01\x01\0\0\x3f\0' + bytes(64) + b'\xff\xd9')
+    return path
+
+
+S100_EXIF = [
+    (0x829A, RATIONAL, [(1, 1000)]),           # exposure_time
+    (0x829D, RATIONAL, [(40, 10)]),            # f_number
+    (0x8827, SHORT, (200,)),                   # photographic_sensitivity
+    (0x9003, ASCII, '2020:07:14 12:30:45'),    # datetime_original
+    (0x920A, RATIONAL, [(5200, 1000)]),        # focal_length
+]
+S100_GPS = [
+    (0x0001, ASCII, 'N'),
+    (0x0002, RATIONAL, [(55, 1), (45, 1), (3600, 100)]),
+    (0x0003, ASCII, 'W'),
+    (0x0004, RATIONAL, [(37, 1), (30, 1), (0, 1)]),
+    (0x0006, RATIONAL, [(1505, 10)]),
+]
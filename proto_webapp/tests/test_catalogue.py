@@ -0,0 +1,69 @@
+import datetime
+
+import pytest
+
+from lacmus_onboard.catalogue import Catalogue, apex_exposure, backfill, make_record, parse_exposure
+
+from .conftest import S100_EXIF, S100_GPS, make_jpeg
+
+
+@pytest.fixture
+def catalogue(tmp_path):
+    catalogue = Catalogue(tmp_path / 'catalogue.sqlite')
+    yield catalogue
+    catalogue.close()
+
+
+def test_apex_exposure():
+    result = parse_exposure(b'rs output\n{"status":1,"tv":960,"av":347,"sv":411}\n')
+    exposure = apex_exposure(result)
+    assert exposure['exposure_time'] == pytest.approx(1 / 1024)
+    assert exposure['f_number'] == 3.5
+    assert exposure['iso'] == 100
+    assert apex_exposure({'status': 1}) == {}
+    assert parse_exposure(b'ERROR: no camera\n') is None
+
+
+def test_make_record(tmp_path):
+    path = make_jpeg(tmp_path / 'image_7.jpg', S100_EXIF, S100_GPS)
+    record = make_record(path)
+    assert record['capture_index'] == 7
+    assert record['iso'] == 200
+    assert record['timestamp'] == datetime.datetime(2020, 7, 14, 12, 30, 45).timestamp()
+    assert record['lat'] == pytest.approx(55.76)
+    assert record['lon'] == pytest.approx(-37.5)
+
+    # the shoot.lua result and the pose take precedence
+    record = make_record(path, {'sv': 411}, {'lat': 1, 'lon': 2, 'alt': 3})
+    assert (record['iso'], record['lat'], record['lon'], record['alt']) == (100, 1, 2, 3)
+
+    with pytest.raises(FileNotFoundError):
+        make_record(tmp_path / 'image_8.jpg')
+
+
+def test_pages_newest_first(catalogue):
+    catalogue.add([{'path': '/captures/image_{}.jpg'.format(n), 'capture_index': n, 'timestamp': 1000 + n}
+                   for n in range(7)])
+    assert catalogue.count() == 7
+    assert [record['capture_index'] for record in catalogue.page(0, 3)] == [6, 5, 4]
+    assert [record['capture_index'] for record in catalogue.page(2, 3)] == [0]
+    assert catalogue.page(3, 3) == []
+
+    catalogue.set_detections('/captures/image_2.jpg', 4)
+    assert [record['detections'] for record in catalogue.page(0, 7)] == [0, 0, 0, 0, 4, 0, 0]
+
+
+def test_backfill(tmp_path, catalogue):
+    folder = tmp_path / 'captures'
+    folder.mkdir()
+    for n in range(3):
+        make_jpeg(folder / 'image_{}.jpg'.format(n), S100_EXIF)
+    make_jpeg(folder / 'image_3.jpg')
+    catalogue.add([make_record(folder / 'image_0.jpg')])
+
+    assert backfill(catalogue, [folder], workers=2, batch_size=2) == 3
+    assert catalogue.count() == 4
+    f_numbers = {record['capture_index']: record['f_number'] for record in catalogue.page()}
+    assert f_numbers == {0: 4.0, 1: 4.0, 2: 4.0, 3: None}
+    # already catalogued images are skipped
+    assert backfill(catalogue, [folder], workers=2) == 0
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from lacmus_onboard import fast_exif
+from lacmus_onboard.catalogue import EXIF_TAGS
+
+from .conftest import S100_EXIF, S100_GPS, SHORT, make_jpeg
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    fast_exif.cache_clear()
+
+
+@pytest.mark.parametrize('byte_order', ['<', '>'])
+def test_read_tags(tmp_path, byte_order):
+    path = make_jpeg(tmp_path / 'image_0.jpg', S100_EXIF, S100_GPS, byte_order)
+    tags = fast_exif.read_tags(path, EXIF_TAGS)
+    assert tags == {
+        'exposure_time': pytest.approx(0.001),
+        'f_number': pytest.approx(4.0),
+        'photographic_sensitivity': 200,
+        'datetime_original': '2020:07:14 12:30:45',
+        'focal_length': pytest.approx(5.2),
+        'gps_latitude_ref': 'N',
+        'gps_latitude': pytest.approx((55, 45, 36)),
+        'gps_longitude_ref': 'W',
+        'gps_longitude': pytest.approx((37, 30, 0)),
+        'gps_altitude': pytest.approx(150.5),
+    }
+
+
+def test_same_as_exif_package(tmp_path):
+    exif = pytest.importorskip('exif')
+    path = make_jpeg(tmp_path / 'image_0.jpg', S100_EXIF, S100_GPS, '>')
+    with open(path, 'rb') as f:
+        image = exif.Image(f)
+    tags = fast_exif.read_tags(path, EXIF_TAGS)
+    for name in EXIF_TAGS:
+        assert tags[name] == pytest.approx(image.get(name)), name
+
+
+def test_missing_tags_and_app1(tmp_path):
+    path = make_jpeg(tmp_path / 'image_0.jpg', [(0x8827, SHORT, (400,))])
+    assert fast_exif.read_tags(path) == {'photographic_sensitivity': 400}
+    assert fast_exif.read_tags(make_jpeg(tmp_path / 'image_1.jpg')) == {}
+    with pytest.raises(KeyError):
+        fast_exif.read_tags(path, ('maker_note',))
+
+
+def test_not_a_jpeg(tmp_path):
+    path = tmp_path / 'image_0.jpg'
+    path.write_bytes(b'GIF89a' + bytes(32))
+    with pytest.raises(fast_exif.ExifError):
+        fast_exif.read_tags(path)
+
+
+def test_cache_is_invalidated_by_mtime(tmp_path):
+    path = make_jpeg(tmp_path / 'image_0.jpg', [(0x8827, SHORT, (100,))])
+    os.utime(path, ns=(1, 1))
+    assert fast_exif.read_tags(path) == {'photographic_sensitivity': 100}
+    assert fast_exif.read_tags(path) == {'photographic_sensitivity': 100}
+    assert fast_exif.cache_info().hits == 1
+
+    make_jpeg(path, [(0x8827, SHORT, (800,))])
+    os.utime(path, ns=(2, 2))
+    assert fast_exif.read_tags(path) == {'photographic_sensitivity': 800}
@@ -13,13 +13,21 @@ setup(
         "lacmus_onboard": ["camera/chdkptp-rpi/*",
                            "camera/chdkptp-rpi/*/*",
                            "camera/chdkptp-rpi/*/*/",
-                           "camera/chdkptp-rpi/*/*/*"],
+                           "camera/chdkptp-rpi/*/*/*",
+                           "camera/chdkptp-sim/*"],
     },
     install_requires=[
         "pymavlink",
         "aiohttp",
+        "numpy",
     ],
     extras_require={
+        "uvloop": [
+            "uvloop",
+        ],
+        "chips": [
+            "Pillow",
+        ],
         "tests": [
             "pytest",
             "pytest-asyncio",
@@ -0,0 +1,115 @@
+"""
+UDP endpoint which drains the socket on every event loop wakeup.
+
+A datagram protocol gets one datagram_received call per packet, at high
+packet rates the per-callback overhead dominates. BatchDatagramEndpoint
+reads with recvfrom_into until EAGAIN into one receive buffer and hands
+all datagrams of the wakeup to a single callback, the MAVLink parser then
+runs once over the whole batch.
+"""
+import logging
+import socket
+
+logger = logging.getLogger(__name__)
+
+
+def parse_batch(parser, data):
+    """
+    Parse all MAVLink frames in data, a bad frame is skipped instead of
+    dropping the rest of the batch as parse_buffer does
+    """
+    msgs = []
+    chunk = data
+    while True:
+        try:
+            msg = parser.parse_char(chunk)
+        except Exception as e:
+            logger.warning("MAVLink Parser error: %s", e)
+            chunk = b''
+            continue
+        chunk = b''
+        if msg is None:
+            return msgs
+        msgs.append(msg)
+
+
+class BatchDatagramEndpoint:
+    """
+    Non-blocking UDP socket watched with loop.add_reader.
+
+    on_batch(data) is called once per wakeup with the concatenated
+    datagrams, at most MAX_DATAGRAMS of them so that a flood can't starve
+    the loop. Python's socket has no recvmmsg, the recvfrom_into loop goes
+    straight into the receive buffer without per-datagram allocations.
+    Has the sendto/close/get_extra_info subset of a datagram transport
+    and remote_addr of the protocol, so TransportFile can write to it.
+    """
+
+    MAX_DATAGRAMS = 256
+    MAX_DATAGRAM_SIZE = 65536
+    BUFFER_SIZE = 4 * MAX_DATAGRAM_SIZE
+
+    def __init__(self, loop, on_batch):
+        self.loop = loop
+        self.on_batch = on_batch
+        self.sock = None
+        self.remote_addr = None
+        self.buffer = memoryview(bytearray(self.BUFFER_SIZE))
+        self.wakeups = 0
+        self.datagrams = 0
+
+    def __str__(self):
+        return "BatchDatagramEndpoint({})".format(self.get_extra_info('sockname'))
+
+    def open(self, local_addr):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.bind(local_addr)
+        self.loop.add_reader(self.sock.fileno(), self.on_readable)
+        return self
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        logger.info('Connection lost: %s', None)
+
+    def get_extra_info(self, name, default=None):
+        if name == 'sockname' and self.sock is not None:
+            return self.sock.getsockname()
+        if name == 'socket':
+            return self.sock
+        return default
+
+    def sendto(self, data, addr):
+        try:
+            self.sock.sendto(data, addr)
+        except (BlockingIOError, InterruptedError):
+            logger.debug("Socket buffer is full, datagram to %s dropped", addr)
+        except OSError as e:
+            logger.error('Error received: %s', e)
+
+    def on_readable(self):
+        buffer = self.buffer
+        recvfrom_into = self.sock.recvfrom_into
+        used = 0
+        count = 0
+        while count < self.MAX_DATAGRAMS and self.BUFFER_SIZE - used >= self.MAX_DATAGRAM_SIZE:
+            try:
+                size, addr = recvfrom_into(buffer[used:])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                logger.error('Error received: %s', e)
+                break
+            if addr != self.remote_addr:
+                logger.info("New remote address: %s", addr)
+                self.remote_addr = addr
+            used += size
+            count += 1
+        if count:
+            self.wakeups += 1
+            self.datagrams += count
+            self.on_batch(bytes(buffer[:used]))
@@ -0,0 +1,427 @@
+"""
+Datagram round-trip and throughput benchmark of MAVLinkServerProtocol.
+
+A local echo server built from MAVLinkServerProtocol answers every PING
+with a PING response, a client on another UDP socket measures:
+
+ - round-trip latency of sequential pings
+ - max sustained message rate with a window of pings in flight
+
+The receive benchmark blasts ATTITUDE datagrams from another thread at the
+service protocol and measures parsed message rate and event loop lag,
+with parsing on the loop, in the parser thread and on the batched receive
+endpoint.
+
+The camera benchmark takes shots one after another, each waiting for its
+image, with a per-shot rs -script upload and with the persistent shooting
+script, and reports shots per minute. Without a camera it runs against
+the simulator (--camera-simulator, latencies from CHDKPTP_SIM_*).
+
+The FTP benchmark downloads a file from FTPServer through a link emulating
+a serial telemetry radio (10 bits per byte at the given baud rate) with a
+stand-in GCS client, once with ReadFile and once with BurstReadFile.
+"""
+import asyncio
+import logging
+import os
+import pathlib
+import socket
+import statistics
+import threading
+import time
+
+from . import ftp_server
+from .camera import CAPTURE_PATH, CHDKPTP_ROOT, Camera
+from .batch_receive import BatchDatagramEndpoint, parse_batch
+from .ftp_server import FTPServer, Opcode
+from .loops import LOOPS, loop_factory
+from .mavlink.dialects import lacmus as mavlink2
+from .mavlink_service import MAVLinkServerProtocol, TransportFile
+from .parser_thread import ParserThread, ThreadedServerProtocol
+
+logger = logging.getLogger(__name__)
+
+
+class PingClientProtocol:
+
+    def __init__(self):
+        self.parser = mavlink2.MAVLink(None, srcSystem=255, srcComponent=190)
+        self.waiters = {}
+        self.received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        pass
+
+    def error_received(self, exc):
+        logger.error('Error received: %s', exc)
+
+    def datagram_received(self, data, addr):
+        for msg in self.parser.parse_buffer(data) or []:
+            self.received += 1
+            waiter = self.waiters.pop(msg.seq, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(time.perf_counter())
+
+    def ping(self, seq):
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters[seq] = waiter
+        msg = self.parser.ping_encode(int(time.time() * 1e6), seq, 0, 0)
+        self.transport.sendto(msg.pack(self.parser))
+        return waiter
+
+
+async def echo(mav, queue):
+    while True:
+        msg = await queue.get()
+        if msg.get_msgId() == mavlink2.MAVLINK_MSG_ID_PING:
+            mav.ping_send(msg.time_usec, msg.seq, msg.get_srcSystem(), msg.get_srcComponent())
+
+
+async def measure(count, window, timeout=5.0):
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=100)
+    server_transport, server_protocol = await loop.create_datagram_endpoint(
+        lambda: MAVLinkServerProtocol(mav, queue), local_addr=('127.0.0.1', 0))
+    mav.file = TransportFile(server_transport, server_protocol)
+    echo_task = loop.create_task(echo(mav, queue))
+
+    client_transport, client = await loop.create_datagram_endpoint(
+        PingClientProtocol, remote_addr=server_transport.get_extra_info('sockname'))
+    try:
+        # warm up and let the server learn the remote address
+        await asyncio.wait_for(client.ping(0), timeout)
+
+        rtts = []
+        for seq in range(1, count + 1):
+            sent = time.perf_counter()
+            received = await asyncio.wait_for(client.ping(seq % 2 ** 32), timeout)
+            rtts.append((received - sent) * 1e6)
+
+        in_flight = set()
+        completed = 0
+        start = time.perf_counter()
+        for seq in range(count):
+            in_flight.add(client.ping(seq))
+            if len(in_flight) >= window:
+                done, in_flight = await asyncio.wait(
+                    in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                completed += len(done)
+        if in_flight:
+            done, in_flight = await asyncio.wait(in_flight, timeout=timeout)
+            completed += len(done)
+        elapsed = time.perf_counter() - start
+    finally:
+        echo_task.cancel()
+        client_transport.close()
+        server_transport.close()
+
+    rtts.sort()
+    return {
+        'rtt_median_us': statistics.median(rtts),
+        'rtt_p99_us': rtts[int(len(rtts) * 0.99) - 1],
+        'rate_msg_s': completed / elapsed,
+        'lost': count - completed,
+    }
+
+
+def run(loops=LOOPS, count=10000, window=64):
+    results = {}
+    for name in loops:
+        used, factory = loop_factory(name)
+        if used != name:
+            print("{:8} skipped, not available".format(name))
+            continue
+        loop = factory()
+        asyncio.set_event_loop(loop)
+        try:
+            results[name] = loop.run_until_complete(measure(count, window))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        print("{:8} rtt median {rtt_median_us:8.1f} us, p99 {rtt_p99_us:8.1f} us, "
+              "rate {rate_msg_s:9.0f} msg/s, lost {lost}".format(name, **results[name]))
+    return results
+
+
+def blast(addr, datagram, count, rate=None):
+    """
+    Send count copies of the datagram to addr from a plain blocking socket,
+    at rate datagrams/s or as fast as possible
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        start = time.perf_counter()
+        for n in range(count):
+            sock.sendto(datagram, addr)
+            if rate is not None:
+                delay = start + (n + 1) / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        sock.close()
+
+
+async def probe_lag(lags, interval=0.001):
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - start - interval)
+
+
+async def measure_receive(mode, count, rate=None, timeout=5.0):
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=100)
+    parser_thread = None
+
+    def deliver(msgs):
+        for msg in msgs:
+            queue.put_nowait(msg)
+
+    if mode == 'batch':
+        transport = BatchDatagramEndpoint(loop, lambda data: deliver(parse_batch(mav, data)))
+        transport.open(('127.0.0.1', 0))
+    else:
+        if mode == 'thread':
+            parser_thread = ParserThread(mavlink2.MAVLink(None), loop, deliver)
+            parser_thread.start()
+            protocol_factory = lambda: ThreadedServerProtocol(parser_thread)
+        else:
+            protocol_factory = lambda: MAVLinkServerProtocol(mav, queue)
+        transport, protocol = await loop.create_datagram_endpoint(protocol_factory, local_addr=('127.0.0.1', 0))
+    sender = mavlink2.MAVLink(None, srcSystem=2, srcComponent=1)
+    datagram = sender.attitude_encode(0, 0.1, 0.2, 0.3, 0, 0, 0).pack(sender)
+
+    lags = []
+    lag_task = loop.create_task(probe_lag(lags))
+    blaster = threading.Thread(target=blast, args=(transport.get_extra_info('sockname'), datagram, count, rate))
+    received = 0
+    start = time.perf_counter()
+    last = start
+    blaster.start()
+    try:
+        while received < count:
+            try:
+                await asyncio.wait_for(queue.get(), timeout if received == 0 else 0.5)
+            except asyncio.TimeoutError:
+                break
+            received += 1
+            last = time.perf_counter()
+    finally:
+        blaster.join()
+        lag_task.cancel()
+        transport.close()
+        if parser_thread is not None:
+            parser_thread.stop()
+    lags.sort()
+    return {
+        'rate_msg_s': received / (last - start),
+        'lost': count - received,
+        'lag_p50_ms': statistics.median(lags) * 1e3 if lags else 0,
+        'lag_max_ms': lags[-1] * 1e3 if lags else 0,
+    }
+
+
+def run_receive(modes=('loop', 'thread', 'batch'), count=50000, rate=None, measure=measure_receive):
+    results = {}
+    for mode in modes:
+        loop = asyncio.new_event_loop()
+        try:
+            results[mode] = loop.run_until_complete(measure(mode, count, rate))
+        finally:
+            loop.close()
+        print("{:8} {rate_msg_s:9.0f} msg/s, lost {lost:6}, loop lag median {lag_p50_ms:6.2f} ms, "
+              "max {lag_max_ms:7.2f} ms".format(mode, **results[mode]))
+    return results
+
+
+class EmulatedLinkFile:
+    """
+    File-like object which delays writes as a serial link of the given baud
+    rate would, queued frames are passed to send() one after another
+    """
+
+    def __init__(self, send, baudrate):
+        self.send = send
+        self.rate = baudrate / 10
+        self.busy_until = 0
+        self.sent = 0
+
+    def write(self, data):
+        loop = asyncio.get_event_loop()
+        self.busy_until = max(loop.time(), self.busy_until) + len(data) / self.rate
+        self.sent += len(data)
+        loop.call_at(self.busy_until, self.send, bytes(data))
+
+
+class FTPClientProtocol:
+
+    def __init__(self):
+        self.parser = mavlink2.MAVLink(None, srcSystem=255, srcComponent=190)
+        self.responses = asyncio.Queue()
+        self.seq = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        pass
+
+    def error_received(self, exc):
+        logger.error('Error received: %s', exc)
+
+    def datagram_received(self, data, addr):
+        for msg in self.parser.parse_buffer(data) or []:
+            if msg.get_msgId() == mavlink2.MAVLINK_MSG_ID_FILE_TRANSFER_PROTOCOL:
+                self.responses.put_nowait(ftp_server.parse_payload(msg.payload))
+
+    def request(self, opcode, session=0, offset=0, data=b'', size=None):
+        self.seq = (self.seq + 1) & 0xFFFF
+        payload = ftp_server.build_payload(self.seq, session, opcode, 0, offset, data)
+        if size is not None:
+            payload[4] = size
+        self.parser.file.write(self.parser.file_transfer_protocol_encode(0, 1, 100, payload).pack(self.parser))
+
+    async def call(self, opcode, session=0, offset=0, data=b'', size=None, timeout=5.0):
+        self.request(opcode, session, offset, data, size)
+        response = await asyncio.wait_for(self.responses.get(), timeout)
+        if response.opcode == Opcode.NAK:
+            raise OSError("FTP {} failed: error {}".format(opcode, response.data[0]))
+        return response
+
+    async def open(self, path):
+        response = await self.call(Opcode.OPEN_FILE_RO, data=path.encode())
+        return response.session, int.from_bytes(response.data[:4], 'little')
+
+    async def read_file(self, path):
+        session, size = await self.open(path)
+        data = bytearray()
+        while len(data) < size:
+            response = await self.call(Opcode.READ_FILE, session, len(data), size=ftp_server.MAX_DATA_SIZE)
+            data += response.data
+        await self.call(Opcode.TERMINATE_SESSION, session)
+        return bytes(data)
+
+    async def burst_read_file(self, path, timeout=5.0):
+        session, size = await self.open(path)
+        data = bytearray(size)
+        received = 0
+        while received < size:
+            self.request(Opcode.BURST_READ_FILE, session, received)
+            while True:
+                response = await asyncio.wait_for(self.responses.get(), timeout)
+                if response.opcode == Opcode.NAK:
+                    raise OSError("FTP burst read failed: error {}".format(response.data[0]))
+                if response.offset != received:
+                    # lost chunk, restart the burst from the gap
+                    break
+                data[received:received + response.size] = response.data
+                received += response.size
+                if response.burst_complete:
+                    break
+        await self.call(Opcode.TERMINATE_SESSION, session)
+        return bytes(data)
+
+
+async def measure_ftp(path, baudrate=57600, timeout=5.0):
+    path = pathlib.Path(path).absolute()
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=100)
+    server_transport, server_protocol = await loop.create_datagram_endpoint(
+        lambda: MAVLinkServerProtocol(mav, queue), local_addr=('127.0.0.1', 0))
+    downlink = mav.file = EmulatedLinkFile(
+        TransportFile(server_transport, server_protocol).write, baudrate)
+    server = FTPServer(mav, {'files': path.parent}, burst_rate=downlink.rate)
+
+    async def serve():
+        while True:
+            msg = await queue.get()
+            if msg.get_msgId() == mavlink2.MAVLINK_MSG_ID_FILE_TRANSFER_PROTOCOL:
+                server.handle(msg)
+
+    serve_task = loop.create_task(serve())
+    client_transport, client = await loop.create_datagram_endpoint(
+        FTPClientProtocol, remote_addr=server_transport.get_extra_info('sockname'))
+    client.parser.file = EmulatedLinkFile(client_transport.sendto, baudrate)
+    expected = path.read_bytes()
+    results = {}
+    try:
+        for name, download in (('ReadFile', client.read_file), ('BurstReadFile', client.burst_read_file)):
+            sent = downlink.sent
+            start = time.perf_counter()
+            data = await download('/files/' + path.name)
+            elapsed = time.perf_counter() - start
+            if data != expected:
+                raise RuntimeError("{} downloaded corrupted file".format(name))
+            results[name] = {
+                'rate_b_s': len(data) / elapsed,
+                'link_usage': (downlink.sent - sent) / elapsed / downlink.rate,
+                'efficiency': len(data) / elapsed / downlink.rate,
+            }
+    finally:
+        serve_task.cancel()
+        server.close()
+        client_transport.close()
+        server_transport.close()
+    return results
+
+
+def run_ftp(path, baudrate=57600):
+    print("{}: {} bytes over {} baud ({:.0f} bytes/s)".format(
+        path, os.path.getsize(path), baudrate, baudrate / 10))
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(measure_ftp(path, baudrate))
+    finally:
+        loop.close()
+    for name, result in results.items():
+        print("{:14} {rate_b_s:8.0f} bytes/s, link busy {link_usage:6.1%}, "
+              "payload efficiency {efficiency:6.1%}".format(name, **result))
+    return results
+
+
+async def measure_camera(count, capture_path, persistent_script, chdkptp_root=CHDKPTP_ROOT):
+    camera = Camera(capture_path, chdkptp_root, persistent_script=persistent_script)
+    if not await camera.init():
+        raise RuntimeError("Camera init failure")
+    intervals = []
+    saved = 0
+    try:
+        start = last = time.perf_counter()
+        for n in range(count):
+            path = await camera.shoot({})
+            if await camera.wait_file(path):
+                saved += 1
+            now = time.perf_counter()
+            intervals.append(now - last)
+            last = now
+    finally:
+        await camera.close()
+    return {
+        'shots_min': count * 60 / (last - start),
+        'interval_median_s': statistics.median(intervals),
+        'interval_max_s': max(intervals),
+        'saved': saved,
+    }
+
+
+def run_camera(count=20, capture_path=CAPTURE_PATH, chdkptp_root=CHDKPTP_ROOT, modes=('rs', 'persistent')):
+    results = {}
+    for mode in modes:
+        loop = asyncio.new_event_loop()
+        try:
+            results[mode] = loop.run_until_complete(measure_camera(
+                count, pathlib.Path(capture_path) / 'benchmark_{}'.format(mode), mode == 'persistent', chdkptp_root))
+        finally:
+            loop.close()
+        print("{:10} {shots_min:6.1f} shots/min, interval median {interval_median_s:.2f} s, "
+              "max {interval_max_s:.2f} s, saved {saved}/{count}".format(mode, count=count, **results[mode]))
+    return results
@@ -0,0 +1,380 @@
+import asyncio
+from asyncio import subprocess
+import collections
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+
+from .chdkptp import ChdkptpChannel, CommandError
+from .stream import FifoReader, write_file
+from .watcher import file_watcher
+
+logger = logging.getLogger(__name__)
+
+
+PACKAGE_ROOT = pathlib.Path(__file__).parent
+if os.uname().machine == 'x86_64':  # ubuntu on PC
+    CHDKPTP_ROOT = PACKAGE_ROOT / 'chdkptp'
+else:  # raspberry pi
+    CHDKPTP_ROOT = PACKAGE_ROOT / 'chdkptp-rpi'
+CHDKPTP_ROOT = pathlib.Path(os.environ.get('CHDKPTP_BASE_PATH', CHDKPTP_ROOT))
+SIMULATOR_ROOT = PACKAGE_ROOT / 'chdkptp-sim'  # see simulator.py
+SHOOT_SCRIPT_PATH = PACKAGE_ROOT / 'shoot.lua'
+SHOOT_SERVER_PATH = PACKAGE_ROOT / 'shoot_server.lua'
+CAPTURE_PATH = pathlib.Path.cwd() / 'captures'
+DETECTION_PATH = pathlib.Path.cwd() / 'detections'
+
+
+def shoot_server_script():
+    """
+    shoot.lua with the shooting loop of shoot_server.lua instead of a single shot
+    """
+    script = SHOOT_SCRIPT_PATH.read_text().rstrip()
+    if not script.endswith('return shoot()'):
+        raise ValueError("{} doesn't end with 'return shoot()'".format(SHOOT_SCRIPT_PATH))
+    return script[:-len('return shoot()')] + SHOOT_SERVER_PATH.read_text()
+
+
+def parse_exposure(text):
+    """
+    JSON result of shoot() from chdkptp output, None if there is none
+    """
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+
+
+class CameraState:
+    """
+    What the camera is known to be set to, None where it is unknown
+    """
+
+    __slots__ = ('mode', 'mf', 'focus', 'zoom')
+
+    def __init__(self):
+        self.invalidate()
+
+    def __str__(self):
+        return "CameraState(mode {}, mf {}, focus {}, zoom {})".format(self.mode, self.mf, self.focus, self.zoom)
+
+    def invalidate(self):
+        self.mode = None  # 'rec' or 'play'
+        self.mf = None
+        self.focus = None
+        self.zoom = None
+
+
+def zoom_step(response):
+    """
+    Zoom step from "1:return:3" of =return get_zoom() or "3" of the script
+    """
+    try:
+        return int(response.text.strip().split(':')[-1])
+    except (AttributeError, ValueError):
+        return None
+
+
+class Camera:
+    """
+    Camera control for Canon S100/S110 using CHDK and chdkptp.
+
+    By default every shot runs "rs -script=shoot.lua", so chdkptp uploads
+    and compiles the exposure script each time. With persistent_script the
+    script is started once in init() and stays on the camera with remote
+    capture enabled. A shot is a "putm shoot" message, the image is fetched
+    with capture_get_data and the JSON exposure result comes back as a
+    script message. Focus and zoom go through messages as well, the camera
+    runs a single script at a time.
+
+    With in_memory chdkptp writes every image into a named pipe in a
+    temporary directory. wait_file() returns as soon as the image is in
+    memory, image_data() gives consumers a memoryview of it and the file
+    in capture_path is written in the background. The last MAX_IMAGES
+    images stay in memory.
+
+    self.state mirrors mode, manual focus, focus distance and zoom as set
+    by successful commands. Settings which are already there aren't sent
+    again and get_zoom() is answered from it. The mirror is reset when
+    chdkptp is (re)started or has exited.
+    """
+
+    # Canon S100
+    VENDOR = 'Canon'
+    MODEL = 'PowerShot S100'
+    FOCAL_LENGTH = 5.2  # mm
+    SENSOR_SIZE = (7.6, 5.7)  # mm
+    RESOLUTION = (4000, 3000)  # px
+
+    COMMAND_TIMEOUT = 5.0
+    CONNECT_TIMEOUT = 10.0
+    SHOOT_TIMEOUT = 30.0
+    MAX_EXPOSURES = 100
+    MAX_IMAGES = 8
+    # print the next message of the persistent script, getm doesn't wait for one
+    READ_MESSAGE = "!print(con:wait_msg{{mtype='user',timeout={}}}.value)"
+
+    def __init__(self, capture_path=CAPTURE_PATH, chdkptp_root=CHDKPTP_ROOT, persistent_script=False,
+                 device=None, name=None, in_memory=False):
+        self.proc = None
+        self.channel = None
+        self.watcher = None
+        self.counter = 0
+        self.capture_path = pathlib.Path(capture_path)
+        self.chdkptp_root = chdkptp_root
+        self.persistent_script = persistent_script
+        self.script_file = None
+        self.exposures = collections.OrderedDict()  # image path: shoot() result
+        self.device = device  # chdkptp connect options, e.g. "-s=<serial>" or "-b=<bus> -d=<dev>"
+        self.name = name
+        self.in_memory = in_memory
+        self.stream_path = None
+        self.readers = {}  # image path: FifoReader
+        self.images = collections.OrderedDict()  # image path: memoryview
+        self.persisting = set()
+        self.state = CameraState()
+
+    def __str__(self):
+        return "Camera({})".format(self.name or self.device or self.chdkptp_root)
+
+    async def send_command(self, cmd, timeout=None):
+        response = await self.channel.call(cmd, timeout or self.COMMAND_TIMEOUT)
+        logger.info("Cmd: %s, ret: %s", cmd, response.text)
+        if not response.ok:
+            logger.warning("Cmd: %s, error: %s", cmd, ' '.join(response.errors))
+        return response
+
+    async def init(self):
+        await self.close()
+        self.state.invalidate()
+        self.capture_path.mkdir(parents=True, exist_ok=True)
+        # watch before the first shot, so that no completion is missed
+        self.watcher = file_watcher(self.capture_path)
+        if self.in_memory:
+            self.stream_path = pathlib.Path(tempfile.mkdtemp(prefix='lacmus_stream_'))
+        proc_cmd = '{}/chdkptp.sh -i'.format(self.chdkptp_root)
+        logger.info("Starting chkptp subprocess: %s", proc_cmd)
+        self.proc = await asyncio.create_subprocess_shell(
+            proc_cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+
+        logger.info("Chkptp subprocess started with pid: %s", self.proc.pid)
+        self.channel = ChdkptpChannel(self.proc)
+        try:
+            await self.send_command("set usb_reset_on_close=true")
+            connect = "connect {}".format(self.device) if self.device else "connect"
+            res = await self.send_command(connect, self.CONNECT_TIMEOUT)
+            if not res.text.startswith('connected: Canon'):
+                return False
+            if (await self.send_command("rec", self.CONNECT_TIMEOUT)).ok:
+                self.state.mode = 'rec'
+            await self.send_command("imrm", self.CONNECT_TIMEOUT)
+            if self.persistent_script:
+                await self.start_script()
+        except (asyncio.TimeoutError, CommandError) as e:
+            logger.error("Camera init failed: %r", e)
+            return False
+        logger.info("Camera init done")
+        return True
+
+    async def start_script(self):
+        with tempfile.NamedTemporaryFile('w', prefix='shoot_server_', suffix='.lua', delete=False) as f:
+            f.write(shoot_server_script())
+        self.script_file = pathlib.Path(f.name)
+        await self.send_command('lua <{}'.format(self.script_file))
+
+    async def camera_call(self, code, message):
+        """
+        Run Lua code on the camera, or ask the persistent script to
+        """
+        if self.channel is None or self.channel.closed:
+            self.state.invalidate()
+        if not self.persistent_script:
+            return await self.send_command('=' + code)
+        response = await self.send_command('putm ' + message)
+        if not code.startswith('return ') or not response.ok:
+            return response
+        return await self.send_command(self.READ_MESSAGE.format(int((self.COMMAND_TIMEOUT - 1) * 1000)))
+
+    async def close(self):
+        if self.script_file is not None:
+            if self.channel is not None and not self.channel.closed:
+                try:
+                    await self.send_command('putm quit')
+                except (asyncio.TimeoutError, CommandError) as e:
+                    logger.warning("Failed to stop the shooting script: %r", e)
+            self.script_file.unlink()
+            self.script_file = None
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        for reader in self.readers.values():
+            reader.close()
+        self.readers.clear()
+        if self.persisting:
+            await asyncio.wait(list(self.persisting))
+        if self.stream_path is not None:
+            shutil.rmtree(self.stream_path, ignore_errors=True)
+            self.stream_path = None
+        if self.channel is not None:
+            await self.channel.close()
+            self.channel = None
+        if self.proc is not None:
+            self.proc.stdin.close()
+            if self.proc.returncode is None:
+                self.proc.terminate()
+            await self.proc.wait()
+        self.proc = None
+
+    async def prepare(self, params):
+        """
+        Set focus mode and distance for the next shot
+        """
+        mf = 1 if params.get('focus_mode') == 'MF' else 0
+        if self.state.mf != mf:
+            if (await self.camera_call('set_mf({})'.format(mf), 'mf {}'.format(mf))).ok:
+                self.state.mf = mf
+            # the focus distance is unknown after a focus mode change
+            self.state.focus = None
+        focus_distance = params.get('focus_distance')
+        if mf and focus_distance and self.state.focus != focus_distance:
+            if (await self.camera_call('set_focus({})'.format(focus_distance), 'focus {}'.format(focus_distance))).ok:
+                self.state.focus = focus_distance
+
+    async def shoot(self, params, index=None, prepare=True):
+        """
+        Take a picture, return path of the JPEG file which the camera is
+        still writing at that moment. The file is numbered with index or
+        the camera's own counter, prepare=False skips the focus setup.
+        """
+        if index is None:
+            index = self.counter
+            self.counter += 1
+        fname = self.make_fname(index)
+        if prepare:
+            await self.prepare(params)
+
+        path = fname.with_suffix('.jpg')
+        if self.in_memory:
+            fname = self.stream_path / fname.name
+            self.readers[path] = FifoReader(fname.with_suffix('.jpg'))
+        if self.persistent_script:
+            await self.send_command('putm shoot')
+            # the script answers as soon as it has pressed shoot_full, the
+            # result is read before the image is fetched so that shoot()
+            # returns at the shutter release like in the rs mode
+            result = self.channel.submit(self.READ_MESSAGE.format(int(self.SHOOT_TIMEOUT * 1000)))
+            result.add_done_callback(lambda future: self.on_command_done('shoot result', path, future))
+            fetch = self.channel.submit(
+                "!con:capture_get_data(chdku.rc_init_std_handlers{{jpg=true,dst='{}'}})".format(fname))
+            fetch.add_done_callback(lambda future: self.on_command_done('capture_get_data', path, future))
+            await asyncio.wait([result], timeout=self.SHOOT_TIMEOUT)
+            return path
+
+        # rs returns when the image is downloaded, the shooting script
+        # prints its first line before that, when it releases the shutter
+        shot = asyncio.get_event_loop().create_future()
+
+        def on_line(line):
+            if not shot.done():
+                shot.set_result(line)
+
+        cmd = 'rs {} -script={}'.format(fname, SHOOT_SCRIPT_PATH)
+        done = self.channel.submit(cmd, on_line)
+        done.add_done_callback(lambda future: self.on_command_done(cmd, path, future))
+        await asyncio.wait([shot, done], timeout=self.SHOOT_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+        shot.cancel()
+        return path
+
+    def on_command_done(self, cmd, path, future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error("Cmd: %s failed: %r", cmd, future.exception())
+            return
+        response = future.result()
+        logger.info("Cmd: %s, ret: %s", cmd, response.text)
+        if not response.ok:
+            logger.warning("Cmd: %s, error: %s", cmd, ' '.join(response.errors))
+        exposure = parse_exposure(response.text)
+        if exposure is not None:
+            self.exposures[path] = exposure
+            if len(self.exposures) > self.MAX_EXPOSURES:
+                self.exposures.popitem(last=False)
+
+    async def wait_file(self, path, timeout=10):
+        """
+        Wait until chdkptp has written and closed the file, or in memory
+        mode until the image is received
+        """
+        reader = self.readers.pop(path, None)
+        if reader is not None:
+            return await self.receive(path, reader, timeout)
+        result = await self.watcher.wait(path, timeout)
+        if not result:
+            logger.warning("Image %s is not saved in %s s", path, timeout)
+        return result
+
+    async def receive(self, path, reader, timeout):
+        done, pending = await asyncio.wait([reader.future], timeout=timeout)
+        if pending:
+            reader.close()
+            logger.warning("Image %s is not received in %s s", path, timeout)
+            return False
+        if reader.future.exception() is not None:
+            logger.error("Failed to receive image %s: %r", path, reader.future.exception())
+            return False
+        data = reader.future.result()
+        self.images[path] = data
+        if len(self.images) > self.MAX_IMAGES:
+            self.images.popitem(last=False)
+        task = asyncio.get_event_loop().run_in_executor(None, write_file, path, data)
+        self.persisting.add(task)
+        task.add_done_callback(lambda future: self.on_persisted(path, future))
+        return True
+
+    def on_persisted(self, path, future):
+        self.persisting.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Failed to save image %s: %r", path, future.exception())
+
+    def image_data(self, path):
+        """
+        Image received in memory mode, None if it isn't kept in memory
+        """
+        return self.images.get(path)
+
+    async def capture(self, params):
+        path = await self.shoot(params)
+        await self.wait_file(path)
+        return path
+
+    async def set_zoom(self, value):
+        value = int(value)
+        if self.state.zoom == value:
+            return
+        self.state.zoom = None
+        if (await self.camera_call('set_zoom({})'.format(value), 'zoom {}'.format(value))).ok:
+            self.state.zoom = value
+
+    async def get_zoom(self):
+        """
+        Zoom step, None if it can't be read
+        """
+        if self.state.zoom is None:
+            self.state.zoom = zoom_step(await self.camera_call('return get_zoom()', 'get_zoom'))
+        return self.state.zoom
+
+    def make_fname(self, n):
+        if self.name:
+            return self.capture_path / 'image_{}_{}'.format(n, self.name)
+        fname = self.capture_path / 'image_{}'.format(n)
+        return fname
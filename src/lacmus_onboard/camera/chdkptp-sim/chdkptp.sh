@@ -0,0 +1,5 @@
+#!/bin/sh
+# simulated chdkptp, see lacmus_onboard/camera/simulator.py
+SIM_DIR="$(dirname "$(readlink -f "$0")")"
+export PYTHONPATH="$SIM_DIR/../../..${PYTHONPATH:+:$PYTHONPATH}"
+exec "${CHDKPTP_SIM_PYTHON:-python3}" -m lacmus_onboard.camera.simulator "$@"
@@ -0,0 +1,149 @@
+"""
+Framed, pipelined command channel to an interactive chdkptp process
+"""
+import asyncio
+import collections
+import itertools
+import logging
+import random
+import re
+
+logger = logging.getLogger(__name__)
+
+
+PROMPT = re.compile(r'^(?:(?:con(?: \d+)?|___)> )+')
+
+
+class CommandError(Exception):
+    pass
+
+
+class Response(collections.namedtuple('Response', ('lines', 'errors'))):
+    """
+    stdout and stderr lines of a command, prompts stripped
+    """
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    @property
+    def text(self):
+        return '\n'.join(self.lines)
+
+
+class PendingCommand:
+    __slots__ = ('id', 'cmd', 'future', 'on_line', 'lines', 'errors', 'stdout_done', 'stderr_done')
+
+    def __init__(self, id, cmd, future, on_line=None):
+        self.id = id
+        self.cmd = cmd
+        self.future = future
+        self.on_line = on_line
+        self.lines = []
+        self.errors = []
+        self.stdout_done = False
+        self.stderr_done = False
+
+    def __str__(self):
+        return "Command({}, {!r})".format(self.id, self.cmd)
+
+
+class ChdkptpChannel:
+    """
+    chdkptp executes stdin lines one after another, every command line is
+    followed by a marker line of local Lua which writes a unique
+    "<token> <id>" line to stdout and stderr when chdkptp gets to it. Reader
+    tasks assign output lines to the oldest unfinished command and resolve
+    its future with a Response once both markers arrived, so an unexpected
+    line can't shift the replies of later commands.
+
+    Any number of commands can be in flight. A command which timed out keeps
+    its place, its output is dropped when it eventually arrives.
+    """
+
+    MARKER = '!io.stdout:write("\\n{0}\\n") io.stdout:flush() io.stderr:write("{0}\\n") io.stderr:flush()'
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.token = '@@lacmus-{:08x}'.format(random.getrandbits(32))
+        self.ids = itertools.count(1)
+        self.stdout_queue = collections.deque()
+        self.stderr_queue = collections.deque()
+        self.closed = False
+        loop = asyncio.get_event_loop()
+        self.readers = [
+            loop.create_task(self.read(proc.stdout, self.stdout_queue, 'lines', 'stdout_done')),
+            loop.create_task(self.read(proc.stderr, self.stderr_queue, 'errors', 'stderr_done')),
+        ]
+
+    def __str__(self):
+        return "ChdkptpChannel(pid {}, {} in flight)".format(self.proc.pid, len(self.stdout_queue))
+
+    def submit(self, cmd, on_line=None):
+        """
+        Send the command, return the future of its Response. on_line(line)
+        is called for every stdout line as it arrives.
+        """
+        if self.closed:
+            raise CommandError("chdkptp has exited")
+        cmd = cmd.strip()
+        if '\n' in cmd:
+            raise ValueError("Multi-line command: {!r}".format(cmd))
+        command = PendingCommand(next(self.ids), cmd, asyncio.get_event_loop().create_future(), on_line)
+        self.stdout_queue.append(command)
+        self.stderr_queue.append(command)
+        marker = self.MARKER.format('{} {}'.format(self.token, command.id))
+        self.proc.stdin.write(cmd.encode() + b'\n' + marker.encode() + b'\n')
+        return command.future
+
+    async def call(self, cmd, timeout=None):
+        future = self.submit(cmd)
+        await self.proc.stdin.drain()
+        return await asyncio.wait_for(future, timeout)
+
+    async def read(self, stream, queue, field, done_flag):
+        while True:
+            data = await stream.readline()
+            if not data:
+                break
+            line = PROMPT.sub('', data.decode(errors='replace').rstrip('\r\n'))
+            if line.startswith(self.token):
+                command_id = int(line.split()[1])
+                while queue and queue[0].id <= command_id:
+                    command = queue.popleft()
+                    setattr(command, done_flag, True)
+                    self.finish(command)
+                continue
+            if not line:
+                continue
+            if not queue:
+                logger.debug("Unsolicited chdkptp output: %s", line)
+                continue
+            command = queue[0]
+            getattr(command, field).append(line)
+            if field == 'lines' and command.on_line is not None and not command.future.done():
+                try:
+                    command.on_line(line)
+                except Exception as e:
+                    logger.exception("%s line callback error: %s", command, e)
+        self.closed = True
+        for command in list(queue):
+            if not command.future.done():
+                command.future.set_exception(CommandError("chdkptp has exited"))
+        queue.clear()
+
+    def finish(self, command):
+        if not (command.stdout_done and command.stderr_done):
+            return
+        if command.future.done():
+            logger.debug("%s finished after its timeout", command)
+            return
+        command.future.set_result(Response(command.lines, command.errors))
+
+    async def close(self):
+        for reader in self.readers:
+            reader.cancel()
+        await asyncio.wait(self.readers)
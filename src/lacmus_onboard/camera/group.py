@@ -0,0 +1,134 @@
+"""
+Several CHDK cameras triggered together
+"""
+import asyncio
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+CaptureSet = collections.namedtuple('CaptureSet', ('index', 'paths', 'skew'))  # paths: camera name -> path or None
+
+
+class CameraGroup:
+    """
+    Cameras with a chdkptp process each, used as one camera.
+
+    A shot sets the focus of all cameras first and then sends the shoot
+    commands to all channels in the same event loop iteration, so the
+    shutters are released together within the USB latency. The files share
+    the capture index: image_<index>_<name>.jpg. Downloads run in parallel,
+    one per process. shoot() returns the path of the primary (first)
+    camera and wait_file() waits for the whole set, so the group can stand
+    in for a Camera in CameraServer. The sets of the last MAX_CAPTURES
+    shots are kept in self.captures by primary path.
+    """
+
+    MAX_CAPTURES = 1000
+
+    def __init__(self, cameras):
+        self.cameras = list(cameras)
+        if not self.cameras:
+            raise ValueError("Camera group is empty")
+        names = [camera.name for camera in self.cameras]
+        if None in names or len(set(names)) != len(names):
+            raise ValueError("Cameras of a group need unique names: {}".format(names))
+        self.primary = self.cameras[0]
+        self.counter = 0
+        self.captures = collections.OrderedDict()
+
+    def __str__(self):
+        return "CameraGroup({})".format(', '.join(camera.name for camera in self.cameras))
+
+    @property
+    def VENDOR(self):
+        return self.primary.VENDOR
+
+    @property
+    def MODEL(self):
+        return self.primary.MODEL
+
+    @property
+    def FOCAL_LENGTH(self):
+        return self.primary.FOCAL_LENGTH
+
+    @property
+    def SENSOR_SIZE(self):
+        return self.primary.SENSOR_SIZE
+
+    @property
+    def RESOLUTION(self):
+        return self.primary.RESOLUTION
+
+    @property
+    def capture_path(self):
+        return self.primary.capture_path
+
+    async def init(self):
+        results = await asyncio.gather(*(camera.init() for camera in self.cameras))
+        failed = [camera.name for camera, result in zip(self.cameras, results) if not result]
+        if failed:
+            logger.error("%s init failed: %s", self, ', '.join(failed))
+        return not failed
+
+    async def close(self):
+        await asyncio.gather(*(camera.close() for camera in self.cameras))
+
+    async def shoot(self, params):
+        index = self.counter
+        self.counter += 1
+        await asyncio.gather(*(camera.prepare(params) for camera in self.cameras))
+        loop = asyncio.get_event_loop()
+        shot_times = {}
+
+        async def shoot(camera):
+            path = await camera.shoot(params, index, prepare=False)
+            shot_times[camera.name] = loop.time()
+            return path
+
+        results = await asyncio.gather(*(shoot(camera) for camera in self.cameras), return_exceptions=True)
+        paths = {}
+        for camera, result in zip(self.cameras, results):
+            if isinstance(result, Exception):
+                logger.error("%s capture %s failed: %r", camera, index, result)
+                result = None
+            paths[camera.name] = result
+        skew = max(shot_times.values()) - min(shot_times.values()) if shot_times else 0
+        capture = CaptureSet(index, paths, skew)
+        logger.info("Capture %s: %s cameras, skew %.3f s", index, len(shot_times), skew)
+        primary = paths[self.primary.name]
+        if primary is None:
+            raise results[0]
+        self.captures[primary] = capture
+        if len(self.captures) > self.MAX_CAPTURES:
+            self.captures.popitem(last=False)
+        return primary
+
+    async def wait_file(self, path, timeout=10):
+        """
+        Wait for all files of the capture set, return whether the primary
+        image is saved
+        """
+        capture = self.captures.get(path)
+        if capture is None:
+            return await self.primary.wait_file(path, timeout)
+        cameras = [camera for camera in self.cameras if capture.paths[camera.name] is not None]
+        results = await asyncio.gather(*(camera.wait_file(capture.paths[camera.name], timeout)
+                                         for camera in cameras))
+        saved = dict(zip((camera.name for camera in cameras), results))
+        if len(saved) < len(self.cameras) or not all(results):
+            logger.warning("Capture %s is incomplete: %s", capture.index, saved)
+        return saved.get(self.primary.name, False)
+
+    def image_data(self, path):
+        for camera in self.cameras:
+            data = camera.image_data(path)
+            if data is not None:
+                return data
+        return None
+
+    async def capture(self, params):
+        path = await self.shoot(params)
+        await self.wait_file(path)
+        return self.captures.get(path)
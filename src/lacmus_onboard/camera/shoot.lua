@@ -116,50 +116,57 @@ function wait_timeout(func , state, interval, delay, msg)
 end
 
 
-set_prop(props.FLASH_MODE, 2)                                  -- disable built-in flash
-set_prop(props.AF_ASSIST_BEAM,0)                               -- AF assist off if supported for this camera
-
--- check exposure if not taking bracketing shots
-bracket_offset = 0
-press("shoot_half")
-wait_timeout(get_shooting, true, 2000, 50, "Warning : unable to focus / set exposure")
-bv96raw=get_bv96()                              -- get meter reading values
-tv96meter=get_tv96()
-av96meter=get_av96()
-sv96meter=get_sv96()
-
-bv96meter=bv96raw-ec96adjust+bracket_offset         -- add in exposure compensation & bracketing offset
-
--- set minimum Av to larger of user input or current minimum for zoom setting
-av96min= math.max(av96minimum, get_prop(props.MIN_AV))
-if (av96target < av96min) then av96target = av96min end
-
--- calculate required setting for current ambient light conditions
-
-exposure_both()
-
-
--- set up all exposure overrides
-set_tv96_direct(tv96setpoint)
-set_sv96(sv96setpoint)
-if( av96setpoint ~= nil) then set_av96_direct(av96setpoint) end
+-- take a picture with the calculated exposure, return it as JSON
+function shoot()
+    set_prop(props.FLASH_MODE, 2)                                  -- disable built-in flash
+    set_prop(props.AF_ASSIST_BEAM,0)                               -- AF assist off if supported for this camera
+
+    -- check exposure if not taking bracketing shots
+    bracket_offset = 0
+    press("shoot_half")
+    wait_timeout(get_shooting, true, 2000, 50, "Warning : unable to focus / set exposure")
+    bv96raw=get_bv96()                              -- get meter reading values
+    tv96meter=get_tv96()
+    av96meter=get_av96()
+    sv96meter=get_sv96()
+
+    bv96meter=bv96raw-ec96adjust+bracket_offset         -- add in exposure compensation & bracketing offset
+
+    -- set minimum Av to larger of user input or current minimum for zoom setting
+    av96min= math.max(av96minimum, get_prop(props.MIN_AV))
+    if (av96target < av96min) then av96target = av96min end
+
+    -- calculate required setting for current ambient light conditions
+
+    exposure_both()
+
+
+    -- set up all exposure overrides
+    set_tv96_direct(tv96setpoint)
+    set_sv96(sv96setpoint)
+    if( av96setpoint ~= nil) then set_av96_direct(av96setpoint) end
+
+    if (insert_ND_filter == true) then         -- ND filter available and needed?
+        set_nd_filter(1)                                        -- activate the ND filter
+        nd_string="NDin"
+    else
+        set_nd_filter(2)                                        -- make sure the ND filter does not activate
+        nd_string="NDout"
+    end
 
-if (insert_ND_filter == true) then         -- ND filter available and needed?
-    set_nd_filter(1)                                        -- activate the ND filter
-    nd_string="NDin"
-else
-    set_nd_filter(2)                                        -- make sure the ND filter does not activate
-    nd_string="NDout"
+    print("Tv ", tv96setpoint)
+    -- shoot !!
+    -- ecnt=get_exp_count()
+    -- hook_shoot.set(10000)                                           -- set the hook just before shutter release for timing
+    press('shoot_full')                                             -- and finally shoot the image
+    -- wait_timeout(hook_shoot.is_ready, true, 2000, 10, "timeout on hook_shoot.is_ready")  -- wait until the hook is reached
+    retval = {}
+    retval["status"] = 1
+    retval["tv"] = tv96setpoint
+    retval["av"] = av96setpoint
+    retval["sv"] = sv96setpoint
+    return to_json(retval)
 end
 
-print("Tv ", tv96setpoint)
--- shoot !!
--- ecnt=get_exp_count()
--- hook_shoot.set(10000)                                           -- set the hook just before shutter release for timing
-press('shoot_full')                                             -- and finally shoot the image
--- wait_timeout(hook_shoot.is_ready, true, 2000, 10, "timeout on hook_shoot.is_ready")  -- wait until the hook is reached
-retval = {}
-retval["status"] = 1
-retval["tv"] = tv96setpoint
-retval["av"] = av96setpoint
-return to_json(retval)
\ No newline at end of file
+
+return shoot()
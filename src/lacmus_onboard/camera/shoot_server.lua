@@ -0,0 +1,41 @@
+--[[
+Persistent shooting script: appended to shoot.lua in place of its final
+"return shoot()" and started once. Remote capture stays initialised and
+requests come as messages:
+  shoot           take a picture, answer with the JSON result of shoot()
+  mf <0|1>        set_mf
+  focus <mm>      set_focus
+  zoom <step>     set_zoom
+  get_zoom        answer with get_zoom()
+  quit            end the script
+]]
+
+init_usb_capture(1, 0, 0)                                          -- JPEG only
+
+while true do
+    local msg = read_usb_msg(1000)
+    local cmd, arg
+    if msg ~= nil then
+        cmd, arg = string.match(msg, "^(%S+)%s*(.*)$")
+    end
+    if cmd == "shoot" then
+        local result = shoot()
+        release("shoot_full")
+        release("shoot_half")
+        write_usb_msg(result)
+        wait_timeout(get_shooting, false, 5000, 10, "Warning : shot is not finished")
+    elseif cmd == "mf" then
+        set_mf(tonumber(arg))
+    elseif cmd == "focus" then
+        set_focus(tonumber(arg))
+    elseif cmd == "zoom" then
+        set_zoom(tonumber(arg))
+    elseif cmd == "get_zoom" then
+        write_usb_msg(get_zoom())
+    elseif cmd == "quit" then
+        break
+    end
+end
+
+init_usb_capture(0)
+return "quit"
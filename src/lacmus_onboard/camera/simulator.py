@@ -0,0 +1,246 @@
+"""
+Stand-in for interactive chdkptp and a CHDK camera, for tests and benchmarks
+without a Canon S100 on USB.
+
+Speaks the stdin/stdout dialogue of Camera and ChdkptpChannel: prompts,
+connect, rec, imrm, =set_zoom and friends, rs with the shooting script,
+the persistent script messages, capture_get_data and the local Lua
+markers. Images are copied from a directory in turn, or a minimal JPEG is
+written. Latencies and the failure rate are options, which default to
+CHDKPTP_SIM_* environment variables so that a Camera started with
+chdkptp_root=SIMULATOR_ROOT (or CHDKPTP_BASE_PATH pointing at it) can be
+configured from outside:
+
+    CHDKPTP_SIM_IMAGES         directory with JPEGs to return
+    CHDKPTP_SIM_COMMAND_TIME   seconds per camera command (0.01)
+    CHDKPTP_SIM_SCRIPT_TIME    seconds to upload and start a camera script (0.2)
+    CHDKPTP_SIM_SHOOT_TIME     seconds from trigger to the released shutter (0.3)
+    CHDKPTP_SIM_DOWNLOAD_TIME  seconds to download an image (0.5)
+    CHDKPTP_SIM_FAIL_RATE      probability that a shot or download fails (0)
+    CHDKPTP_SIM_SEED           random seed of the failures
+"""
+import argparse
+import json
+import os
+import pathlib
+import random
+import re
+import sys
+import time
+
+MINIMAL_JPEG = b'\xff\xd8\xff\xd9'
+CONNECTED = 'connected: Canon PowerShot S100, max packet size 512'
+EXPOSURE = {'status': 1, 'tv': 960, 'av': 347, 'sv': 411, 'bv': 500, 'tv96target': 960, 'av96target': 347}
+
+LOCAL_WRITE = re.compile(r'io\.(stdout|stderr):write\("(.*?)"\)')
+DESTINATION = re.compile(r"dst='(.*?)'")
+WAIT_MSG_TIMEOUT = re.compile(r'timeout=(\d+)')
+
+
+class Simulator:
+    """
+    One chdkptp session, reads commands from stdin until EOF
+    """
+
+    def __init__(self, images=None, command_time=0.01, script_time=0.2, shoot_time=0.3, download_time=0.5,
+                 fail_rate=0, seed=None, stdin=sys.stdin, stdout=sys.stdout, stderr=sys.stderr):
+        self.images = sorted(pathlib.Path(images).glob('*.[jJ][pP][gG]')) if images else []
+        self.command_time = command_time
+        self.script_time = script_time
+        self.shoot_time = shoot_time
+        self.download_time = download_time
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr = stderr
+        self.connected = False
+        self.mode = 'play'
+        self.zoom = 0
+        self.mf = 0
+        self.focus = 0
+        self.script = None
+        self.messages = []  # (time the message is ready, text) from the running script
+        self.pending_shots = []  # time each shot of the running script is downloadable
+        self.shots = 0
+
+    def run(self):
+        while True:
+            self.stdout.write('con> ' if self.connected else '___> ')
+            self.stdout.flush()
+            line = self.stdin.readline()
+            if not line:
+                break
+            line = line.strip()
+            if line:
+                self.handle(line)
+            self.stdout.flush()
+            self.stderr.flush()
+
+    def print(self, text):
+        self.stdout.write(text + '\n')
+
+    def error(self, text):
+        self.stderr.write('ERROR: {}\n'.format(text))
+
+    def failed(self):
+        return self.random.random() < self.fail_rate
+
+    def camera_command(self):
+        if not self.connected:
+            self.error('not connected')
+            return False
+        time.sleep(self.command_time)
+        return True
+
+    def handle(self, line):
+        if line.startswith('!'):
+            self.local_lua(line[1:])
+        elif line.startswith('='):
+            self.remote_lua(line[1:])
+        else:
+            cmd, _, args = line.partition(' ')
+            handler = getattr(self, 'cmd_' + cmd, None)
+            if handler is None:
+                self.error('unknown command {}'.format(cmd))
+            else:
+                handler(args.strip())
+
+    def local_lua(self, code):
+        if code.startswith('con:capture_get_data'):
+            self.capture_get_data(DESTINATION.search(code).group(1))
+        elif code.startswith('print(con:wait_msg'):
+            match = WAIT_MSG_TIMEOUT.search(code)
+            self.wait_msg(int(match.group(1)) / 1000 if match else 0)
+        else:
+            for stream, text in LOCAL_WRITE.findall(code):
+                getattr(self, stream).write(text.replace('\\n', '\n'))
+                getattr(self, stream).flush()
+
+    def remote_lua(self, code):
+        if not self.camera_command():
+            return
+        match = re.match(r'(?:return )?(\w+)\((.*)\)$', code)
+        name, arg = match.groups() if match else (None, '')
+        if name == 'get_zoom':
+            self.print('1:return:{}'.format(self.zoom))
+        elif name in ('set_zoom', 'set_mf', 'set_focus'):
+            setattr(self, name[4:], int(float(arg)))
+
+    def cmd_set(self, args):
+        pass
+
+    def cmd_connect(self, args):
+        time.sleep(self.command_time)
+        self.connected = True
+        self.print(CONNECTED)
+
+    def cmd_rec(self, args):
+        if self.camera_command():
+            self.mode = 'rec'
+
+    def cmd_play(self, args):
+        if self.camera_command():
+            self.mode = 'play'
+
+    def cmd_imrm(self, args):
+        self.camera_command()
+
+    def cmd_rs(self, args):
+        if not self.camera_command():
+            return
+        if self.mode != 'rec':
+            self.error('not in rec mode')
+            return
+        dst = args.split()[0] if args and not args.startswith('-') else 'IMG_{:04d}'.format(self.shots)
+        time.sleep(self.script_time + self.shoot_time)
+        if self.failed():
+            self.error('remote shoot failed')
+            return
+        self.print(self.exposure_line())
+        self.stdout.flush()
+        time.sleep(self.download_time)
+        self.save_image(dst)
+
+    def cmd_lua(self, args):
+        if not self.camera_command():
+            return
+        if not args.startswith('<'):
+            self.error('expected lua <file')
+            return
+        self.script = pathlib.Path(args[1:].strip()).read_text()
+        time.sleep(self.script_time)
+        self.messages = []
+        self.pending_shots = []
+
+    def cmd_putm(self, args):
+        if not self.camera_command():
+            return
+        if self.script is None:
+            self.error('no script running')
+            return
+        cmd, _, arg = args.partition(' ')
+        now = time.monotonic()
+        if cmd == 'shoot':
+            ready = now + self.shoot_time
+            self.pending_shots.append(ready)
+            self.messages.append((ready, self.exposure_line()))
+        elif cmd == 'get_zoom':
+            self.messages.append((now, str(self.zoom)))
+        elif cmd in ('zoom', 'mf', 'focus'):
+            setattr(self, cmd, int(float(arg)))
+        elif cmd == 'quit':
+            self.script = None
+
+    def capture_get_data(self, dst):
+        if not self.pending_shots:
+            self.error('timeout waiting for capture data')
+            return
+        ready = self.pending_shots.pop(0)
+        time.sleep(max(0, ready - time.monotonic()) + self.download_time)
+        if self.failed():
+            self.error('capture data transfer failed')
+            return
+        self.save_image(dst)
+
+    def wait_msg(self, timeout):
+        if not self.messages:
+            time.sleep(timeout)
+            self.error('timed out waiting for message')
+            return
+        ready, text = self.messages.pop(0)
+        time.sleep(max(0, ready - time.monotonic()))
+        self.print(text)
+
+    def exposure_line(self):
+        return json.dumps(dict(EXPOSURE, zoom=self.zoom, mf=self.mf, focus=self.focus))
+
+    def save_image(self, dst):
+        data = self.images[self.shots % len(self.images)].read_bytes() if self.images else MINIMAL_JPEG
+        self.shots += 1
+        with open(dst + '.jpg', 'wb') as f:
+            f.write(data)
+
+
+def env(name, default, type=float):
+    value = os.environ.get('CHDKPTP_SIM_' + name)
+    return default if value in (None, '') else type(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulated chdkptp with a CHDK camera')
+    parser.add_argument('-i', action='store_true', help='Interactive mode, the only one there is')
+    parser.add_argument('--images', default=env('IMAGES', None, str), help='Directory with JPEGs to return')
+    parser.add_argument('--command-time', type=float, default=env('COMMAND_TIME', 0.01))
+    parser.add_argument('--script-time', type=float, default=env('SCRIPT_TIME', 0.2))
+    parser.add_argument('--shoot-time', type=float, default=env('SHOOT_TIME', 0.3))
+    parser.add_argument('--download-time', type=float, default=env('DOWNLOAD_TIME', 0.5))
+    parser.add_argument('--fail-rate', type=float, default=env('FAIL_RATE', 0))
+    parser.add_argument('--seed', type=int, default=env('SEED', None, int))
+    args = parser.parse_args(argv)
+    Simulator(args.images, args.command_time, args.script_time, args.shoot_time, args.download_time, args.fail_rate,
+              args.seed).run()
+
+
+if __name__ == '__main__':
+    main()
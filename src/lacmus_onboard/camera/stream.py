@@ -0,0 +1,84 @@
+"""
+In-memory capture: chdkptp writes the image into a named pipe, the service
+reads it into a buffer which consumers share, the file on disk is written
+in the background
+"""
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class FifoReader:
+    """
+    Reads one image from a named pipe with the event loop.
+
+    The pipe is created and opened before chdkptp is asked for the image.
+    A non-blocking read end of a FIFO isn't readable until a writer has
+    connected, so the reader just waits for the data and EOF. The bytes go
+    straight into a growing bytearray with readv, the result is a
+    memoryview of it.
+    """
+
+    INITIAL_SIZE = 1 << 20
+
+    def __init__(self, path, loop=None):
+        self.path = path
+        self.loop = loop or asyncio.get_event_loop()
+        self.buffer = bytearray(self.INITIAL_SIZE)
+        self.size = 0
+        self.future = self.loop.create_future()
+        os.mkfifo(path)
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self.loop.add_reader(self.fd, self.on_readable)
+
+    def __str__(self):
+        return "FifoReader({}, {} bytes)".format(self.path, self.size)
+
+    def on_readable(self):
+        if self.size == len(self.buffer):
+            self.buffer.extend(bytes(len(self.buffer)))
+        try:
+            with memoryview(self.buffer) as view:
+                n = os.readv(self.fd, [view[self.size:]])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.finish(e)
+            return
+        if not n:
+            self.finish()
+        self.size += n
+
+    def finish(self, exc=None):
+        if exc is not None:
+            self.future.set_exception(exc)
+        else:
+            del self.buffer[self.size:]
+            self.future.set_result(memoryview(self.buffer))
+        self.close()
+
+    def close(self):
+        if self.fd is None:
+            return
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        if not self.future.done():
+            self.future.cancel()
+
+
+def write_file(path, data):
+    """
+    Write data next to path and rename it into place, readers of the
+    capture directory never see a partial image
+    """
+    tmp = path.with_name(path.name + '.part')
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
@@ -0,0 +1,154 @@
+"""
+Capture completion: wait until chdkptp has written and closed an image file
+"""
+import asyncio
+import collections
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+import struct
+
+logger = logging.getLogger(__name__)
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class InotifyWatcher:
+    """
+    Watches a directory with Linux inotify through ctypes and the event loop.
+
+    A file is complete on IN_CLOSE_WRITE (or IN_MOVED_TO if it is renamed
+    into place). Names completed since the watcher was started are
+    remembered, so a file finished before wait() is called isn't missed,
+    while a stale file of the same name from an earlier run is.
+    """
+
+    MAX_COMPLETED = 1000
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self.loop = asyncio.get_event_loop()
+        self.completed = collections.OrderedDict()
+        self.waiters = collections.defaultdict(list)
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno), str(self.directory))
+        self.loop.add_reader(self.fd, self.on_readable)
+
+    def __str__(self):
+        return "InotifyWatcher({})".format(self.directory)
+
+    def on_readable(self):
+        try:
+            data = os.read(self.fd, self.READ_SIZE)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, size = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + size].rstrip(b'\0'))
+            offset += size
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("%s event queue overflow", self)
+                self.check_waiters()
+            elif name:
+                self.complete(name)
+
+    def complete(self, name):
+        self.completed[name] = True
+        self.completed.move_to_end(name)
+        if len(self.completed) > self.MAX_COMPLETED:
+            self.completed.popitem(last=False)
+        for waiter in self.waiters.pop(name, ()):
+            if not waiter.done():
+                waiter.set_result(True)
+
+    def check_waiters(self):
+        # events were lost, trust files which are there
+        for name in list(self.waiters):
+            if (self.directory / name).exists():
+                self.complete(name)
+
+    async def wait(self, path, timeout):
+        path = pathlib.Path(path)
+        if path.parent != self.directory:
+            raise ValueError("{} is not in {}".format(path, self.directory))
+        if path.name in self.completed:
+            return True
+        waiter = self.loop.create_future()
+        self.waiters[path.name].append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self.waiters.get(path.name)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self.waiters[path.name]
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+
+class PollingWatcher:
+    """
+    Fallback without inotify: a file is complete once it exists and its size
+    stopped changing between two polls
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+
+    def __str__(self):
+        return "PollingWatcher({})".format(self.directory)
+
+    async def wait(self, path, timeout):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        size = None
+        while True:
+            try:
+                current = os.stat(path).st_size
+            except FileNotFoundError:
+                current = None
+            if current is not None and current == size:
+                return True
+            size = current
+            if loop.time() >= deadline:
+                return False
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    def close(self):
+        pass
+
+
+def file_watcher(directory):
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        logger.warning("inotify is not available (%s), polling %s", e, directory)
+        return PollingWatcher(directory)
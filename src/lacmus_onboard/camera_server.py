@@ -0,0 +1,334 @@
+import asyncio
+import collections
+import logging
+import math
+import shutil
+import time
+
+from .mavlink.dialects import lacmus as mavlink2
+
+logger = logging.getLogger(__name__)
+
+
+EARTH_RADIUS = 6371000  # m
+
+# data: the JPEG received in memory mode, None otherwise; the file at path may still be being written then
+CapturedImage = collections.namedtuple('CapturedImage', ('index', 'path', 'file_url', 'pose', 'result', 'data'))
+
+
+def fixed_bytes(value, size):
+    """
+    uint8_t[] MAVLink field from a string
+    """
+    data = value.encode()[:size]
+    return list(data) + [0] * (size - len(data))
+
+
+def ground_distance(a, b):
+    """
+    Distance in metres between poses with lat/lon in degE7, equirectangular
+    approximation which is good enough for trigger distances
+    """
+    lat_a, lat_b = math.radians(a['lat'] / 1e7), math.radians(b['lat'] / 1e7)
+    x = math.radians((b['lon'] - a['lon']) / 1e7) * math.cos((lat_a + lat_b) / 2)
+    y = lat_b - lat_a
+    return EARTH_RADIUS * math.hypot(x, y)
+
+
+class CaptureStats:
+    """
+    Achieved interval, jitter and missed triggers of a capture series
+    """
+
+    __slots__ = ('target', 'unit', 'shots', 'missed', 'first', 'last', 'sum', 'sum_squares')
+
+    def __init__(self, target, unit='s'):
+        self.target = target
+        self.unit = unit
+        self.shots = 0
+        self.missed = 0
+        self.first = None
+        self.last = None
+        self.sum = 0
+        self.sum_squares = 0
+
+    def __str__(self):
+        return "CaptureStats({} shots every {} {}, interval {:.3f} s, jitter {:.3f} s, {} missed)".format(
+            self.shots, self.target, self.unit, self.interval, self.jitter, self.missed)
+
+    def add(self, t):
+        if self.last is None:
+            self.first = t
+        else:
+            interval = t - self.last
+            self.sum += interval
+            self.sum_squares += interval * interval
+        self.last = t
+        self.shots += 1
+
+    @property
+    def interval(self):
+        """
+        Mean time between shots
+        """
+        return self.sum / (self.shots - 1) if self.shots > 1 else 0
+
+    @property
+    def jitter(self):
+        """
+        Standard deviation of the time between shots
+        """
+        if self.shots < 3:
+            return 0
+        n = self.shots - 1
+        return math.sqrt(max(0, self.sum_squares / n - (self.sum / n) ** 2))
+
+
+class CameraServer:
+    """
+    MAVLink camera protocol on top of the CHDK Camera.
+
+    Interval captures are pipelined: as soon as the camera has taken a shot
+    the next one is scheduled, while the previous JPEG is still being written
+    and reported in the background. Besides the time interval of
+    IMAGE_START_CAPTURE the camera can be triggered every trigger distance
+    metres of MAV_CMD_DO_SET_CAM_TRIGG_DIST, the position is polled from
+    pose_at. A trigger which comes while the camera is still busy with the
+    previous shot is missed, stats of the series are kept in self.stats.
+    """
+
+    CAMERA_ID = 1
+    MAX_CAPTURED = 1000
+    DISTANCE_POLL_INTERVAL = 0.05
+
+    def __init__(self, mav, camera, pose_at, time_boot_ms):
+        self.mav = mav
+        self.camera = camera
+        self.pose_at = pose_at
+        self.time_boot_ms = time_boot_ms
+        self.image_count = 0
+        self.interval = 0
+        self.trigger_distance = 0
+        self.interval_task = None
+        self.stats = None
+        self.shooting = False
+        self.lock = asyncio.Lock()
+        self.triggers = set()
+        self.saving = set()
+        self.last_sequence = None
+        self.captured = collections.OrderedDict()
+        self.listeners = []
+
+    def __str__(self):
+        return "CameraServer({})".format(self.camera)
+
+    def add_listener(self, listener):
+        """
+        listener(image) is called for every saved image
+        """
+        self.listeners.append(listener)
+
+    def register(self, scheduler, commands):
+        scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_CAMERA_INFORMATION, self.camera_information_message)
+        scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_CAMERA_SETTINGS, self.camera_settings_message)
+        scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS, self.camera_capture_status_message)
+        commands.register(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, self.on_start_capture, long_running=True)
+        commands.register(mavlink2.MAV_CMD_IMAGE_STOP_CAPTURE, self.on_stop_capture, idempotent=True)
+        commands.register(mavlink2.MAV_CMD_DO_SET_CAM_TRIGG_DIST, self.on_set_trigger_distance, long_running=True)
+        commands.register(mavlink2.MAV_CMD_REQUEST_CAMERA_IMAGE_CAPTURE, self.on_request_image, idempotent=True)
+        commands.register(mavlink2.MAV_CMD_REQUEST_CAMERA_INFORMATION,
+                          lambda cmd: scheduler.request(mavlink2.MAVLINK_MSG_ID_CAMERA_INFORMATION), idempotent=True)
+        commands.register(mavlink2.MAV_CMD_REQUEST_CAMERA_SETTINGS,
+                          lambda cmd: scheduler.request(mavlink2.MAVLINK_MSG_ID_CAMERA_SETTINGS), idempotent=True)
+        commands.register(mavlink2.MAV_CMD_REQUEST_CAMERA_CAPTURE_STATUS,
+                          lambda cmd: scheduler.request(mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS), idempotent=True)
+
+    def camera_information_message(self):
+        camera = self.camera
+        return self.mav.camera_information_encode(
+            self.time_boot_ms(), fixed_bytes(camera.VENDOR, 32), fixed_bytes(camera.MODEL, 32), 0,
+            camera.FOCAL_LENGTH, camera.SENSOR_SIZE[0], camera.SENSOR_SIZE[1],
+            camera.RESOLUTION[0], camera.RESOLUTION[1], 0, mavlink2.CAMERA_CAP_FLAGS_CAPTURE_IMAGE, 0, b'')
+
+    def camera_settings_message(self):
+        return self.mav.camera_settings_encode(self.time_boot_ms(), mavlink2.CAMERA_MODE_IMAGE,
+                                               math.nan, math.nan)
+
+    def camera_capture_status_message(self):
+        # 0: idle, 1: capture in progress, 2: interval set but idle, 3: interval set and capture in progress
+        image_status = int(self.shooting) | (2 if self.interval_task is not None else 0)
+        available_capacity = shutil.disk_usage(self.camera.capture_path).free / 2 ** 20
+        return self.mav.camera_capture_status_encode(self.time_boot_ms(), image_status, 0, self.interval, 0,
+                                                     available_capacity, self.image_count)
+
+    async def on_start_capture(self, cmd):
+        interval, count, sequence = cmd.params[1], int(cmd.params[2]), int(cmd.params[3])
+        if self.interval_task is not None:
+            return mavlink2.MAV_RESULT_TEMPORARILY_REJECTED
+        if count == 1:
+            if sequence and sequence == self.last_sequence:
+                logger.info("Capture sequence %s is already done", sequence)
+                return mavlink2.MAV_RESULT_ACCEPTED
+            self.last_sequence = sequence
+            image = await self.capture()
+            return mavlink2.MAV_RESULT_ACCEPTED if image.result else mavlink2.MAV_RESULT_FAILED
+        if not interval > 0:
+            return mavlink2.MAV_RESULT_DENIED
+        self.interval = interval
+        self.interval_task = asyncio.ensure_future(self.run_interval(interval, count))
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    async def on_set_trigger_distance(self, cmd):
+        distance, trigger_once = cmd.params[0], int(cmd.params[2])
+        if distance < 0:
+            return mavlink2.MAV_RESULT_DENIED
+        if self.interval_task is not None:
+            if not self.trigger_distance:
+                return mavlink2.MAV_RESULT_TEMPORARILY_REJECTED
+            await self.stop_interval()
+        if trigger_once:
+            await self.shoot()
+        if distance > 0:
+            self.trigger_distance = distance
+            self.interval_task = asyncio.ensure_future(self.run_distance(distance))
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    async def on_stop_capture(self, cmd):
+        await self.stop_interval()
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    def on_request_image(self, cmd):
+        image = self.captured.get(int(cmd.params[0]))
+        if image is None:
+            return mavlink2.MAV_RESULT_DENIED
+        self.send_captured(image)
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    async def stop_interval(self):
+        task, self.interval_task = self.interval_task, None
+        self.interval = 0
+        self.trigger_distance = 0
+        if task is not None:
+            task.cancel()
+            await asyncio.wait([task])
+
+    async def shoot(self, params=None):
+        """
+        Take a picture and return the task which waits for the image file
+        """
+        async with self.lock:
+            index = self.image_count
+            self.image_count += 1
+            self.shooting = True
+            try:
+                path = await self.camera.shoot(params or {})
+            except Exception as e:
+                logger.exception("Capture %s failed: %s", index, e)
+                path = None
+            finally:
+                self.shooting = False
+            # the shutter is released when camera.shoot() returns
+            shutter_usec = int(time.time() * 1e6)
+        task = asyncio.ensure_future(self.save(index, path, shutter_usec))
+        self.saving.add(task)
+        task.add_done_callback(self.saving.discard)
+        return task
+
+    async def save(self, index, path, shutter_usec):
+        result = path is not None and await self.camera.wait_file(path)
+        # by now telemetry newer than the shutter time has come in, the pose is interpolated
+        pose = self.pose_at(shutter_usec)
+        file_url = '/captures/{}'.format(path.name) if path is not None else ''
+        data = self.camera.image_data(path) if result else None
+        image = CapturedImage(index, path, file_url, pose, result, data)
+        self.captured[index] = image
+        if len(self.captured) > self.MAX_CAPTURED:
+            self.captured.popitem(last=False)
+        self.send_captured(image)
+        if result:
+            for listener in self.listeners:
+                try:
+                    listener(image)
+                except Exception as e:
+                    logger.exception("Capture listener error: %s", e)
+        return image
+
+    def trigger(self):
+        """
+        Take a picture without waiting for it, e.g. on CAMERA_TRIGGER from the autopilot
+        """
+        task = asyncio.ensure_future(self.shoot())
+        self.triggers.add(task)
+        task.add_done_callback(self.triggers.discard)
+
+    async def capture(self, params=None):
+        return await (await self.shoot(params))
+
+    async def run_interval(self, interval, count):
+        logger.info("Start interval capture: %s s, %s images", interval, count or 'unlimited')
+        loop = asyncio.get_event_loop()
+        stats = self.stats = CaptureStats(interval)
+        next_shot = loop.time()
+        try:
+            while True:
+                stats.add(loop.time())
+                await self.shoot()
+                if count and stats.shots >= count:
+                    break
+                next_shot += interval
+                delay = next_shot - loop.time()
+                if delay < 0:
+                    missed = int(-delay // interval)
+                    logger.warning("Capture interval %s s is too short, %.2f s late, %s triggers missed",
+                                   interval, -delay, missed)
+                    stats.missed += missed
+                    next_shot += missed * interval
+                    delay = max(0, next_shot - loop.time())
+                await asyncio.sleep(delay)
+        finally:
+            self.finish_series()
+
+    async def run_distance(self, distance):
+        logger.info("Start distance capture: every %s m", distance)
+        loop = asyncio.get_event_loop()
+        stats = self.stats = CaptureStats(distance, 'm')
+        origin = self.pose_at(int(time.time() * 1e6))
+        try:
+            while True:
+                await asyncio.sleep(self.DISTANCE_POLL_INTERVAL)
+                # the latest position is what counts for the trigger, geotags are looked up in save()
+                pose = self.pose_at(int(time.time() * 1e6))
+                travelled = ground_distance(origin, pose)
+                if travelled < distance:
+                    continue
+                if travelled >= 2 * distance:
+                    missed = int(travelled // distance) - 1
+                    logger.warning("Capture distance %s m is too short, %.1f m travelled, %s triggers missed",
+                                   distance, travelled, missed)
+                    stats.missed += missed
+                origin = pose
+                stats.add(loop.time())
+                await self.shoot()
+        finally:
+            self.finish_series()
+
+    def finish_series(self):
+        if self.interval_task is asyncio.current_task():
+            self.interval_task = None
+            self.interval = 0
+            self.trigger_distance = 0
+        logger.info("Capture series finished: %s", self.stats)
+
+    def send_captured(self, image):
+        pose = dict(image.pose)
+        q = pose.pop("q")
+        self.mav.camera_image_captured_send(
+            camera_id=self.CAMERA_ID, q=q, image_index=image.index, capture_result=image.result,
+            file_url=image.file_url.encode(), **pose)
+
+    async def close(self):
+        await self.stop_interval()
+        if self.triggers:
+            await asyncio.wait(list(self.triggers))
+        if self.saving:
+            await asyncio.wait(list(self.saving))
@@ -0,0 +1,200 @@
+"""
+Detection chips over the MAVLink image transmission protocol
+(https://mavlink.io/en/services/image_transmission.html)
+
+Each chip is a small progressive JPEG cropped around a detection from the
+full resolution capture. It is announced with DATA_TRANSMISSION_HANDSHAKE
+and sent as ENCAPSULATED_DATA packets; the first scans of a progressive JPEG
+already make a coarse preview, later packets refine it. The JPEG comment
+names the source image and the box.
+"""
+import asyncio
+import collections
+import io
+import logging
+import time
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, chips are disabled without it
+    Image = None
+
+from .mavlink.dialects import lacmus as mavlink2
+
+logger = logging.getLogger(__name__)
+
+
+PACKET_SIZE = 253
+
+
+ChipRequest = collections.namedtuple('ChipRequest', ('path', 'bbox', 'comment'))
+
+
+def make_chip(path, bbox, size=128, quality=60, margin=0.5, comment=''):
+    """
+    Crop (x_min, y_min, x_max, y_max) box with margin around it from the
+    image (path or file object), return (jpeg, width, height) of the progressive JPEG chip no
+    larger than size
+    """
+    with Image.open(path) as img:
+        full_width, full_height = img.size
+        x_min, y_min, x_max, y_max = bbox
+        dx, dy = (x_max - x_min) * margin, (y_max - y_min) * margin
+        box = (max(0, x_min - dx), max(0, y_min - dy), min(full_width, x_max + dx), min(full_height, y_max + dy))
+        # let the JPEG decoder downscale, a chip needs only a fraction of the pixels
+        scale = min(1, size / max(box[2] - box[0], box[3] - box[1], 1))
+        img.draft('RGB', (int(full_width * scale) + 1, int(full_height * scale) + 1))
+        k = img.size[0] / full_width
+        chip = img.crop(tuple(int(value * k) for value in box))
+        chip.thumbnail((size, size))
+        buf = io.BytesIO()
+        chip.convert('RGB').save(buf, 'JPEG', quality=quality, progressive=True, optimize=True,
+                                 comment=comment.encode())
+        return buf.getvalue(), chip.width, chip.height
+
+
+class ChipTransfer:
+    __slots__ = ('request', 'data', 'width', 'height', 'packets', 'seqnr', 'sent_at', 'handshake')
+
+    def __init__(self, request, data, width, height):
+        self.request = request
+        self.data = memoryview(data)
+        self.width = width
+        self.height = height
+        self.packets = (len(data) + PACKET_SIZE - 1) // PACKET_SIZE
+        self.seqnr = 0
+        self.sent_at = [None] * self.packets
+        self.handshake = True
+
+    def __str__(self):
+        return "ChipTransfer({}, {} bytes)".format(self.request.comment, len(self.data))
+
+    def packet(self, seqnr):
+        chunk = self.data[seqnr * PACKET_SIZE:(seqnr + 1) * PACKET_SIZE]
+        return bytes(chunk) + bytes(PACKET_SIZE - len(chunk))
+
+
+class ChipSender:
+    """
+    Sends chips one after another, paced by the link token bucket.
+
+    Packets are only sent while idle() is true, e.g. there are no pending
+    detection reports. Chips are cut from image_data(path) when the image
+    is still in memory, from the file otherwise. On link loss the transfer is paused and rewound to
+    the first packet sent after the peer was last seen; on resume the
+    handshake is repeated and the transfer continues from there.
+    """
+
+    CHIP_SIZE = 128
+    QUALITY = 60
+    MAX_QUEUE = 100
+    IDLE_POLL = 0.1
+
+    def __init__(self, mav, bucket, idle=lambda: True, clock=time.monotonic, image_data=lambda path: None):
+        self.mav = mav
+        self.bucket = bucket
+        self.idle = idle
+        self.image_data = image_data
+        self.clock = clock
+        self.queue = collections.deque(maxlen=self.MAX_QUEUE)
+        self.transfer = None
+        self.paused = False
+        self.wakeup = asyncio.Event()
+        self.sent_chips = 0
+        self.sent_bytes = 0
+        if Image is None:
+            logger.warning("Pillow is not installed, detection chips are disabled")
+
+    def __str__(self):
+        return "ChipSender(queue {}, sent {})".format(len(self.queue), self.sent_chips)
+
+    def add(self, path, bbox, comment=''):
+        if Image is None:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            logger.warning("Chip queue is full, dropping the oldest chip")
+        self.queue.append(ChipRequest(path, bbox, comment))
+        self.wakeup.set()
+
+    def pause(self, since=None):
+        """
+        Pause the transfer, packets sent after since were probably lost
+        """
+        self.paused = True
+        transfer = self.transfer
+        if transfer is None or since is None:
+            return
+        for seqnr, sent_at in enumerate(transfer.sent_at[:transfer.seqnr]):
+            if sent_at is None or sent_at > since:
+                transfer.seqnr = seqnr
+                break
+        transfer.handshake = True
+        logger.info("%s paused at packet %s of %s", transfer, transfer.seqnr, transfer.packets)
+
+    def resume(self):
+        self.paused = False
+        self.wakeup.set()
+
+    async def next_transfer(self):
+        loop = asyncio.get_event_loop()
+        while self.queue:
+            request = self.queue.popleft()
+            image = self.image_data(request.path)
+            source = request.path if image is None else io.BytesIO(image)
+            try:
+                data, width, height = await loop.run_in_executor(
+                    None, make_chip, source, request.bbox, self.CHIP_SIZE, self.QUALITY, 0.5, request.comment)
+            except Exception as e:
+                logger.warning("Failed to make chip %s: %s", request.comment, e)
+                continue
+            return ChipTransfer(request, data, width, height)
+        return None
+
+    def send_next(self, transfer):
+        """
+        Send handshake or the next packet if the budget allows, return delay
+        until the next attempt or 0 if sent
+        """
+        mav = self.mav
+        if transfer.handshake:
+            msg = mav.data_transmission_handshake_encode(
+                mavlink2.MAVLINK_DATA_STREAM_IMG_JPEG, len(transfer.data), transfer.width, transfer.height,
+                transfer.packets, PACKET_SIZE, self.QUALITY)
+        else:
+            msg = mav.encapsulated_data_encode(transfer.seqnr, transfer.packet(transfer.seqnr))
+        buf = msg.pack(mav)
+        size = len(buf)
+        if not self.bucket.consume(size):
+            return max(self.bucket.delay(size), 0.001)
+        # the frame is packed once, as in MessageScheduler.send_batch
+        mav.file.write(buf)
+        mav.seq = (mav.seq + 1) % 256
+        mav.total_packets_sent += 1
+        mav.total_bytes_sent += size
+        self.sent_bytes += size
+        if transfer.handshake:
+            transfer.handshake = False
+        else:
+            transfer.sent_at[transfer.seqnr] = self.clock()
+            transfer.seqnr += 1
+        return 0
+
+    async def run(self):
+        logger.info('Start chip sender')
+        while True:
+            if self.paused or (self.transfer is None and not self.queue):
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            if self.transfer is None:
+                self.transfer = await self.next_transfer()
+                continue
+            if not self.idle():
+                await asyncio.sleep(self.IDLE_POLL)
+                continue
+            delay = self.send_next(self.transfer)
+            if self.transfer.seqnr >= self.transfer.packets:
+                logger.debug("%s done", self.transfer)
+                self.sent_chips += 1
+                self.transfer = None
+            await asyncio.sleep(delay)
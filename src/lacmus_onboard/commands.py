@@ -0,0 +1,164 @@
+import asyncio
+import collections
+import logging
+import time
+
+from .mavlink.dialects import lacmus as mavlink2
+
+logger = logging.getLogger(__name__)
+
+
+CommandHandler = collections.namedtuple('CommandHandler', ('handler', 'long_running', 'idempotent'))
+
+
+class Command:
+    """
+    Single COMMAND_LONG/COMMAND_INT request as seen by a handler.
+    params are param1..param7 (x, y, z for COMMAND_INT).
+    """
+
+    __slots__ = ('engine', 'msg', 'command', 'params', 'source', 'confirmation',
+                 'progress_value', 'result', 'finished')
+
+    def __init__(self, engine, msg):
+        self.engine = engine
+        self.msg = msg
+        self.command = msg.command
+        if msg.get_msgId() == mavlink2.MAVLINK_MSG_ID_COMMAND_INT:
+            self.params = (msg.param1, msg.param2, msg.param3, msg.param4, msg.x, msg.y, msg.z)
+            self.confirmation = 0
+        else:
+            self.params = (msg.param1, msg.param2, msg.param3, msg.param4, msg.param5, msg.param6, msg.param7)
+            self.confirmation = msg.confirmation
+        self.source = (msg.get_srcSystem(), msg.get_srcComponent())
+        self.progress_value = 0
+        self.result = None
+        self.finished = 0
+
+    def __str__(self):
+        return "Command({} from {}, confirmation {})".format(self.command, self.source, self.confirmation)
+
+    def progress(self, percent):
+        """
+        Report progress of a long running command to the sender
+        """
+        self.progress_value = max(0, min(int(percent), 100))
+        self.engine.ack(self, mavlink2.MAV_RESULT_IN_PROGRESS, self.progress_value)
+
+
+class CommandEngine:
+    """
+    COMMAND_LONG/COMMAND_INT dispatcher.
+
+    Handlers are registered per MAV_CMD and may be plain functions or
+    coroutines returning a MAV_RESULT. Coroutine handlers run as separate
+    tasks, so a long capture does not block other commands. Every command is
+    answered with COMMAND_ACK, long running ones get MAV_RESULT_IN_PROGRESS
+    first. Retransmissions of a command which is still running are not
+    executed again, the sender gets the current progress instead. The same
+    goes for recently answered non-idempotent commands, whose retransmissions
+    (same source and command, higher confirmation) get the cached ACK. A
+    command with confirmation 0 is always new, COMMAND_INT has no
+    confirmation field at all.
+    """
+
+    DEDUP_TIMEOUT = 3.0
+
+    def __init__(self, mav, system_id, component_id, clock=time.monotonic):
+        self.mav = mav
+        self.system_id = system_id
+        self.component_id = component_id
+        self.clock = clock
+        self.handlers = {}
+        self.in_progress = {}  # (source, command) -> Command
+        self.completed = {}  # (source, command) -> Command
+        self.tasks = set()
+
+    def register(self, command, handler, long_running=False, idempotent=False):
+        self.handlers[command] = CommandHandler(handler, long_running, idempotent)
+
+    def ack(self, cmd, result, progress=0):
+        self.mav.command_ack_send(cmd.command, result, progress=progress,
+                                  target_system=cmd.source[0], target_component=cmd.source[1])
+
+    def is_duplicate(self, cmd):
+        key = (cmd.source, cmd.command)
+        running = self.in_progress.get(key)
+        if running is not None:
+            logger.debug("%s is in progress, ignoring retransmission", running)
+            self.ack(running, mavlink2.MAV_RESULT_IN_PROGRESS, running.progress_value)
+            return True
+        previous = self.completed.get(key)
+        if previous is None:
+            return False
+        entry = self.handlers.get(cmd.command)
+        if entry is not None and entry.idempotent:
+            return False
+        if self.clock() - previous.finished > self.DEDUP_TIMEOUT:
+            del self.completed[key]
+            return False
+        if cmd.confirmation > previous.confirmation:
+            logger.debug("%s was already executed, repeating ACK", previous)
+            self.ack(previous, previous.result)
+            return True
+        return False
+
+    def handle(self, msg):
+        """
+        Dispatch incoming COMMAND_LONG/COMMAND_INT message.
+        Return the Command or None if it is not addressed to us or is a duplicate.
+        """
+        if msg.target_system not in (0, self.system_id) or msg.target_component not in (0, self.component_id):
+            return None
+        cmd = Command(self, msg)
+        if self.is_duplicate(cmd):
+            return None
+
+        entry = self.handlers.get(cmd.command)
+        if entry is None:
+            self.finish(cmd, mavlink2.MAV_RESULT_UNSUPPORTED)
+            return cmd
+
+        if not asyncio.iscoroutinefunction(entry.handler):
+            try:
+                result = entry.handler(cmd)
+            except Exception as e:
+                logger.exception("%s failed: %s", cmd, e)
+                result = mavlink2.MAV_RESULT_FAILED
+            self.finish(cmd, result)
+            return cmd
+
+        self.in_progress[(cmd.source, cmd.command)] = cmd
+        if entry.long_running:
+            self.ack(cmd, mavlink2.MAV_RESULT_IN_PROGRESS, 0)
+        task = asyncio.ensure_future(self.run(cmd, entry.handler))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return cmd
+
+    async def run(self, cmd, handler):
+        try:
+            result = await handler(cmd)
+        except asyncio.CancelledError:
+            result = mavlink2.MAV_RESULT_FAILED
+            raise
+        except Exception as e:
+            logger.exception("%s failed: %s", cmd, e)
+            result = mavlink2.MAV_RESULT_FAILED
+        finally:
+            del self.in_progress[(cmd.source, cmd.command)]
+            self.finish(cmd, result)
+
+    def finish(self, cmd, result):
+        if result is None:
+            result = mavlink2.MAV_RESULT_ACCEPTED
+        cmd.result = result
+        cmd.finished = self.clock()
+        self.completed[(cmd.source, cmd.command)] = cmd
+        self.ack(cmd, result)
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        if self.tasks:
+            await asyncio.wait(list(self.tasks))
@@ -0,0 +1,403 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import pathlib
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Byte budget of a link: refills at rate [bytes/s] up to capacity [bytes]
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'clock')
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, size):
+        self.refill()
+        if size > self.tokens and self.tokens < self.capacity:
+            # frames larger than the bucket go out on a full one
+            return False
+        self.tokens -= size
+        return True
+
+    def delay(self, size):
+        """
+        Seconds until size bytes can be consumed
+        """
+        self.refill()
+        return max(0, min(size, self.capacity) - self.tokens) / self.rate
+
+
+def iou(a, b):
+    """
+    Intersection over union of (x_min, y_min, x_max, y_max) boxes
+    """
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union
+
+
+def quantise(value, scale):
+    return max(0, min(255, int(round(value * 255 / scale))))
+
+
+DETECTION_FIELDS = ('time_boot_ms', 'time_utc', 'camera_id', 'lat', 'lon', 'alt', 'relative_alt',
+                    'source_image_index', 'bbox', 'confidence', 'class_id')
+
+
+class PendingImage:
+    __slots__ = ('index', 'detections', 'entry')
+
+    def __init__(self, index):
+        self.index = index
+        self.detections = []  # sorted by confidence, best first
+        self.entry = None
+
+    @property
+    def confidence(self):
+        return self.detections[0]['confidence'] if self.detections else 0
+
+
+class Report:
+    """
+    LACMUS_DETECTION_BATCH waiting for LACMUS_DETECTION_ACK
+    """
+
+    __slots__ = ('detection_id', 'fields', 'confidence', 'attempts', 'deadline', 'entry', 'size')
+
+    def __init__(self, detection_id, fields, confidence, attempts=0):
+        self.detection_id = detection_id
+        self.fields = fields
+        self.confidence = confidence
+        self.attempts = attempts
+        self.deadline = 0
+        self.entry = None
+        self.size = 0  # MAVLink frame size [bytes]
+
+    def __str__(self):
+        return "Report({}, image {}, {} objects)".format(
+            self.detection_id, self.fields['source_image_index'], self.fields['count'])
+
+
+class DetectionDownlink:
+    """
+    Bandwidth budgeted, acknowledged detections downlink.
+
+    Detections are dicts with DETECTION_FIELDS, 'confidence' is 1.0 and
+    'class_id' 0 if missing. They are grouped per source image, overlapping
+    boxes of the same image are coalesced into the most confident one.
+    Images are sent best confidence first as LACMUS_DETECTION_BATCH reports
+    of up to BATCH_SIZE objects with boxes quantised to image_size, as long
+    as the token bucket allows. A report of one object takes 55 bytes,
+    MAVLink 2 trims the unused tail of objects. The rest is deferred, when the backlog is
+    full the least confident detection is dropped.
+
+    Every report has a detection_id and is retransmitted with exponential
+    backoff until the GCS confirms it with LACMUS_DETECTION_ACK. Due
+    retransmissions go before new reports. Unconfirmed reports and the
+    backlog are saved to the store file, at most once per SAVE_INTERVAL and
+    on close(), and loaded again on start.
+    """
+
+    COALESCE_IOU = 0.5
+    BATCH_SIZE = 16
+    RETRANSMIT_TIMEOUT = 1.0
+    MAX_RETRANSMIT_TIMEOUT = 30.0
+    SAVE_INTERVAL = 1.0
+
+    def __init__(self, mav, rate, burst=None, max_backlog=1000, image_size=(4000, 3000), store=None,
+                 clock=time.monotonic):
+        self.mav = mav
+        self.image_size = image_size
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.max_backlog = max_backlog
+        self.images = {}
+        self.heap = []
+        self.entries = itertools.count()
+        self.backlog = 0
+        self.next_id = 1
+        self.unacked = {}
+        self.retransmits = []
+        self.sent = 0
+        self.sent_reports = 0
+        self.sent_bytes = 0
+        self.retransmitted = 0
+        self.acked = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.paused = False
+        self.wakeup = asyncio.Event()
+        self.store = pathlib.Path(store) if store is not None else None
+        self.dirty = False
+        self.saved_at = None
+        if self.store is not None and self.store.exists():
+            self.load()
+
+    def __str__(self):
+        return "DetectionDownlink(backlog {}, unacked {}, sent {}, coalesced {}, dropped {})".format(
+            self.backlog, len(self.unacked), self.sent, self.coalesced, self.dropped)
+
+    @property
+    def retransmitting(self):
+        return any(report.attempts for report in self.unacked.values())
+
+    @property
+    def idle(self):
+        """
+        Nothing is due, the rest of the budget is free for other traffic
+        """
+        if self.backlog and not self.paused:
+            return False
+        report = self._next_retransmit()
+        return report is None or report.deadline > self.clock()
+
+    def _schedule(self, image):
+        image.entry = next(self.entries)
+        heapq.heappush(self.heap, (-image.confidence, image.entry, image.index))
+
+    def _schedule_retransmit(self, report, when):
+        report.deadline = when
+        report.entry = next(self.entries)
+        heapq.heappush(self.retransmits, (when, report.entry, report.detection_id))
+
+    def add(self, detection):
+        detection = {name: detection[name] for name in DETECTION_FIELDS if name in detection}
+        detection.setdefault('confidence', 1.0)
+        detection.setdefault('class_id', 0)
+        index = detection['source_image_index']
+        image = self.images.get(index)
+        if image is None:
+            image = self.images[index] = PendingImage(index)
+        for n, other in enumerate(image.detections):
+            if iou(other['bbox'], detection['bbox']) >= self.COALESCE_IOU:
+                self.coalesced += 1
+                if detection['confidence'] <= other['confidence']:
+                    return
+                del image.detections[n]
+                self.backlog -= 1
+                break
+        best = image.confidence
+        image.detections.append(detection)
+        image.detections.sort(key=lambda detection: detection['confidence'], reverse=True)
+        self.backlog += 1
+        if image.entry is None or image.confidence > best:
+            self._schedule(image)
+        if self.backlog + len(self.unacked) > self.max_backlog:
+            self.drop_least_confident()
+        self.dirty = True
+        self.wakeup.set()
+
+    def ack(self, detection_id):
+        report = self.unacked.pop(detection_id, None)
+        if report is None:
+            return False
+        self.acked += 1
+        self.dirty = True
+        self.wakeup.set()
+        return True
+
+    def drop_least_confident(self):
+        image = min(self.images.values(), key=lambda image: image.detections[-1]['confidence'], default=None)
+        report = min(self.unacked.values(), key=lambda report: report.confidence, default=None)
+        if image is not None and (report is None or image.detections[-1]['confidence'] <= report.confidence):
+            image.detections.pop()
+            self.backlog -= 1
+            self.dropped += 1
+            if not image.detections:
+                del self.images[image.index]
+        elif report is not None:
+            del self.unacked[report.detection_id]
+            self.dropped += report.fields['count']
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning("Detection backlog is full, %s detections dropped", self.dropped)
+
+    def _next_image(self):
+        while self.heap:
+            confidence, entry, index = self.heap[0]
+            image = self.images.get(index)
+            if image is not None and image.entry == entry:
+                return image
+            heapq.heappop(self.heap)
+        return None
+
+    def _next_retransmit(self):
+        while self.retransmits:
+            deadline, entry, detection_id = self.retransmits[0]
+            report = self.unacked.get(detection_id)
+            if report is not None and report.entry == entry:
+                return report
+            heapq.heappop(self.retransmits)
+        return None
+
+    def flush(self):
+        """
+        Send as many reports as the budget allows, return seconds until the
+        next one or the next save of the store is due, None if there is
+        nothing to do
+        """
+        delay = None
+        try:
+            delay = self._flush()
+        finally:
+            if self.dirty and self.store is not None:
+                save_delay = self.save_delay()
+                if save_delay <= 0:
+                    self.save()
+                else:
+                    delay = save_delay if delay is None else min(delay, save_delay)
+        return delay
+
+    def save_delay(self):
+        if self.saved_at is None:
+            return 0
+        return self.saved_at + self.SAVE_INTERVAL - self.clock()
+
+    def _flush(self):
+        while not self.paused:
+            now = self.clock()
+            report = self._next_retransmit()
+            if report is not None and report.deadline <= now:
+                if not self.send(report):
+                    return self.bucket.delay(report.size)
+                if report.attempts == 1 or report.attempts % 10 == 0:
+                    logger.info("%s is not confirmed, retransmission %s", report, report.attempts)
+                self.retransmitted += 1
+                continue
+
+            image = self._next_image()
+            if image is None:
+                return None if report is None else report.deadline - now
+            count = min(len(image.detections), self.BATCH_SIZE)
+            detections = image.detections[:count]
+            report = Report(self.next_id, self.batch_fields(detections), detections[0]['confidence'])
+            if not self.send(report):
+                return self.bucket.delay(report.size)
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF or 1
+            self.unacked[report.detection_id] = report
+            self.dirty = True
+            del image.detections[:count]
+            self.backlog -= count
+            self.sent += count
+            if not image.detections:
+                del self.images[image.index]
+        return None
+
+    def send(self, report):
+        """
+        Send or retransmit the report if the budget allows
+        """
+        mav = self.mav
+        buf = mav.lacmus_detection_batch_encode(**report.fields).pack(mav)
+        size = report.size = len(buf)
+        if not self.bucket.consume(size):
+            return False
+        # the frame is packed once, as in MessageScheduler.send_batch
+        mav.file.write(buf)
+        mav.seq = (mav.seq + 1) % 256
+        mav.total_packets_sent += 1
+        mav.total_bytes_sent += size
+        timeout = min(self.RETRANSMIT_TIMEOUT * 2 ** report.attempts, self.MAX_RETRANSMIT_TIMEOUT)
+        report.attempts += 1
+        self._schedule_retransmit(report, self.clock() + timeout)
+        self.sent_reports += 1
+        self.sent_bytes += size
+        return True
+
+    def batch_fields(self, detections):
+        first = detections[0]
+        width, height = self.image_size
+        objects = [0] * (6 * self.BATCH_SIZE)
+        for n, detection in enumerate(detections):
+            x_min, y_min, x_max, y_max = detection['bbox']
+            objects[6 * n:6 * n + 6] = (quantise(x_min, width), quantise(y_min, height),
+                                        quantise(x_max, width), quantise(y_max, height),
+                                        quantise(detection['confidence'], 1), detection['class_id'])
+        fields = {name: first[name] for name in DETECTION_FIELDS[:8]}
+        fields.update(detection_id=self.next_id, count=len(detections), objects=objects)
+        return fields
+
+    def save(self):
+        state = {
+            'next_id': self.next_id,
+            'unacked': [report.fields for report in self.unacked.values()],
+            'backlog': [detection for image in self.images.values() for detection in image.detections],
+        }
+        tmp = self.store.with_name(self.store.name + '.tmp')
+        try:
+            self.store.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(state))
+            os.replace(tmp, self.store)
+        except OSError as e:
+            logger.error("Failed to save detections to %s: %s", self.store, e)
+        self.dirty = False
+        self.saved_at = self.clock()
+
+    def load(self):
+        try:
+            state = json.loads(self.store.read_text())
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load detections from %s: %s", self.store, e)
+            return
+        self.next_id = state['next_id']
+        now = self.clock()
+        for fields in state['unacked']:
+            report = Report(fields['detection_id'], fields, fields['objects'][4] / 255, attempts=1)
+            self.unacked[report.detection_id] = report
+            self._schedule_retransmit(report, now)
+        for detection in state['backlog']:
+            self.add(detection)
+        logger.info("Loaded %s unconfirmed reports and %s detections from %s",
+                    len(self.unacked), self.backlog, self.store)
+
+    async def run(self):
+        logger.info('Start detection downlink, %s bytes/s', self.bucket.rate)
+        while True:
+            self.wakeup.clear()
+            try:
+                delay = self.flush()
+            except Exception as e:
+                logger.exception("Detection downlink error: %s", e)
+                delay = None
+            # not wait_for: it can swallow a cancellation that races with the wakeup
+            timer = None if delay is None else asyncio.get_event_loop().call_later(delay, self.wakeup.set)
+            try:
+                await self.wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+    def close(self):
+        """
+        Save what the debounce has held back
+        """
+        if self.dirty and self.store is not None:
+            self.save()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.wakeup.set()
@@ -0,0 +1,307 @@
+"""
+Read-only MAVLink FTP server (https://mavlink.io/en/services/ftp.html)
+
+Serves the captures/detections directories to the GCS over
+FILE_TRANSFER_PROTOCOL, e.g. "/captures/image_7.jpg" from the file_url of
+CAMERA_IMAGE_CAPTURED.
+"""
+import asyncio
+import collections
+import logging
+import os
+import pathlib
+import stat
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+HEADER = struct.Struct('<HBBBBBBI')
+PAYLOAD_SIZE = 251
+MAX_DATA_SIZE = PAYLOAD_SIZE - HEADER.size
+# FILE_TRANSFER_PROTOCOL frame on the wire: MAVLink 2 header and CRC, target fields and payload
+FRAME_SIZE = 12 + 3 + PAYLOAD_SIZE
+
+
+def crc32(data, crc=0):
+    """
+    CRC32 of MAVLink FTP (PX4 crc32part, ArduPilot crc_crc32): the IEEE
+    table seeded with 0, without the pre- and post-inversion of zlib.crc32.
+    zlib does the table work, its inversions are undone around it.
+    """
+    return zlib.crc32(data, crc ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+
+class Opcode:
+    NONE = 0
+    TERMINATE_SESSION = 1
+    RESET_SESSIONS = 2
+    LIST_DIRECTORY = 3
+    OPEN_FILE_RO = 4
+    READ_FILE = 5
+    CREATE_FILE = 6
+    WRITE_FILE = 7
+    REMOVE_FILE = 8
+    CREATE_DIRECTORY = 9
+    REMOVE_DIRECTORY = 10
+    OPEN_FILE_WO = 11
+    TRUNCATE_FILE = 12
+    RENAME = 13
+    CALC_FILE_CRC32 = 14
+    BURST_READ_FILE = 15
+    ACK = 128
+    NAK = 129
+
+
+class Error:
+    NONE = 0
+    FAIL = 1
+    FAIL_ERRNO = 2
+    INVALID_DATA_SIZE = 3
+    INVALID_SESSION = 4
+    NO_SESSIONS_AVAILABLE = 5
+    EOF = 6
+    UNKNOWN_COMMAND = 7
+    FILE_EXISTS = 8
+    FILE_PROTECTED = 9
+    FILE_NOT_FOUND = 10
+
+
+WRITE_OPCODES = (
+    Opcode.CREATE_FILE, Opcode.WRITE_FILE, Opcode.REMOVE_FILE, Opcode.CREATE_DIRECTORY,
+    Opcode.REMOVE_DIRECTORY, Opcode.OPEN_FILE_WO, Opcode.TRUNCATE_FILE, Opcode.RENAME,
+)
+
+
+FTPRequest = collections.namedtuple('FTPRequest', (
+    'seq', 'session', 'opcode', 'size', 'req_opcode', 'burst_complete', 'offset', 'data'))
+
+
+def parse_payload(payload):
+    payload = bytes(payload)
+    seq, session, opcode, size, req_opcode, burst_complete, _, offset = HEADER.unpack_from(payload)
+    data = payload[HEADER.size:HEADER.size + size]
+    return FTPRequest(seq, session, opcode, size, req_opcode, burst_complete, offset, data)
+
+
+def build_payload(seq, session, opcode, req_opcode, offset=0, data=b'', burst_complete=0):
+    payload = bytearray(PAYLOAD_SIZE)
+    HEADER.pack_into(payload, 0, seq & 0xFFFF, session, opcode, len(data), req_opcode, burst_complete, 0, offset)
+    payload[HEADER.size:HEADER.size + len(data)] = data
+    return payload
+
+
+class FTPSession:
+    """
+    Open read-only file with a read-ahead block, data is read with os.pread
+    and served as memoryview slices of the block without further copies
+    """
+
+    __slots__ = ('fd', 'path', 'size', 'block_offset', 'block', 'burst_task')
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+        self.block_offset = 0
+        self.block = memoryview(b'')
+        self.burst_task = None
+
+    def read(self, offset, size, read_ahead):
+        end = offset + size
+        block_end = self.block_offset + len(self.block)
+        if not (self.block_offset <= offset and end <= block_end) and offset < self.size:
+            self.block = memoryview(os.pread(self.fd, max(read_ahead, size), offset))
+            self.block_offset = offset
+        start = offset - self.block_offset
+        return self.block[start:start + size]
+
+    def close(self):
+        if self.burst_task is not None:
+            self.burst_task.cancel()
+        os.close(self.fd)
+
+
+class FTPServer:
+    """
+    Read-only MAVLink FTP server over a set of named root directories.
+
+    Supports ListDirectory, OpenFileRO, ReadFile, BurstReadFile,
+    CalcFileCRC32, TerminateSession and ResetSessions. Burst reads can be
+    paced to a link rate in bytes/s.
+    """
+
+    MAX_SESSIONS = 4
+    READ_AHEAD = 64 * 1024
+    BURST_SIZE = 64 * 1024  # bytes per burst, the client requests the next one
+
+    def __init__(self, mav, roots, burst_rate=None):
+        self.mav = mav
+        self.roots = {name: pathlib.Path(path) for name, path in roots.items()}
+        self.burst_rate = burst_rate
+        self.sessions = {}
+        self.last_request = None
+        self.last_response = None
+
+    def resolve(self, path):
+        """
+        Map FTP path to a local one, None if it is outside of the roots
+        """
+        parts = [part for part in path.strip('\0').split('/') if part and part != '.']
+        if not parts:
+            return None
+        root = self.roots.get(parts[0])
+        if root is None or '..' in parts:
+            return None
+        return root.joinpath(*parts[1:])
+
+    def handle(self, msg):
+        target = (msg.get_srcSystem(), msg.get_srcComponent())
+        request = parse_payload(msg.payload)
+        key = (target, request.seq, request.opcode)
+        if key == self.last_request and self.last_response is not None:
+            # the response was lost, repeat it instead of executing again
+            self.send(target, self.last_response)
+            return
+
+        handler = self.HANDLERS.get(request.opcode)
+        try:
+            if request.opcode in WRITE_OPCODES:
+                response = self.nak(request, Error.FILE_PROTECTED)
+            elif handler is None:
+                response = self.nak(request, Error.UNKNOWN_COMMAND)
+            else:
+                response = handler(self, target, request)
+        except OSError as e:
+            logger.warning("FTP %s failed: %s", request.opcode, e)
+            response = self.nak(request, Error.FAIL_ERRNO, bytes([e.errno or 0]))
+        if response is None:
+            return
+        self.last_request = key
+        self.last_response = response
+        self.send(target, response)
+
+    def send(self, target, payload):
+        self.mav.file_transfer_protocol_send(0, target[0], target[1], payload)
+
+    def ack(self, request, data=b'', offset=None):
+        return build_payload(request.seq + 1, request.session, Opcode.ACK, request.opcode,
+                             request.offset if offset is None else offset, data)
+
+    def nak(self, request, error, extra=b''):
+        return build_payload(request.seq + 1, request.session, Opcode.NAK, request.opcode,
+                             data=bytes([error]) + extra)
+
+    def on_list_directory(self, target, request):
+        path = self.resolve(request.data.decode(errors='replace'))
+        if request.data.strip(b'\0/') in (b'', b'.'):
+            entries = ['D' + name for name in sorted(self.roots)]
+        elif path is None or not path.is_dir():
+            return self.nak(request, Error.FILE_NOT_FOUND)
+        else:
+            entries = []
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+                st = entry.stat()
+                if stat.S_ISDIR(st.st_mode):
+                    entries.append('D' + entry.name)
+                elif stat.S_ISREG(st.st_mode):
+                    entries.append('F{}\t{}'.format(entry.name, st.st_size))
+        if request.offset >= len(entries):
+            return self.nak(request, Error.EOF)
+        data = bytearray()
+        for entry in entries[request.offset:]:
+            encoded = entry.encode() + b'\0'
+            if len(data) + len(encoded) > MAX_DATA_SIZE:
+                break
+            data += encoded
+        return self.ack(request, bytes(data))
+
+    def on_open_file_ro(self, target, request):
+        path = self.resolve(request.data.decode(errors='replace'))
+        if path is None or not path.is_file():
+            return self.nak(request, Error.FILE_NOT_FOUND)
+        if len(self.sessions) >= self.MAX_SESSIONS:
+            return self.nak(request, Error.NO_SESSIONS_AVAILABLE)
+        session_id = next(n for n in range(256) if n not in self.sessions)
+        session = self.sessions[session_id] = FTPSession(path)
+        logger.info("FTP session %s: %s, %s bytes", session_id, path, session.size)
+        return build_payload(request.seq + 1, session_id, Opcode.ACK, request.opcode,
+                             data=struct.pack('<I', session.size))
+
+    def on_read_file(self, target, request):
+        session = self.sessions.get(request.session)
+        if session is None:
+            return self.nak(request, Error.INVALID_SESSION)
+        if request.offset >= session.size:
+            return self.nak(request, Error.EOF)
+        size = min(request.size or MAX_DATA_SIZE, MAX_DATA_SIZE)
+        return self.ack(request, session.read(request.offset, size, self.READ_AHEAD))
+
+    def on_burst_read_file(self, target, request):
+        session = self.sessions.get(request.session)
+        if session is None:
+            return self.nak(request, Error.INVALID_SESSION)
+        if request.offset >= session.size:
+            return self.nak(request, Error.EOF)
+        if session.burst_task is not None:
+            session.burst_task.cancel()
+        session.burst_task = asyncio.ensure_future(self.burst(target, request, session))
+        return None
+
+    async def burst(self, target, request, session):
+        seq = request.seq
+        offset = request.offset
+        end = min(session.size, offset + self.BURST_SIZE)
+        while offset < end:
+            data = session.read(offset, min(MAX_DATA_SIZE, end - offset), self.READ_AHEAD)
+            seq += 1
+            complete = int(offset + len(data) >= end)
+            payload = build_payload(seq, request.session, Opcode.ACK, request.opcode, offset, data, complete)
+            self.send(target, payload)
+            offset += len(data)
+            if self.burst_rate:
+                await asyncio.sleep(FRAME_SIZE / self.burst_rate)
+            else:
+                await asyncio.sleep(0)
+        session.burst_task = None
+
+    def on_calc_file_crc32(self, target, request):
+        path = self.resolve(request.data.decode(errors='replace'))
+        if path is None or not path.is_file():
+            return self.nak(request, Error.FILE_NOT_FOUND)
+        crc = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(self.READ_AHEAD), b''):
+                crc = crc32(block, crc)
+        return self.ack(request, struct.pack('<I', crc))
+
+    def on_terminate_session(self, target, request):
+        session = self.sessions.pop(request.session, None)
+        if session is None:
+            return self.nak(request, Error.INVALID_SESSION)
+        session.close()
+        return self.ack(request)
+
+    def on_reset_sessions(self, target, request):
+        self.close()
+        return self.ack(request)
+
+    def on_none(self, target, request):
+        return self.ack(request)
+
+    HANDLERS = {
+        Opcode.NONE: on_none,
+        Opcode.TERMINATE_SESSION: on_terminate_session,
+        Opcode.RESET_SESSIONS: on_reset_sessions,
+        Opcode.LIST_DIRECTORY: on_list_directory,
+        Opcode.OPEN_FILE_RO: on_open_file_ro,
+        Opcode.READ_FILE: on_read_file,
+        Opcode.BURST_READ_FILE: on_burst_read_file,
+        Opcode.CALC_FILE_CRC32: on_calc_file_crc32,
+    }
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
@@ -0,0 +1,75 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Peer:
+    __slots__ = ('system_id', 'component_id', 'last_seen', 'alive', 'timer')
+
+    def __init__(self, system_id, component_id):
+        self.system_id = system_id
+        self.component_id = component_id
+        self.last_seen = 0
+        self.alive = False
+        self.timer = None
+
+    def __str__(self):
+        return "Peer({},{})".format(self.system_id, self.component_id)
+
+
+class LinkMonitor:
+    """
+    Liveness of every MAVLink peer (system id, component id) on the link.
+
+    Receiving a message only updates the peer's last seen time. Each alive peer
+    owns a single timer in the shared TimerWheel which, on expiry, either
+    re-arms itself for the remaining time or declares the peer lost. Listeners
+    are called with (peer, alive) on every state change.
+    """
+
+    def __init__(self, timers, timeout=3.0):
+        self.timers = timers
+        self.timeout = timeout
+        self.peers = {}
+        self.alive_count = 0
+        self.listeners = []
+
+    @property
+    def link_alive(self):
+        return self.alive_count > 0
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def seen(self, system_id, component_id):
+        key = (system_id, component_id)
+        peer = self.peers.get(key)
+        if peer is None:
+            peer = self.peers[key] = Peer(system_id, component_id)
+        peer.last_seen = self.timers.clock()
+        if not peer.alive:
+            peer.alive = True
+            self.alive_count += 1
+            peer.timer = self.timers.call_later(self.timeout, self._check, peer)
+            logger.info("%s is alive", peer)
+            self._notify(peer)
+        return peer
+
+    def _check(self, peer):
+        remaining = peer.last_seen + self.timeout - self.timers.clock()
+        if remaining > 0:
+            peer.timer = self.timers.call_later(remaining, self._check, peer)
+            return
+        peer.alive = False
+        peer.timer = None
+        self.alive_count -= 1
+        logger.warning("%s is lost, no messages for %.1f s", peer, self.timeout)
+        self._notify(peer)
+
+    def _notify(self, peer):
+        for listener in self.listeners:
+            try:
+                listener(peer, peer.alive)
+            except Exception as e:
+                logger.exception("Link listener error: %s", e)
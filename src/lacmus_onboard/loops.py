@@ -0,0 +1,42 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+LOOPS = ('asyncio', 'uvloop')
+
+
+def loop_factory(name):
+    """
+    Return (name, factory) of the requested event loop implementation.
+    Falls back to the default asyncio loop if uvloop is not installed.
+    """
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning("uvloop is not installed, falling back to asyncio event loop")
+        else:
+            return 'uvloop', uvloop.new_event_loop
+    elif name != 'asyncio':
+        raise ValueError("Unknown event loop: {}".format(name))
+    return 'asyncio', asyncio.new_event_loop
+
+
+def run_in_loop(coro, name):
+    """
+    Run coroutine until complete in a new event loop of the given kind
+    """
+    name, factory = loop_factory(name)
+    logger.info("Using %s event loop", name)
+    loop = factory()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -2,12 +2,49 @@ import argparse
 import asyncio
 import logging
 
+from . import benchmark
+from .camera import CAPTURE_PATH, CHDKPTP_ROOT, DETECTION_PATH, SIMULATOR_ROOT, Camera
+from .camera.group import CameraGroup
+from .loops import LOOPS, run_in_loop
 from .mavlink_service import MAVLinkService
 
 parser = argparse.ArgumentParser(description='Start lacmus onboard service.')
 
-parser.add_argument('--port', type=int, required=True, help='MAVLink UDP port for inbound connection')
+parser.add_argument('--port', type=int, help='MAVLink UDP port for inbound connection')
 parser.add_argument('--log-level', help='Log level', default='INFO')
+parser.add_argument('--loop', choices=LOOPS, default='asyncio',
+                    help='Event loop implementation, falls back to asyncio if uvloop is not installed')
+parser.add_argument('--parser-thread', action='store_true',
+                    help='Parse incoming MAVLink in a separate thread instead of the event loop')
+parser.add_argument('--batch-receive', action='store_true',
+                    help='Drain the UDP socket on every wakeup and parse the datagrams as one batch')
+parser.add_argument('--camera', action='store_true', help='Control CHDK camera over USB via chdkptp')
+parser.add_argument('--persistent-script', action='store_true',
+                    help='Keep the shooting script running on the camera instead of uploading it for every shot')
+parser.add_argument('--in-memory', action='store_true',
+                    help='Receive images through a pipe into memory and save them to disk in the background')
+parser.add_argument('--camera-simulator', action='store_true',
+                    help='Use the simulated chdkptp and camera, configured with CHDKPTP_SIM_* variables')
+parser.add_argument('--camera-device', action='append', metavar='NAME=OPTIONS', default=[],
+                    help='Camera of a group and its chdkptp connect options, e.g. wide=-s=<serial>. '
+                         'Repeat for every camera, the first one is primary')
+parser.add_argument('--captures', default=CAPTURE_PATH, help='Directory for captured images')
+parser.add_argument('--detections', default=DETECTION_PATH, help='Directory for detection results')
+parser.add_argument('--ftp-rate', type=int, help='Limit MAVLink FTP burst reads to this rate [bytes/s]')
+parser.add_argument('--detection-rate', type=int, default=MAVLinkService.DETECTION_RATE,
+                    help='Detections downlink budget [bytes/s]')
+parser.add_argument('--detection-store', default=DETECTION_PATH / 'downlink.json',
+                    help='File keeping unconfirmed detections across restarts')
+parser.add_argument('--benchmark', action='store_true',
+                    help='Measure MAVLink datagram round-trip and message rate under each event loop and exit')
+parser.add_argument('--benchmark-count', type=int, default=10000, help='Number of messages per benchmark run')
+parser.add_argument('--benchmark-receive', action='store_true',
+                    help='Measure incoming message rate and event loop lag of the receive modes and exit')
+parser.add_argument('--benchmark-camera', action='store_true',
+                    help='Measure shots per minute with and without the persistent shooting script and exit')
+parser.add_argument('--benchmark-shots', type=int, default=20, help='Number of shots per camera benchmark run')
+parser.add_argument('--benchmark-ftp', metavar='FILE',
+                    help='Measure MAVLink FTP download of FILE over an emulated 57600 baud link and exit')
 
 
 
@@ -15,14 +52,43 @@ def run():
     args = parser.parse_args()
     logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(levelname)-8s %(name)s: %(message)s")
 
+    if args.benchmark_receive:
+        benchmark.run_receive(count=args.benchmark_count)
+        return
+    chdkptp_root = SIMULATOR_ROOT if args.camera_simulator else CHDKPTP_ROOT
+    if args.benchmark_camera:
+        benchmark.run_camera(count=args.benchmark_shots, capture_path=args.captures, chdkptp_root=chdkptp_root)
+        return
+    if args.benchmark_ftp:
+        benchmark.run_ftp(args.benchmark_ftp)
+        return
+    if args.benchmark:
+        benchmark.run(count=args.benchmark_count)
+        return
+    if args.port is None:
+        parser.error('the following arguments are required: --port')
+
     async def main():
         # mav_logger = MAVLogger(1, 100, ('127.0.0.1', 14550))
-        mav_logger = MAVLinkService(1, 100, ('127.0.0.1', args.port))
+        camera = None
+        if args.camera_device:
+            devices = [device.partition('=') for device in args.camera_device]
+            camera = CameraGroup(Camera(args.captures, chdkptp_root, persistent_script=args.persistent_script,
+                                        device=options, name=name, in_memory=args.in_memory)
+                                 for name, sep, options in devices)
+        elif args.camera:
+            camera = Camera(args.captures, chdkptp_root, persistent_script=args.persistent_script,
+                            in_memory=args.in_memory)
+        ftp_roots = {'captures': args.captures, 'detections': args.detections}
+        mav_logger = MAVLinkService(1, 100, ('127.0.0.1', args.port), camera=camera,
+                                    ftp_roots=ftp_roots, ftp_rate=args.ftp_rate,
+                                    detection_rate=args.detection_rate, detection_store=args.detection_store,
+                                    parser_thread=args.parser_thread, batch_receive=args.batch_receive)
         await mav_logger.start()
         while True:
             await asyncio.sleep(5)
 
-    asyncio.run(main())
+    run_in_loop(main(), args.loop)
 
 
 if __name__ == '__main__':
@@ -4878,6 +4878,8 @@ enums['FAILURE_TYPE'][8] = EnumEntry('FAILURE_TYPE_ENUM_END', '''''')
 # message IDs
 MAVLINK_MSG_ID_BAD_DATA = -1
 MAVLINK_MSG_ID_LACMUS_OBJECT_DETECTED = 7000
+MAVLINK_MSG_ID_LACMUS_DETECTION_BATCH = 7001
+MAVLINK_MSG_ID_LACMUS_DETECTION_ACK = 7002
 MAVLINK_MSG_ID_HEARTBEAT = 0
 MAVLINK_MSG_ID_SYS_STATUS = 1
 MAVLINK_MSG_ID_SYSTEM_TIME = 2
@@ -5116,6 +5118,77 @@ class MAVLink_lacmus_object_detected_message(MAVLink_message):
         def pack(self, mav, force_mavlink1=False):
                 return MAVLink_message.pack(self, mav, 24, struct.pack('<QIiiiii4HB205s', self.time_utc, self.time_boot_ms, self.lat, self.lon, self.alt, self.relative_alt, self.source_image_index, self.bbox[0], self.bbox[1], self.bbox[2], self.bbox[3], self.camera_id, self.file_url), force_mavlink1=force_mavlink1)
 
+class MAVLink_lacmus_detection_batch_message(MAVLink_message):
+        '''
+        Objects detected on one image, compact replacement of several
+        LACMUS_OBJECT_DETECTED. The image and its detection samples can be
+        requested by source_image_index.
+        '''
+        id = MAVLINK_MSG_ID_LACMUS_DETECTION_BATCH
+        name = 'LACMUS_DETECTION_BATCH'
+        fieldnames = ['time_boot_ms', 'time_utc', 'camera_id', 'lat', 'lon', 'alt', 'relative_alt', 'source_image_index', 'detection_id', 'count', 'objects']
+        ordered_fieldnames = ['time_utc', 'time_boot_ms', 'lat', 'lon', 'alt', 'relative_alt', 'source_image_index', 'detection_id', 'camera_id', 'count', 'objects']
+        fieldtypes = ['uint32_t', 'uint64_t', 'uint8_t', 'int32_t', 'int32_t', 'int32_t', 'int32_t', 'int32_t', 'uint32_t', 'uint8_t', 'uint8_t']
+        fielddisplays_by_name = {}
+        fieldenums_by_name = {}
+        fieldunits_by_name = {"time_boot_ms": "ms", "time_utc": "us", "lat": "degE7", "lon": "degE7", "alt": "mm", "relative_alt": "mm"}
+        format = '<QIiiiiiIBB96B'
+        native_format = bytearray('<QIiiiiiIBBB', 'ascii')
+        orders = [1, 0, 8, 2, 3, 4, 5, 6, 7, 9, 10]
+        lengths = [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 96]
+        array_lengths = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 96]
+        crc_extra = 27
+        unpacker = struct.Struct('<QIiiiiiIBB96B')
+
+        def __init__(self, time_boot_ms, time_utc, camera_id, lat, lon, alt, relative_alt, source_image_index, detection_id, count, objects):
+                MAVLink_message.__init__(self, MAVLink_lacmus_detection_batch_message.id, MAVLink_lacmus_detection_batch_message.name)
+                self._fieldnames = MAVLink_lacmus_detection_batch_message.fieldnames
+                self.time_boot_ms = time_boot_ms
+                self.time_utc = time_utc
+                self.camera_id = camera_id
+                self.lat = lat
+                self.lon = lon
+                self.alt = alt
+                self.relative_alt = relative_alt
+                self.source_image_index = source_image_index
+                self.detection_id = detection_id
+                self.count = count
+                self.objects = objects
+
+        def pack(self, mav, force_mavlink1=False):
+                return MAVLink_message.pack(self, mav, 27, struct.pack('<QIiiiiiIBB96B', self.time_utc, self.time_boot_ms, self.lat, self.lon, self.alt, self.relative_alt, self.source_image_index, self.detection_id, self.camera_id, self.count, self.objects[0], self.objects[1], self.objects[2], self.objects[3], self.objects[4], self.objects[5], self.objects[6], self.objects[7], self.objects[8], self.objects[9], self.objects[10], self.objects[11], self.objects[12], self.objects[13], self.objects[14], self.objects[15], self.objects[16], self.objects[17], self.objects[18], self.objects[19], self.objects[20], self.objects[21], self.objects[22], self.objects[23], self.objects[24], self.objects[25], self.objects[26], self.objects[27], self.objects[28], self.objects[29], self.objects[30], self.objects[31], self.objects[32], self.objects[33], self.objects[34], self.objects[35], self.objects[36], self.objects[37], self.objects[38], self.objects[39], self.objects[40], self.objects[41], self.objects[42], self.objects[43], self.objects[44], self.objects[45], self.objects[46], self.objects[47], self.objects[48], self.objects[49], self.objects[50], self.objects[51], self.objects[52], self.objects[53], self.objects[54], self.objects[55], self.objects[56], self.objects[57], self.objects[58], self.objects[59], self.objects[60], self.objects[61], self.objects[62], self.objects[63], self.objects[64], self.objects[65], self.objects[66], self.objects[67], self.objects[68], self.objects[69], self.objects[70], self.objects[71], self.objects[72], self.objects[73], self.objects[74], self.objects[75], self.objects[76], self.objects[77], self.objects[78], self.objects[79], self.objects[80], self.objects[81], self.objects[82], self.objects[83], self.objects[84], self.objects[85], self.objects[86], self.objects[87], self.objects[88], self.objects[89], self.objects[90], self.objects[91], self.objects[92], self.objects[93], self.objects[94], self.objects[95]), force_mavlink1=force_mavlink1)
+
+class MAVLink_lacmus_detection_ack_message(MAVLink_message):
+        '''
+        Confirms reception of LACMUS_DETECTION_BATCH, unconfirmed reports are
+        retransmitted.
+        '''
+        id = MAVLINK_MSG_ID_LACMUS_DETECTION_ACK
+        name = 'LACMUS_DETECTION_ACK'
+        fieldnames = ['target_system', 'target_component', 'detection_id']
+        ordered_fieldnames = ['detection_id', 'target_system', 'target_component']
+        fieldtypes = ['uint8_t', 'uint8_t', 'uint32_t']
+        fielddisplays_by_name = {}
+        fieldenums_by_name = {}
+        fieldunits_by_name = {}
+        format = '<IBB'
+        native_format = bytearray('<IBB', 'ascii')
+        orders = [1, 2, 0]
+        lengths = [1, 1, 1]
+        array_lengths = [0, 0, 0]
+        crc_extra = 251
+        unpacker = struct.Struct('<IBB')
+
+        def __init__(self, target_system, target_component, detection_id):
+                MAVLink_message.__init__(self, MAVLink_lacmus_detection_ack_message.id, MAVLink_lacmus_detection_ack_message.name)
+                self._fieldnames = MAVLink_lacmus_detection_ack_message.fieldnames
+                self.target_system = target_system
+                self.target_component = target_component
+                self.detection_id = detection_id
+
+        def pack(self, mav, force_mavlink1=False):
+                return MAVLink_message.pack(self, mav, 251, struct.pack('<IBB', self.detection_id, self.target_system, self.target_component), force_mavlink1=force_mavlink1)
+
 class MAVLink_heartbeat_message(MAVLink_message):
         '''
         The heartbeat message shows that a system or component is
@@ -12510,6 +12583,8 @@ class MAVLink_open_drone_id_message_pack_message(MAVLink_message):
 
 mavlink_map = {
         MAVLINK_MSG_ID_LACMUS_OBJECT_DETECTED : MAVLink_lacmus_object_detected_message,
+        MAVLINK_MSG_ID_LACMUS_DETECTION_BATCH : MAVLink_lacmus_detection_batch_message,
+        MAVLINK_MSG_ID_LACMUS_DETECTION_ACK : MAVLink_lacmus_detection_ack_message,
         MAVLINK_MSG_ID_HEARTBEAT : MAVLink_heartbeat_message,
         MAVLINK_MSG_ID_SYS_STATUS : MAVLink_sys_status_message,
         MAVLINK_MSG_ID_SYSTEM_TIME : MAVLink_system_time_message,
@@ -13176,6 +13251,72 @@ class MAVLink(object):
                 '''
                 return self.send(self.lacmus_object_detected_encode(time_boot_ms, time_utc, camera_id, lat, lon, alt, relative_alt, source_image_index, bbox, file_url), force_mavlink1=force_mavlink1)
 
+        def lacmus_detection_batch_encode(self, time_boot_ms, time_utc, camera_id, lat, lon, alt, relative_alt, source_image_index, detection_id, count, objects):
+                '''
+                Objects detected on one image, compact replacement of several
+                LACMUS_OBJECT_DETECTED. The image and its detection samples can be
+                requested by source_image_index.
+
+                time_boot_ms              : Timestamp (time since system boot). [ms] (type:uint32_t)
+                time_utc                  : Timestamp (time since UNIX epoch) in UTC. 0 for unknown. [us] (type:uint64_t)
+                camera_id                 : Camera ID (1 for first, 2 for second, etc.) (type:uint8_t)
+                lat                       : Latitude where image was taken [degE7] (type:int32_t)
+                lon                       : Longitude where capture was taken [degE7] (type:int32_t)
+                alt                       : Altitude (MSL) where image was taken [mm] (type:int32_t)
+                relative_alt              : Altitude above ground [mm] (type:int32_t)
+                source_image_index        : Zero based index of this image (image count since armed -1) (type:int32_t)
+                detection_id              : Sequence number of this report, to be confirmed with LACMUS_DETECTION_ACK. (type:uint32_t)
+                count                     : Number of objects. (type:uint8_t)
+                objects                   : 6 bytes per object: x_min, y_min, x_max, y_max in 1/255 of the image width and height, confidence in 1/255, class (0 for person). Unused entries are zero. (type:uint8_t)
+
+                '''
+                return MAVLink_lacmus_detection_batch_message(time_boot_ms, time_utc, camera_id, lat, lon, alt, relative_alt, source_image_index, detection_id, count, objects)
+
+        def lacmus_detection_batch_send(self, time_boot_ms, time_utc, camera_id, lat, lon, alt, relative_alt, source_image_index, detection_id, count, objects, force_mavlink1=False):
+                '''
+                Objects detected on one image, compact replacement of several
+                LACMUS_OBJECT_DETECTED. The image and its detection samples can be
+                requested by source_image_index.
+
+                time_boot_ms              : Timestamp (time since system boot). [ms] (type:uint32_t)
+                time_utc                  : Timestamp (time since UNIX epoch) in UTC. 0 for unknown. [us] (type:uint64_t)
+                camera_id                 : Camera ID (1 for first, 2 for second, etc.) (type:uint8_t)
+                lat                       : Latitude where image was taken [degE7] (type:int32_t)
+                lon                       : Longitude where capture was taken [degE7] (type:int32_t)
+                alt                       : Altitude (MSL) where image was taken [mm] (type:int32_t)
+                relative_alt              : Altitude above ground [mm] (type:int32_t)
+                source_image_index        : Zero based index of this image (image count since armed -1) (type:int32_t)
+                detection_id              : Sequence number of this report, to be confirmed with LACMUS_DETECTION_ACK. (type:uint32_t)
+                count                     : Number of objects. (type:uint8_t)
+                objects                   : 6 bytes per object: x_min, y_min, x_max, y_max in 1/255 of the image width and height, confidence in 1/255, class (0 for person). Unused entries are zero. (type:uint8_t)
+
+                '''
+                return self.send(self.lacmus_detection_batch_encode(time_boot_ms, time_utc, camera_id, lat, lon, alt, relative_alt, source_image_index, detection_id, count, objects), force_mavlink1=force_mavlink1)
+
+        def lacmus_detection_ack_encode(self, target_system, target_component, detection_id):
+                '''
+                Confirms reception of LACMUS_DETECTION_BATCH, unconfirmed reports are
+                retransmitted.
+
+                target_system             : System ID (type:uint8_t)
+                target_component          : Component ID (type:uint8_t)
+                detection_id              : detection_id of the received LACMUS_DETECTION_BATCH. (type:uint32_t)
+
+                '''
+                return MAVLink_lacmus_detection_ack_message(target_system, target_component, detection_id)
+
+        def lacmus_detection_ack_send(self, target_system, target_component, detection_id, force_mavlink1=False):
+                '''
+                Confirms reception of LACMUS_DETECTION_BATCH, unconfirmed reports are
+                retransmitted.
+
+                target_system             : System ID (type:uint8_t)
+                target_component          : Component ID (type:uint8_t)
+                detection_id              : detection_id of the received LACMUS_DETECTION_BATCH. (type:uint32_t)
+
+                '''
+                return self.send(self.lacmus_detection_ack_encode(target_system, target_component, detection_id), force_mavlink1=force_mavlink1)
+
         def heartbeat_encode(self, type, autopilot, base_mode, custom_mode, system_status, mavlink_version=3):
                 '''
                 The heartbeat message shows that a system or component is present and
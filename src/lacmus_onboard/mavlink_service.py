@@ -1,11 +1,26 @@
 import asyncio
+import collections
 import datetime
+import itertools
 import logging
 import math
+import os
 import struct
+import time
 
 # from pymavlink.dialects.v20 import common as mavlink2
 from .mavlink.dialects import lacmus as mavlink2
+from .batch_receive import BatchDatagramEndpoint, parse_batch
+from .camera_server import CameraServer
+from .chips import ChipSender
+from .commands import CommandEngine
+from .downlink import DetectionDownlink
+from .ftp_server import FTPServer
+from .link_monitor import LinkMonitor
+from .parser_thread import ParserThread, ThreadedServerProtocol
+from .scheduler import MessageScheduler
+from .timer_wheel import TimerWheel
+from .vehicle_state import VehicleStateCache
 
 logger = logging.getLogger(__name__)
 
@@ -46,13 +61,76 @@ class MAVLinkServerProtocol:
 
 
 class TransportFile:
-    def __init__(self, transport, proto):
+    """
+    Coalescing writer for the MAVLink file of the service.
+
+    Frames written during one loop iteration are gathered and flushed by a
+    single call_soon callback, packed back to back into datagrams of up to
+    MAX_DATAGRAM_SIZE bytes; a write is never split. Until the first peer
+    appears frames are kept in a pre-connect buffer of MAX_PRECONNECT
+    frames, the oldest are dropped when it is full, and sent with the next
+    flush after the remote address is known.
+    """
+
+    MAX_DATAGRAM_SIZE = 1472  # Ethernet MTU without IP and UDP headers
+    MAX_PRECONNECT = 64
+
+    def __init__(self, transport, proto, loop=None):
         self.transport = transport
         self.proto = proto
+        self.loop = loop or asyncio.get_event_loop()
+        self.frames = []
+        self.preconnect = collections.deque(maxlen=self.MAX_PRECONNECT)
+        self.flush_handle = None
+        self.writes = 0
+        self.datagrams = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+
+    def __str__(self):
+        return "TransportFile(writes {}, datagrams {}, bytes {}, dropped {})".format(
+            self.writes, self.datagrams, self.sent_bytes, self.dropped)
 
     def write(self, data):
-        if self.proto.remote_addr:
-            self.transport.sendto(data, self.proto.remote_addr)
+        self.writes += 1
+        self.frames.append(data)
+        if self.flush_handle is None:
+            self.flush_handle = self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.flush_handle = None
+        frames, self.frames = self.frames, []
+        addr = self.proto.remote_addr
+        if addr is None:
+            overflow = len(self.preconnect) + len(frames) - self.MAX_PRECONNECT
+            if overflow > 0:
+                self.dropped += overflow
+            self.preconnect.extend(frames)
+            return
+        if self.preconnect:
+            frames[:0] = self.preconnect
+            self.preconnect.clear()
+        datagram = bytearray()
+        for frame in frames:
+            if datagram and len(datagram) + len(frame) > self.MAX_DATAGRAM_SIZE:
+                self.sendto(datagram, addr)
+                datagram = bytearray()
+            datagram += frame
+        if datagram:
+            self.sendto(datagram, addr)
+
+    def sendto(self, datagram, addr):
+        self.transport.sendto(bytes(datagram), addr)
+        self.datagrams += 1
+        self.sent_bytes += len(datagram)
+
+    def close(self):
+        """
+        Send what is pending before the transport is closed
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush()
 
 
 class LoggerStatus:
@@ -72,8 +150,26 @@ class MAVLinkService:
         mavlink2.MAVLINK_MSG_ID_COMMAND_LONG,
     )
 
-    def __init__(self, system_id, component_id, udp_endpoint):
-        # TODO: implement DATA_LINK_LOST status on timeouts
+    LINK_TIMEOUT = 3.0
+    MAX_DETECTION_BACKLOG = 1000
+    DETECTION_RATE = 1000  # detections downlink budget [bytes/s]
+
+    # default intervals of periodic streams [s], None - disabled until requested
+    HEARTBEAT_INTERVAL = 1.0
+    SYS_STATUS_INTERVAL = 1.0
+    DETECTION_SUMMARY_INTERVAL = 5.0
+    DETECTION_SUMMARY_NAME = b'LCM_DET'
+    DETECTION_BACKLOG_NAME = b'LCM_BKLG'
+    DETECTION_DROPPED_NAME = b'LCM_DROP'
+
+    CAMERA_INIT_ATTEMPTS = 5
+
+    NO_POSE = {"time_boot_ms": 0, "time_utc": 0, "lat": 0, "lon": 0, "alt": 0, "relative_alt": 0,
+               "q": (0, 0, 0, 0)}
+
+    def __init__(self, system_id, component_id, udp_endpoint, camera=None, ftp_roots=None, ftp_rate=None,
+                 detection_rate=DETECTION_RATE, detection_store=None, parser_thread=False,
+                 batch_receive=False, detector=None):
         self.loop = asyncio.get_event_loop()
         self.udp_endpoint = udp_endpoint
         self.system_id = system_id
@@ -82,9 +178,55 @@ class MAVLinkService:
         self.tasks = []
         self.queue = asyncio.Queue()
         self.mav = mavlink2.MAVLink(None, srcSystem=system_id, srcComponent=component_id)
+        # incoming messages are parsed by self.parser, a separate instance if it runs in a thread
+        self.parser = self.mav
+        self.parser_thread = None
+        if parser_thread:
+            self.parser = mavlink2.MAVLink(None, srcSystem=system_id, srcComponent=component_id)
+            self.parser_thread = ParserThread(self.parser, self.loop, self.deliver_batch)
+        self.batch_receive = batch_receive
         self.transport = None
         self.status = None
         self.local_timestamp = None
+        self.vehicles = VehicleStateCache()
+        self.timers = TimerWheel()
+        self.links = LinkMonitor(self.timers, timeout=self.LINK_TIMEOUT)
+        self.links.add_listener(self.on_link_change)
+        self.downlink = DetectionDownlink(self.mav, detection_rate, max_backlog=self.MAX_DETECTION_BACKLOG,
+                                          store=detection_store)
+        if camera is not None:
+            self.downlink.image_size = camera.RESOLUTION
+        self.downlink.pause()
+        self.detections_count = 0
+        # detector(image) -> [(bbox, confidence, class_id)] of a CapturedImage, no detection without it.
+        # In memory mode image.data has the JPEG, the detector should read the file only without it
+        self.detector = detector
+        self.summary_names = itertools.cycle((self.DETECTION_SUMMARY_NAME, self.DETECTION_BACKLOG_NAME,
+                                              self.DETECTION_DROPPED_NAME))
+        self.start_time = time.monotonic()
+        self.scheduler = MessageScheduler(self.mav)
+        self.scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_HEARTBEAT,
+                                  self.heartbeat_message, self.HEARTBEAT_INTERVAL)
+        self.scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_SYS_STATUS,
+                                  self.sys_status_message, self.SYS_STATUS_INTERVAL)
+        self.scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_NAMED_VALUE_INT,
+                                  self.detection_summary_message, self.DETECTION_SUMMARY_INTERVAL)
+        self.commands = CommandEngine(self.mav, system_id, component_id)
+        self.commands.register(mavlink2.MAV_CMD_SET_MESSAGE_INTERVAL, self.on_set_message_interval, idempotent=True)
+        self.commands.register(mavlink2.MAV_CMD_GET_MESSAGE_INTERVAL, self.on_get_message_interval, idempotent=True)
+        self.commands.register(mavlink2.MAV_CMD_REQUEST_MESSAGE, self.on_request_message, idempotent=True)
+        self.camera = camera
+        self.camera_server = None
+        self.chips = None
+        if camera is not None:
+            self.chips = ChipSender(self.mav, self.downlink.bucket, idle=lambda: self.downlink.idle,
+                                    image_data=camera.image_data)
+            self.chips.pause()
+            self.camera_server = CameraServer(self.mav, camera, self.vehicle_pose_at, self.time_boot_ms)
+            self.camera_server.register(self.scheduler, self.commands)
+            if detector is not None:
+                self.camera_server.add_listener(self.on_image_captured)
+        self.ftp = FTPServer(self.mav, ftp_roots, ftp_rate) if ftp_roots else None
 
     def __str__(self):
         return "MAVLinkService({},{})".format(self.system_id, self.component_id)
@@ -93,16 +235,38 @@ class MAVLinkService:
         logger.info("Starting %s, udp_endpoint: %s, system_id: %s",
                     self, self.udp_endpoint, self.system_id)
         self.running = True
-        transport, protocol = await self.loop.create_datagram_endpoint(
-            lambda: MAVLinkServerProtocol(self.mav, self.queue),
-            local_addr=self.udp_endpoint,
-        )
+        if self.camera is not None:
+            for n in range(self.CAMERA_INIT_ATTEMPTS):
+                if await self.camera.init():
+                    break
+            else:
+                raise RuntimeError("Camera init failure")
+        if self.parser_thread is not None:
+            self.parser_thread.start()
+        if self.batch_receive:
+            on_batch = self.parser_thread.submit if self.parser_thread is not None else self.receive_batch
+            transport = protocol = BatchDatagramEndpoint(self.loop, on_batch).open(self.udp_endpoint)
+        else:
+            if self.parser_thread is not None:
+                protocol_factory = lambda: ThreadedServerProtocol(self.parser_thread)
+            else:
+                protocol_factory = lambda: MAVLinkServerProtocol(self.mav, self.queue)
+            transport, protocol = await self.loop.create_datagram_endpoint(
+                protocol_factory,
+                local_addr=self.udp_endpoint,
+            )
         self.transport = transport
         self.mav.file = TransportFile(transport, protocol)
         consume_task = self.loop.create_task(self.consume())
-        heartbeat_task = self.loop.create_task(self.heartbeat())
+        scheduler_task = self.loop.create_task(self.scheduler.run())
+        timers_task = self.loop.create_task(self.run_timers())
+        downlink_task = self.loop.create_task(self.downlink.run())
         self.tasks.append(consume_task)
-        self.tasks.append(heartbeat_task)
+        self.tasks.append(scheduler_task)
+        self.tasks.append(timers_task)
+        self.tasks.append(downlink_task)
+        if self.chips is not None:
+            self.tasks.append(self.loop.create_task(self.chips.run()))
         self.status = LoggerStatus.WAIT_DATA
         logger.info("Started %s", self)
 
@@ -112,42 +276,140 @@ class MAVLinkService:
         for task in self.tasks:
             task.cancel()
         await asyncio.wait(self.tasks)
+        await self.commands.close()
+        self.downlink.close()
+        if self.ftp is not None:
+            self.ftp.close()
+        if self.camera_server is not None:
+            await self.camera_server.close()
+            await self.camera.close()
+        self.mav.file.close()
+        logger.info("%s", self.mav.file)
         self.transport.close()
+        if self.parser_thread is not None:
+            self.parser_thread.stop()
         logger.info("Stopped %s", self)
 
     async def process_message(self, msg):
         mid = msg.get_msgId()
+        self.links.seen(msg.get_srcSystem(), msg.get_srcComponent())
+        self.vehicles.update(msg)
         if mid in self.MESSAGE_IDS:
             print(msg.get_srcSystem(), msg.get_srcComponent(), msg.to_dict())
+        if mid in (mavlink2.MAVLINK_MSG_ID_COMMAND_LONG, mavlink2.MAVLINK_MSG_ID_COMMAND_INT):
+            self.commands.handle(msg)
+        if mid == mavlink2.MAVLINK_MSG_ID_LACMUS_DETECTION_ACK:
+            if msg.target_system in (0, self.system_id) and msg.target_component in (0, self.component_id):
+                self.downlink.ack(msg.detection_id)
+        if mid == mavlink2.MAVLINK_MSG_ID_FILE_TRANSFER_PROTOCOL:
+            if self.ftp is not None and msg.target_system in (0, self.system_id) \
+                    and msg.target_component in (0, self.component_id):
+                self.ftp.handle(msg)
         if mid == mavlink2.MAVLINK_MSG_ID_CAMERA_TRIGGER:
-            capture = {
-                "time_boot_ms": 100,                  # : Timestamp (time since system boot). [ms] (type:uint32_t)
-                "time_utc": 1234,                     # : Timestamp (time since UNIX epoch) in UTC. 0 for unknown. [us] (type:uint64_t)
-                "camera_id": 1,                       # : Camera ID (1 for first, 2 for second, etc.) (type:uint8_t)
-                "lat": 1231233,                       # : Latitude where image was taken [degE7] (type:int32_t)
-                "lon": 3321312,                       # : Longitude where capture was taken [degE7] (type:int32_t)
-                "alt": 12,                            # : Altitude (MSL) where image was taken [mm] (type:int32_t)
-                "relative_alt": 22,                   # : Altitude above ground [mm] (type:int32_t)
-                "q": (0, 0, 0, 0),                    # : Quaternion of camera orientation (w, x, y, z order, zero-rotation is 0, 0, 0, 0) (type:float)
-                "image_index": 7,                     # : Zero based index of this image (image count since armed -1) (type:int32_t)
-                "capture_result": True,               # : Boolean indicating success (1) or failure (0) while capturing this image. (type:int8_t)
-                "file_url": b'/captures/image_7.jpg',  # : URL of image taken. Either local storage or http://foo.jpg if camera provides an HTTP interface. (type:char)
-            }
-            self.mav.camera_image_captured_send(**capture)
-
+            if self.camera_server is None:
+                logger.warning("Camera trigger %s ignored, no camera", msg.seq)
+            else:
+                self.camera_server.trigger()
+
+    def vehicle_pose_at(self, time_usec):
+        pose = self.vehicles.pose_at(self.system_id, time_usec)
+        if pose is None:
+            logger.warning("No telemetry from system %s, capture is not geotagged", self.system_id)
+            pose = dict(self.NO_POSE)
+        return pose
+
+    def on_image_captured(self, image):
+        try:
+            found = self.detector(image)
+        except Exception as e:
+            logger.exception("Detection on %s failed: %s", image.path, e)
+            return
+        pose = dict(image.pose)
+        pose.pop("q")
+        for bbox, confidence, class_id in found:
             detection = {
-                "time_boot_ms": 100,                  # : Timestamp (time since system boot). [ms] (type:uint32_t)
-                "time_utc": 1234,                     # : Timestamp (time since UNIX epoch) in UTC. 0 for unknown. [us] (type:uint64_t)
-                "camera_id": 1,                       # : Camera ID (1 for first, 2 for second, etc.) (type:uint8_t)
-                "lat": 1231233,                       # : Latitude where image was taken [degE7] (type:int32_t)
-                "lon": 3321312,                       # : Longitude where capture was taken [degE7] (type:int32_t)
-                "alt": 12,                            # : Altitude (MSL) where image was taken [mm] (type:int32_t)
-                "relative_alt": 22,                   # : Altitude above ground [mm] (type:int32_t)
-                "bbox": (12, 12, 200, 200),                 # : Bound box of detected object (type:uint16_t)
-                "source_image_index": 7,                     # : Zero based index of this image (image count since armed -1) (type:int32_t)
-                "file_url": b'/detections/7/image_7.jpg',  # : URL of image taken. Either local storage or http://foo.jpg if camera provides an HTTP interface. (type:char)
+                "camera_id": self.camera_server.CAMERA_ID,    # : Camera ID (1 for first, 2 for second, etc.) (type:uint8_t)
+                "bbox": tuple(bbox),                         # : Bound box of detected object (type:uint16_t)
+                "source_image_index": image.index,            # : Zero based index of this image (image count since armed -1) (type:int32_t)
+                "confidence": confidence,
+                "class_id": class_id,
             }
-            self.mav.lacmus_object_detected_send(**detection)
+            self.detections_count += 1
+            self.send_detection(dict(detection, **pose))
+            self.chips.add(image.path, detection["bbox"], "image={} bbox={}".format(
+                image.index, ",".join(map(str, detection["bbox"]))))
+
+    def on_set_message_interval(self, cmd):
+        return self.scheduler.set_interval(int(cmd.params[0]), int(cmd.params[1]))
+
+    def on_get_message_interval(self, cmd):
+        msg_id = int(cmd.params[0])
+        self.mav.message_interval_send(msg_id, self.scheduler.get_interval(msg_id))
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    def on_request_message(self, cmd):
+        return self.scheduler.request(int(cmd.params[0]))
+
+    def time_boot_ms(self):
+        return int((time.monotonic() - self.start_time) * 1000) & 0xFFFFFFFF
+
+    def heartbeat_message(self):
+        return self.mav.heartbeat_encode(mavlink2.MAV_TYPE_ONBOARD_CONTROLLER,
+                                         mavlink2.MAV_AUTOPILOT_INVALID, 0, 0, mavlink2.MAV_STATE_ACTIVE)
+
+    def sys_status_message(self):
+        load = min(int(os.getloadavg()[0] / (os.cpu_count() or 1) * 1000), 1000)
+        return self.mav.sys_status_encode(0, 0, 0, load, 0xFFFF, -1, -1, 0,
+                                          min(self.parser.total_receive_errors, 0xFFFF), 0, 0, 0, 0)
+
+    def detection_summary_message(self):
+        if self.downlink.retransmitting:
+            # leave the link to unconfirmed detections
+            return None
+        # detections count, downlink backlog and dropped detections in turn
+        name = next(self.summary_names)
+        value = {
+            self.DETECTION_SUMMARY_NAME: self.detections_count,
+            self.DETECTION_BACKLOG_NAME: self.downlink.backlog,
+            self.DETECTION_DROPPED_NAME: self.downlink.dropped,
+        }[name]
+        return self.mav.named_value_int_encode(self.time_boot_ms(), name, value)
+
+    def send_detection(self, detection):
+        """
+        Queue detection for the downlink, see DetectionDownlink for the fields.
+        Detections are held back while the data link is down
+        """
+        self.downlink.add(detection)
+
+    def on_link_change(self, peer, alive):
+        if self.links.link_alive:
+            if self.status != LoggerStatus.DATA_RECEIVED:
+                logger.info("Data link is up, sending %s paused detections", self.downlink.backlog)
+                self.status = LoggerStatus.DATA_RECEIVED
+                self.downlink.resume()
+                if self.chips is not None:
+                    self.chips.resume()
+        elif self.status == LoggerStatus.DATA_RECEIVED:
+            logger.warning("Data link lost, pausing detections downlink, %s", self.downlink)
+            self.status = LoggerStatus.DATA_LINK_LOST
+            self.downlink.pause()
+            if self.chips is not None:
+                self.chips.pause(since=max(peer.last_seen for peer in self.links.peers.values()))
+
+    def receive_batch(self, data):
+        """
+        Datagrams of one BatchDatagramEndpoint wakeup
+        """
+        self.deliver_batch(parse_batch(self.parser, data))
+
+    def deliver_batch(self, msgs):
+        """
+        Messages parsed by the parser thread, called in the event loop
+        """
+        put = self.queue.put_nowait
+        for msg in msgs:
+            put(msg)
 
     async def consume(self):
         logger.info('Start consume task for %s', self)
@@ -161,13 +423,15 @@ class MAVLinkService:
                 logger.exception("Error: %s", e)
         logger.info('Exit from consume task for %s', self)
 
-    async def heartbeat(self):
-        logger.info('Start heartbeat task for %s', self)
+    async def run_timers(self):
+        logger.info('Start timers task for %s', self)
         while self.running:
-            self.mav.heartbeat_send(mavlink2.MAV_TYPE_ONBOARD_CONTROLLER,
-                                    mavlink2.MAV_AUTOPILOT_INVALID, 0, 0, mavlink2.MAV_STATE_ACTIVE)
-            await asyncio.sleep(1)
-        logger.info('Exit from heartbeat task for %s', self)
+            try:
+                self.timers.advance()
+            except Exception as e:
+                logger.exception("Error: %s", e)
+            await asyncio.sleep(self.timers.resolution)
+        logger.info('Exit from timers task for %s', self)
 
 
 if __name__ == '__main__':
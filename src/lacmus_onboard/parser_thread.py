@@ -0,0 +1,92 @@
+import collections
+import logging
+import threading
+
+from .batch_receive import parse_batch
+
+logger = logging.getLogger(__name__)
+
+
+class ParserThread:
+    """
+    Parses MAVLink datagrams in a dedicated thread.
+
+    The event loop only appends raw datagrams to a deque, the thread drains
+    it, parses everything it got and hands the messages back to the loop
+    with a single call_soon_threadsafe per batch. The parser must not be
+    used by the loop at the same time, MAVLinkService gives it a separate
+    MAVLink instance.
+    """
+
+    def __init__(self, parser, loop, deliver):
+        self.parser = parser
+        self.loop = loop
+        self.deliver = deliver
+        self.datagrams = collections.deque()
+        self.ready = threading.Event()
+        self.running = False
+        self.thread = None
+        self.batches = 0
+        self.messages = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='mavlink-parser', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.ready.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, data):
+        # deque.append is atomic, the event is only touched when the thread sleeps
+        self.datagrams.append(data)
+        if not self.ready.is_set():
+            self.ready.set()
+
+    def run(self):
+        logger.info('Start MAVLink parser thread')
+        datagrams = self.datagrams
+        while self.running:
+            self.ready.wait()
+            self.ready.clear()
+            batch = []
+            while datagrams:
+                batch.extend(parse_batch(self.parser, datagrams.popleft()))
+            if batch:
+                self.batches += 1
+                self.messages += len(batch)
+                try:
+                    self.loop.call_soon_threadsafe(self.deliver, batch)
+                except RuntimeError:  # the loop is closed
+                    break
+        logger.info('Exit from MAVLink parser thread')
+
+
+class ThreadedServerProtocol:
+    """
+    Datagram protocol which leaves parsing to a ParserThread
+    """
+
+    def __init__(self, parser_thread):
+        self.parser_thread = parser_thread
+        self.parser = parser_thread.parser
+        self.remote_addr = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        logger.info('Connection lost: %s', exc)
+
+    def datagram_received(self, data, addr):
+        if addr != self.remote_addr:
+            logger.info("New remote address: %s", addr)
+            self.remote_addr = addr
+        self.parser_thread.submit(data)
+
+    def error_received(self, exc):
+        logger.error('Error received: %s', exc)
@@ -0,0 +1,163 @@
+import numpy as np
+
+
+def slerp(q0, q1, fraction):
+    """
+    Spherical linear interpolation between arrays of (w, x, y, z) quaternions.
+    q0, q1 have shape (N, 4), fraction has shape (N,).
+    """
+    dot = np.einsum('ij,ij->i', q0, q1)
+    # take the short way round
+    q1 = np.where((dot < 0)[:, None], -q1, q1)
+    dot = np.abs(dot)
+
+    w0 = 1.0 - fraction
+    w1 = fraction.copy()
+    # fall back to normalised lerp for nearly parallel quaternions
+    spherical = dot < 0.9995
+    if spherical.any():
+        theta = np.arccos(np.clip(dot[spherical], -1.0, 1.0))
+        sin_theta = np.sin(theta)
+        w0[spherical] = np.sin(w0[spherical] * theta) / sin_theta
+        w1[spherical] = np.sin(w1[spherical] * theta) / sin_theta
+
+    q = q0 * w0[:, None] + q1 * w1[:, None]
+    norm = np.linalg.norm(q, axis=1)
+    norm[norm == 0] = 1.0
+    return q / norm[:, None]
+
+
+class TimeSeriesRing:
+    """
+    Fixed-size ring buffer of timestamped sample rows.
+
+    Samples are expected in timestamp order, older ones are silently dropped.
+    A jump back by more than max_backwards_jump means the clock was reset,
+    e.g. the autopilot rebooted, and the ring starts over with the sample.
+    A contiguous time ordered view is rebuilt lazily on the first lookup after
+    an append, so batches of lookups share a single copy.
+    """
+
+    def __init__(self, capacity, width, max_backwards_jump=5.0):
+        self.capacity = capacity
+        self.max_backwards_jump = max_backwards_jump
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, width), dtype=np.float64)
+        self.head = 0
+        self.size = 0
+        self._ordered = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def last_time(self):
+        if self.size == 0:
+            return None
+        return self.times[(self.head - 1) % self.capacity]
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+        self._ordered = None
+
+    def append(self, t, row):
+        last_time = self.last_time
+        if last_time is not None and t < last_time:
+            if last_time - t <= self.max_backwards_jump:
+                return False
+            self.clear()
+            last_time = None
+        if last_time is not None and t == last_time:
+            # same sample time, keep the latest value
+            self.values[(self.head - 1) % self.capacity] = row
+        else:
+            self.times[self.head] = t
+            self.values[self.head] = row
+            self.head = (self.head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+        self._ordered = None
+        return True
+
+    def ordered(self):
+        if self._ordered is None:
+            if self.size < self.capacity:
+                self._ordered = self.times[:self.size], self.values[:self.size]
+            else:
+                self._ordered = (np.roll(self.times, -self.head),
+                                 np.roll(self.values, -self.head, axis=0))
+        return self._ordered
+
+    def bracket(self, t):
+        """
+        Return indices of the samples around each timestamp in t and the
+        interpolation fraction between them. Timestamps outside of the stored
+        range are clamped to the first/last sample.
+        """
+        times, values = self.ordered()
+        hi = np.searchsorted(times, t, side='right')
+        hi = np.clip(hi, 1, max(self.size - 1, 1))
+        lo = hi - 1
+        if self.size == 1:
+            hi = lo
+            fraction = np.zeros(len(t))
+        else:
+            span = times[hi] - times[lo]
+            fraction = np.clip((t - times[lo]) / span, 0.0, 1.0)
+        return values[lo], values[hi], fraction
+
+
+class PoseHistory:
+    """
+    Recent position and attitude samples of a single vehicle.
+
+    Timestamps are autopilot boot time in seconds. Lookups accept a scalar or
+    an array of timestamps and return one row per timestamp.
+    """
+
+    def __init__(self, capacity=512):
+        # lat [degE7], lon [degE7], alt [mm], relative_alt [mm]
+        self.positions = TimeSeriesRing(capacity, 4)
+        # w, x, y, z
+        self.attitudes = TimeSeriesRing(capacity, 4)
+
+    def add_position(self, t, lat, lon, alt, relative_alt):
+        return self.positions.append(t, (lat, lon, alt, relative_alt))
+
+    def add_attitude(self, t, q):
+        return self.attitudes.append(t, q)
+
+    def position_at(self, t):
+        """
+        Linearly interpolated (lat, lon, alt, relative_alt) rows, None if no
+        position was received yet
+        """
+        if not self.positions:
+            return None
+        t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+        before, after, fraction = self.positions.bracket(t)
+        return before + (after - before) * fraction[:, None]
+
+    def attitude_at(self, t):
+        """
+        Slerp interpolated (w, x, y, z) rows, None if no attitude was received yet
+        """
+        if not self.attitudes:
+            return None
+        t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+        before, after, fraction = self.attitudes.bracket(t)
+        return slerp(before, after, fraction)
+
+    def pose_at(self, t):
+        """
+        Pose fields of MAVLink capture/detection messages for a single timestamp
+        """
+        pose = {}
+        position = self.position_at(t)
+        if position is not None:
+            lat, lon, alt, relative_alt = np.rint(position[0]).astype(np.int64).tolist()
+            pose.update(lat=lat, lon=lon, alt=alt, relative_alt=relative_alt)
+        attitude = self.attitude_at(t)
+        if attitude is not None:
+            pose['q'] = tuple(attitude[0].tolist())
+        return pose
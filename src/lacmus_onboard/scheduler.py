@@ -0,0 +1,160 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from .mavlink.dialects import lacmus as mavlink2
+
+logger = logging.getLogger(__name__)
+
+
+class Stream:
+    __slots__ = ('msg_id', 'builder', 'default_interval', 'interval', 'deadline', 'entry')
+
+    def __init__(self, msg_id, builder, default_interval):
+        self.msg_id = msg_id
+        self.builder = builder
+        self.default_interval = default_interval
+        self.interval = default_interval
+        self.deadline = None
+        self.entry = None
+
+
+class MessageScheduler:
+    """
+    Periodic MAVLink message streams served from a single task.
+
+    Each stream has a message builder returning an encoded MAVLink message
+    (or None to skip) and an interval in seconds, None for disabled streams.
+    Deadlines are kept in a heap, entries of rescheduled streams are dropped
+    lazily. All messages due within one tick are packed and written to the
+    link with a single write.
+    """
+
+    def __init__(self, mav, tick=0.01, clock=time.monotonic):
+        self.mav = mav
+        self.tick = tick
+        self.clock = clock
+        self.streams = {}
+        self.heap = []
+        self.entries = itertools.count()
+        self.wakeup = asyncio.Event()
+
+    def add_stream(self, msg_id, builder, interval=None):
+        stream = self.streams[msg_id] = Stream(msg_id, builder, interval)
+        self._schedule(stream, self.clock())
+        return stream
+
+    def _schedule(self, stream, when):
+        if stream.interval is None:
+            stream.deadline = stream.entry = None
+            return
+        stream.deadline = when
+        stream.entry = next(self.entries)
+        heapq.heappush(self.heap, (when, stream.entry, stream.msg_id))
+        self.wakeup.set()
+
+    def get_interval(self, msg_id):
+        """
+        Stream interval in MESSAGE_INTERVAL units: [us], -1 if disabled, 0 if not available
+        """
+        stream = self.streams.get(msg_id)
+        if stream is None:
+            return 0
+        if stream.interval is None:
+            return -1
+        return int(stream.interval * 1e6)
+
+    def set_interval(self, msg_id, interval_us):
+        """
+        MAV_CMD_SET_MESSAGE_INTERVAL: interval in [us], -1 to disable, 0 for default rate
+        """
+        stream = self.streams.get(msg_id)
+        if stream is None:
+            return mavlink2.MAV_RESULT_UNSUPPORTED
+        if interval_us < 0:
+            interval = None
+        elif interval_us == 0:
+            interval = stream.default_interval
+        else:
+            interval = interval_us / 1e6
+        logger.info("Set interval of message %s to %s s", msg_id, interval)
+        stream.interval = interval
+        self._schedule(stream, self.clock())
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    def request(self, msg_id):
+        """
+        MAV_CMD_REQUEST_MESSAGE: send a single instance of the message now
+        """
+        stream = self.streams.get(msg_id)
+        if stream is None:
+            return mavlink2.MAV_RESULT_UNSUPPORTED
+        msg = stream.builder()
+        if msg is None:
+            return mavlink2.MAV_RESULT_FAILED
+        self.send_batch([msg])
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    def send_batch(self, msgs):
+        mav = self.mav
+        buf = bytearray()
+        for msg in msgs:
+            buf += msg.pack(mav)
+            mav.seq = (mav.seq + 1) % 256
+            mav.total_packets_sent += 1
+        mav.total_bytes_sent += len(buf)
+        mav.file.write(bytes(buf))
+
+    def pop_due(self, now):
+        """
+        Return streams due before the end of the current tick and reschedule them
+        """
+        due = []
+        horizon = now + self.tick
+        while self.heap and self.heap[0][0] <= horizon:
+            deadline, entry, msg_id = heapq.heappop(self.heap)
+            stream = self.streams[msg_id]
+            if stream.entry != entry:
+                # stale entry of a rescheduled or disabled stream
+                continue
+            due.append(stream)
+        for stream in due:
+            # keep the phase, but don't try to catch up after a stall
+            self._schedule(stream, max(stream.deadline + stream.interval, now))
+        return due
+
+    def next_deadline(self):
+        while self.heap:
+            deadline, entry, msg_id = self.heap[0]
+            if self.streams[msg_id].entry == entry:
+                return deadline
+            heapq.heappop(self.heap)
+        return None
+
+    async def run(self):
+        logger.info('Start message scheduler')
+        while True:
+            msgs = []
+            for stream in self.pop_due(self.clock()):
+                try:
+                    msg = stream.builder()
+                except Exception as e:
+                    logger.exception("Error building message %s: %s", stream.msg_id, e)
+                    continue
+                if msg is not None:
+                    msgs.append(msg)
+            if msgs:
+                self.send_batch(msgs)
+
+            self.wakeup.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(deadline - self.clock(), 0)
+            # not wait_for: it can swallow a cancellation that races with the wakeup
+            timer = None if timeout is None else asyncio.get_event_loop().call_later(timeout, self.wakeup.set)
+            try:
+                await self.wakeup.wait()
+            finally:
+                if timer is not None:
+                    timer.cancel()
@@ -0,0 +1,104 @@
+import time
+
+
+class Timer:
+    __slots__ = ('expires', 'callback', 'args', 'cancelled')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel.
+
+    Time is split into ticks of `resolution` seconds. Level 0 has one slot per
+    tick, every next level has slots `2 ** bits` times wider. Timers far in the
+    future sit in an upper level and cascade down as the wheel turns, so
+    scheduling, cancelling and expiring are O(1) regardless of the number of
+    timers. The wheel does not run by itself, the owner calls `advance()`
+    periodically.
+    """
+
+    def __init__(self, resolution=0.1, bits=6, levels=4, clock=time.monotonic):
+        self.resolution = resolution
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.max_ticks = (1 << (bits * levels)) - 1
+        self.clock = clock
+        self.current_tick = self._tick(clock())
+        self.wheels = [[[] for _ in range(1 << bits)] for _ in range(levels)]
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def _tick(self, when):
+        return int(when / self.resolution)
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args):
+        # round up so that a timer never fires early
+        expires = max(-int(-when // self.resolution), self.current_tick + 1)
+        timer = Timer(expires, callback, args)
+        self._insert(timer)
+        self.pending += 1
+        return timer
+
+    def _insert(self, timer):
+        delta = timer.expires - self.current_tick
+        expires = timer.expires
+        if delta > self.max_ticks:
+            # out of range, park in the top level and re-insert on cascade
+            delta = self.max_ticks
+            expires = self.current_tick + delta
+        for level in range(self.levels):
+            if delta < 1 << (self.bits * (level + 1)) or level == self.levels - 1:
+                slot = (expires >> (self.bits * level)) & self.mask
+                self.wheels[level][slot].append(timer)
+                return
+
+    def _cascade(self, level):
+        slot = (self.current_tick >> (self.bits * level)) & self.mask
+        timers = self.wheels[level][slot]
+        self.wheels[level][slot] = []
+        for timer in timers:
+            if timer.cancelled:
+                self.pending -= 1
+            else:
+                self._insert(timer)
+        return slot
+
+    def advance(self, now=None):
+        """
+        Turn the wheel up to `now` running callbacks of expired timers.
+        Return the number of callbacks run.
+        """
+        target = self._tick(self.clock() if now is None else now)
+        fired = 0
+        while self.current_tick < target:
+            self.current_tick += 1
+            level = 1
+            while level < self.levels and (self.current_tick >> (self.bits * (level - 1))) & self.mask == 0:
+                if self._cascade(level) != 0:
+                    break
+                level += 1
+
+            slot = self.current_tick & self.mask
+            timers = self.wheels[0][slot]
+            self.wheels[0][slot] = []
+            for timer in timers:
+                self.pending -= 1
+                if not timer.cancelled:
+                    timer.callback(*timer.args)
+                    fired += 1
+        return fired
@@ -0,0 +1,217 @@
+import collections
+import math
+import time
+
+from .mavlink.dialects import lacmus as mavlink2
+from .pose_history import PoseHistory
+
+
+# timestamps above this are UNIX time, below - time since boot (2000-01-01)
+UNIX_TIME_THRESHOLD_US = 946684800 * 1000000
+
+
+VehicleSnapshot = collections.namedtuple('VehicleSnapshot', (
+    'system_id',
+    'time_boot_ms',       # autopilot boot time of the latest sample [ms]
+    'time_utc',           # UNIX time derived from SYSTEM_TIME, 0 if unknown [us]
+    'lat',                # [degE7]
+    'lon',                # [degE7]
+    'alt',                # MSL [mm]
+    'relative_alt',       # above home [mm]
+    'q',                  # attitude quaternion (w, x, y, z), (0, 0, 0, 0) if unknown
+    'fix_type',           # GPS_FIX_TYPE of the latest GPS_RAW_INT
+    'satellites_visible',
+    'position_received',  # local monotonic time of the latest position [s], 0 if none
+    'attitude_received',  # local monotonic time of the latest attitude [s], 0 if none
+))
+
+
+def euler_to_quaternion(roll, pitch, yaw):
+    """
+    Convert aeronautical euler angles [rad] to a (w, x, y, z) quaternion
+    """
+    cr, sr = math.cos(roll / 2), math.sin(roll / 2)
+    cp, sp = math.cos(pitch / 2), math.sin(pitch / 2)
+    cy, sy = math.cos(yaw / 2), math.sin(yaw / 2)
+    return (
+        cr * cp * cy + sr * sp * sy,
+        sr * cp * cy - cr * sp * sy,
+        cr * sp * cy + sr * cp * sy,
+        cr * cp * sy - sr * sp * cy,
+    )
+
+
+class VehicleState:
+    """
+    Latest known telemetry of a single MAVLink system.
+
+    Every update overwrites a fixed set of slots, readers get an immutable
+    snapshot which is built once per update and shared until the next one.
+    """
+
+    __slots__ = (
+        'system_id', 'time_boot_ms', 'time_offset_us',
+        'lat', 'lon', 'alt', 'relative_alt', 'q',
+        'fix_type', 'satellites_visible',
+        'position_received', 'attitude_received',
+        '_snapshot',
+    )
+
+    def __init__(self, system_id):
+        self.system_id = system_id
+        self.time_boot_ms = 0
+        self.time_offset_us = None  # time_unix_usec - time_boot_ms * 1000
+        self.lat = 0
+        self.lon = 0
+        self.alt = 0
+        self.relative_alt = 0
+        self.q = (0, 0, 0, 0)
+        self.fix_type = mavlink2.GPS_FIX_TYPE_NO_GPS
+        self.satellites_visible = 0
+        self.position_received = 0
+        self.attitude_received = 0
+        self._snapshot = None
+
+    def __str__(self):
+        return "VehicleState({})".format(self.system_id)
+
+    @property
+    def time_utc(self):
+        if self.time_offset_us is None:
+            return 0
+        return self.time_offset_us + self.time_boot_ms * 1000
+
+    def update_global_position(self, msg, now):
+        self.time_boot_ms = msg.time_boot_ms
+        self.lat = msg.lat
+        self.lon = msg.lon
+        self.alt = msg.alt
+        self.relative_alt = msg.relative_alt
+        self.position_received = now
+        self._snapshot = None
+
+    def update_attitude(self, msg, now):
+        self.time_boot_ms = msg.time_boot_ms
+        self.q = euler_to_quaternion(msg.roll, msg.pitch, msg.yaw)
+        self.attitude_received = now
+        self._snapshot = None
+
+    def update_attitude_quaternion(self, msg, now):
+        self.time_boot_ms = msg.time_boot_ms
+        self.q = (msg.q1, msg.q2, msg.q3, msg.q4)
+        self.attitude_received = now
+        self._snapshot = None
+
+    def update_gps_raw(self, msg, now):
+        self.fix_type = msg.fix_type
+        self.satellites_visible = msg.satellites_visible
+        self._snapshot = None
+
+    def update_system_time(self, msg, now):
+        if msg.time_unix_usec:
+            self.time_offset_us = msg.time_unix_usec - msg.time_boot_ms * 1000
+        self.time_boot_ms = msg.time_boot_ms
+        self._snapshot = None
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self._snapshot = VehicleSnapshot(
+                self.system_id, self.time_boot_ms, self.time_utc,
+                self.lat, self.lon, self.alt, self.relative_alt, self.q,
+                self.fix_type, self.satellites_visible,
+                self.position_received, self.attitude_received,
+            )
+        return snapshot
+
+
+class VehicleStateCache:
+    """
+    Telemetry state and pose history of all systems seen on the link, keyed
+    by source system id
+    """
+
+    UPDATERS = {
+        mavlink2.MAVLINK_MSG_ID_GLOBAL_POSITION_INT: VehicleState.update_global_position,
+        mavlink2.MAVLINK_MSG_ID_ATTITUDE: VehicleState.update_attitude,
+        mavlink2.MAVLINK_MSG_ID_ATTITUDE_QUATERNION: VehicleState.update_attitude_quaternion,
+        mavlink2.MAVLINK_MSG_ID_GPS_RAW_INT: VehicleState.update_gps_raw,
+        mavlink2.MAVLINK_MSG_ID_SYSTEM_TIME: VehicleState.update_system_time,
+    }
+
+    def __init__(self, clock=time.monotonic, history_size=512):
+        self.clock = clock
+        self.history_size = history_size
+        self.vehicles = {}
+        self.histories = {}
+
+    def __contains__(self, system_id):
+        return system_id in self.vehicles
+
+    def update(self, msg):
+        """
+        Apply telemetry message to the state of its source system.
+        Return True if the message was consumed.
+        """
+        updater = self.UPDATERS.get(msg.get_msgId())
+        if updater is None:
+            return False
+        system_id = msg.get_srcSystem()
+        state = self.vehicles.get(system_id)
+        if state is None:
+            state = self.vehicles[system_id] = VehicleState(system_id)
+            self.histories[system_id] = PoseHistory(self.history_size)
+        updater(state, msg, self.clock())
+
+        mid = msg.get_msgId()
+        if mid == mavlink2.MAVLINK_MSG_ID_GLOBAL_POSITION_INT:
+            self.histories[system_id].add_position(
+                msg.time_boot_ms / 1000, msg.lat, msg.lon, msg.alt, msg.relative_alt)
+        elif mid in (mavlink2.MAVLINK_MSG_ID_ATTITUDE, mavlink2.MAVLINK_MSG_ID_ATTITUDE_QUATERNION):
+            self.histories[system_id].add_attitude(msg.time_boot_ms / 1000, state.q)
+        return True
+
+    def get(self, system_id):
+        state = self.vehicles.get(system_id)
+        if state is None:
+            return None
+        return state.snapshot()
+
+    def history(self, system_id):
+        return self.histories.get(system_id)
+
+    def pose_at(self, system_id, time_usec=0):
+        """
+        Pose fields for CAMERA_IMAGE_CAPTURED / LACMUS_OBJECT_DETECTED at the
+        given capture time. time_usec is either UNIX time or time since boot,
+        0 means the latest known pose. Return None if the system is unknown.
+        """
+        state = self.vehicles.get(system_id)
+        if state is None:
+            return None
+        snapshot = state.snapshot()
+        pose = {
+            "time_boot_ms": snapshot.time_boot_ms,
+            "time_utc": snapshot.time_utc,
+            "lat": snapshot.lat,
+            "lon": snapshot.lon,
+            "alt": snapshot.alt,
+            "relative_alt": snapshot.relative_alt,
+            "q": snapshot.q,
+        }
+        if not time_usec:
+            return pose
+
+        if time_usec >= UNIX_TIME_THRESHOLD_US:
+            if state.time_offset_us is None:
+                return pose
+            time_utc = time_usec
+            time_boot_us = time_usec - state.time_offset_us
+        else:
+            time_boot_us = time_usec
+            time_utc = 0 if state.time_offset_us is None else time_usec + state.time_offset_us
+
+        pose.update(self.histories[system_id].pose_at(time_boot_us / 1000000))
+        pose["time_boot_ms"] = time_boot_us // 1000
+        pose["time_utc"] = time_utc
+        return pose
@@ -0,0 +1,43 @@
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Collector:
+    """
+    MAVLink file of the service under test, keeps what was written
+    """
+
+    def __init__(self):
+        self.parser = mavlink2.MAVLink(None)
+        self.writes = []
+        self.msgs = []
+        self.bytes = 0
+
+    def write(self, data):
+        self.writes.append(data)
+        self.bytes += len(data)
+        self.msgs.extend(self.parser.parse_buffer(data) or [])
+
+    def of_type(self, name):
+        return [msg for msg in self.msgs if msg.get_type() == name]
+
+    @property
+    def acks(self):
+        return [(msg.command, msg.result, msg.progress) for msg in self.of_type('COMMAND_ACK')]
+
+
+def command_long(command, *params, confirmation=0, target_system=1, target_component=100):
+    """
+    COMMAND_LONG from a GCS as the service receives it
+    """
+    gcs = mavlink2.MAVLink(None, srcSystem=255, srcComponent=190)
+    params = (list(params) + [0] * 7)[:7]
+    msg = gcs.command_long_encode(target_system, target_component, command, confirmation, *params)
+    return mavlink2.MAVLink(None).parse_buffer(msg.pack(gcs))[0]
@@ -0,0 +1,73 @@
+import asyncio
+import socket
+
+import pytest
+
+from lacmus_onboard import benchmark
+from lacmus_onboard.batch_receive import BatchDatagramEndpoint, parse_batch
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+
+
+def heartbeat(sender, custom_mode):
+    return sender.heartbeat_encode(6, 8, 0, custom_mode, 0).pack(sender)
+
+
+def test_bad_frame_does_not_drop_the_rest_of_the_batch():
+    sender = mavlink2.MAVLink(None, srcSystem=2, srcComponent=1)
+    bad = bytearray(heartbeat(sender, 1))
+    bad[-1] ^= 0xFF
+    data = heartbeat(sender, 0) + bytes(bad) + heartbeat(sender, 2) + heartbeat(sender, 3)
+    msgs = parse_batch(mavlink2.MAVLink(None), data)
+    assert [msg.custom_mode for msg in msgs] == [0, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_pending_datagrams_are_delivered_in_one_batch():
+    loop = asyncio.get_event_loop()
+    batches = []
+    endpoint = BatchDatagramEndpoint(loop, batches.append).open(('127.0.0.1', 0))
+    sender = mavlink2.MAVLink(None, srcSystem=2, srcComponent=1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for n in range(10):
+            sock.sendto(heartbeat(sender, n), endpoint.get_extra_info('sockname'))
+        for n in range(100):
+            await asyncio.sleep(0.01)
+            if batches:
+                break
+        assert len(batches) == 1
+        assert endpoint.datagrams == 10
+        assert [msg.custom_mode for msg in parse_batch(mavlink2.MAVLink(None), batches[0])] == list(range(10))
+        assert endpoint.remote_addr[1] == sock.getsockname()[1]
+        endpoint.sendto(b'pong', endpoint.remote_addr)
+        assert sock.recv(16) == b'pong'
+    finally:
+        sock.close()
+        endpoint.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('parser_thread', (False, True))
+async def test_service_receives_batches(parser_thread):
+    from lacmus_onboard.mavlink_service import MAVLinkService
+
+    service = MAVLinkService(1, 100, ('127.0.0.1', 0), parser_thread=parser_thread, batch_receive=True)
+    await service.start()
+    sender = mavlink2.MAVLink(None, srcSystem=255, srcComponent=190)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(2)
+    try:
+        sock.sendto(heartbeat(sender, 0), service.transport.get_extra_info('sockname'))
+        for n in range(100):
+            await asyncio.sleep(0.01)
+            if service.links.link_alive:
+                break
+        assert (255, 190) in service.links.peers
+    finally:
+        sock.close()
+        await service.stop()
+
+
+def test_receive_benchmark():
+    results = benchmark.run_receive(modes=('batch',), count=500, rate=5000)
+    assert results['batch']['rate_msg_s'] > 0
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from lacmus_onboard.camera import Camera
+from lacmus_onboard.camera.group import CameraGroup
+
+from test_camera_server import FakeCamera
+from test_chdkptp import make_chdkptp_root
+
+
+class NamedFakeCamera(FakeCamera):
+    def __init__(self, capture_path, name, fail=False, **kwargs):
+        super().__init__(capture_path, **kwargs)
+        self.name = name
+        self.fail = fail
+        self.prepared = []
+
+    async def prepare(self, params):
+        self.prepared.append(params)
+
+    async def shoot(self, params, index=None, prepare=True):
+        if self.fail:
+            raise RuntimeError("no camera")
+        self.events.append(('shoot', index, asyncio.get_event_loop().time()))
+        await asyncio.sleep(self.shoot_time)
+        path = self.capture_path / 'image_{}_{}.jpg'.format(index, self.name)
+        asyncio.get_event_loop().call_later(self.save_time, path.write_bytes, b'\xff\xd8\xff\xd9')
+        return path
+
+
+def test_group_needs_unique_names(tmp_path):
+    with pytest.raises(ValueError):
+        CameraGroup([])
+    with pytest.raises(ValueError):
+        CameraGroup([NamedFakeCamera(tmp_path, 'a'), NamedFakeCamera(tmp_path, 'a')])
+
+
+@pytest.mark.asyncio
+async def test_group_shoots_in_parallel(tmp_path):
+    cameras = [NamedFakeCamera(tmp_path, name, shoot_time=0.05, save_time=0.01) for name in ('wide', 'zoom')]
+    group = CameraGroup(cameras)
+    assert group.RESOLUTION == (4000, 3000)
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    captures = [await group.capture({'focus_mode': 'MF'}) for n in range(2)]
+    # two shots of two cameras take two shoot times, not four
+    assert loop.time() - start < 0.19
+    assert [capture.index for capture in captures] == [0, 1]
+    assert captures[1].paths == {'wide': tmp_path / 'image_1_wide.jpg', 'zoom': tmp_path / 'image_1_zoom.jpg'}
+    assert all(path.exists() for capture in captures for path in capture.paths.values())
+    assert cameras[1].prepared == [{'focus_mode': 'MF'}] * 2
+    triggered = [event[2] for camera in cameras for event in camera.events if event[:2] == ('shoot', 0)]
+    assert max(triggered) - min(triggered) < 0.01
+
+
+@pytest.mark.asyncio
+async def test_group_with_failed_camera(tmp_path):
+    group = CameraGroup([NamedFakeCamera(tmp_path, 'wide'), NamedFakeCamera(tmp_path, 'zoom', fail=True)])
+    path = await group.shoot({})
+    assert group.captures[path].paths == {'wide': tmp_path / 'image_0_wide.jpg', 'zoom': None}
+    assert await group.wait_file(path)
+
+    group = CameraGroup([NamedFakeCamera(tmp_path, 'wide', fail=True), NamedFakeCamera(tmp_path, 'zoom')])
+    with pytest.raises(RuntimeError):
+        await group.shoot({})
+
+
+@pytest.mark.asyncio
+async def test_group_of_chdkptp_cameras(tmp_path):
+    root = make_chdkptp_root(tmp_path)
+    group = CameraGroup(Camera(tmp_path / 'captures', chdkptp_root=root, device='-s={}'.format(n), name=name)
+                        for n, name in enumerate(('left', 'right')))
+    try:
+        assert await group.init()
+        assert len({camera.proc.pid for camera in group.cameras}) == 2
+        capture = await group.capture({})
+        assert capture.paths == {'left': tmp_path / 'captures' / 'image_0_left.jpg',
+                                 'right': tmp_path / 'captures' / 'image_0_right.jpg'}
+        assert all(path.exists() for path in capture.paths.values())
+    finally:
+        await group.close()
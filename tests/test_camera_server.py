@@ -0,0 +1,202 @@
+import asyncio
+import pathlib
+import time
+
+import pytest
+
+from lacmus_onboard.camera_server import CameraServer, CaptureStats, ground_distance
+from lacmus_onboard.commands import CommandEngine
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+from lacmus_onboard.scheduler import MessageScheduler
+
+from conftest import Collector, command_long
+
+
+NO_POSE = {"time_boot_ms": 0, "time_utc": 0, "lat": 0, "lon": 0, "alt": 0, "relative_alt": 0, "q": (0, 0, 0, 0)}
+
+
+class FakeCamera:
+    VENDOR = 'Canon'
+    MODEL = 'PowerShot S100'
+    FOCAL_LENGTH = 5.2
+    SENSOR_SIZE = (7.6, 5.7)
+    RESOLUTION = (4000, 3000)
+
+    def __init__(self, capture_path, shoot_time=0.01, save_time=0.05):
+        self.capture_path = pathlib.Path(capture_path)
+        self.shoot_time = shoot_time
+        self.save_time = save_time
+        self.counter = 0
+        self.events = []
+
+    async def shoot(self, params):
+        n = self.counter
+        self.counter += 1
+        self.events.append(('shoot', n))
+        await asyncio.sleep(self.shoot_time)
+        path = self.capture_path / 'image_{}.jpg'.format(n)
+        asyncio.get_event_loop().call_later(self.save_time, path.write_bytes, b'\xff\xd8\xff\xd9')
+        return path
+
+    async def wait_file(self, path, timeout=10):
+        while not path.exists():
+            await asyncio.sleep(0.005)
+        self.events.append(('saved', int(path.stem.split('_')[1])))
+        return True
+
+    def image_data(self, path):
+        return None
+
+
+def make_server(tmp_path, **kwargs):
+    mav = mavlink2.MAVLink(Collector(), srcSystem=1, srcComponent=100)
+    camera = FakeCamera(tmp_path, **kwargs)
+    server = CameraServer(mav, camera, lambda time_usec: dict(NO_POSE, lat=10), lambda: 0)
+    scheduler = MessageScheduler(mav)
+    commands = CommandEngine(mav, 1, 100)
+    server.register(scheduler, commands)
+    return server, commands, scheduler, mav.file
+
+
+@pytest.mark.asyncio
+async def test_single_capture(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path)
+    commands.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 0, 0, 1, 1))
+    await asyncio.sleep(0.2)
+    acks = [msg.result for msg in link.of_type('COMMAND_ACK')]
+    assert acks == [mavlink2.MAV_RESULT_IN_PROGRESS, mavlink2.MAV_RESULT_ACCEPTED]
+    captured, = link.of_type('CAMERA_IMAGE_CAPTURED')
+    assert (captured.image_index, captured.capture_result, captured.lat) == (0, 1, 10)
+    assert captured.file_url == '/captures/image_0.jpg'
+
+    # same sequence number is not captured twice
+    commands.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 0, 0, 1, 1))
+    await asyncio.sleep(0.1)
+    assert server.camera.counter == 1
+
+    commands.handle(command_long(mavlink2.MAV_CMD_REQUEST_CAMERA_IMAGE_CAPTURE, 0))
+    assert len(link.of_type('CAMERA_IMAGE_CAPTURED')) == 2
+
+
+@pytest.mark.asyncio
+async def test_pose_is_looked_up_at_shutter_time(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path, shoot_time=0.05)
+    requests = []
+
+    def pose_at(time_usec):
+        requests.append(time_usec)
+        server.camera.events.append(('pose', time_usec))
+        return dict(NO_POSE, lat=20)
+
+    server.pose_at = pose_at
+    before = time.time() * 1e6
+    image = await server.capture()
+    assert image.pose['lat'] == 20
+    assert image.data is None
+    # after the image is saved, for the time the shutter was released
+    assert server.camera.events[-1] == ('pose', requests[0])
+    assert requests[0] >= before + 0.05e6
+
+
+@pytest.mark.asyncio
+async def test_in_memory_image_is_carried(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path)
+    images = {}
+    server.camera.image_data = images.get
+    images[tmp_path / 'image_0.jpg'] = memoryview(b'\xff\xd8\xff\xd9')
+    image = await server.capture()
+    assert image.data == b'\xff\xd8\xff\xd9'
+
+
+@pytest.mark.asyncio
+async def test_interval_capture_is_pipelined(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path, shoot_time=0.01, save_time=0.08)
+    commands.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 0, 0.03, 3))
+    await asyncio.sleep(0.01)
+    assert server.interval_task is not None
+    status = server.camera_capture_status_message()
+    assert status.image_status & 2
+    await asyncio.sleep(0.3)
+
+    assert server.interval_task is None
+    assert [msg.image_index for msg in link.of_type('CAMERA_IMAGE_CAPTURED')] == [0, 1, 2]
+    # the second shot is taken before the first image is saved
+    events = server.camera.events
+    assert events.index(('shoot', 1)) < events.index(('saved', 0))
+    assert server.stats.shots == 3
+    assert server.stats.missed == 0
+    assert 0.025 < server.stats.interval < 0.06
+
+
+@pytest.mark.asyncio
+async def test_interval_capture_counts_missed_triggers(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path, shoot_time=0.07, save_time=0.01)
+    commands.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 0, 0.03, 3))
+    await asyncio.sleep(0.4)
+    assert server.interval_task is None
+    assert server.stats.shots == 3
+    assert server.stats.missed >= 2
+
+
+def test_capture_stats():
+    stats = CaptureStats(1.0)
+    for t in (0, 1.0, 2.2, 3.0):
+        stats.add(t)
+    assert stats.shots == 4
+    assert stats.interval == pytest.approx(1.0)
+    assert stats.jitter == pytest.approx(0.163, abs=0.001)
+    assert 'missed' in str(stats)
+
+
+def test_ground_distance():
+    a = {'lat': 550000000, 'lon': 370000000}
+    assert ground_distance(a, dict(a, lat=550000000 + 9000)) == pytest.approx(100, rel=0.01)
+    assert ground_distance(a, dict(a, lon=370000000 + 15700)) == pytest.approx(100, rel=0.01)
+
+
+@pytest.mark.asyncio
+async def test_distance_capture(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path)
+    position = dict(NO_POSE, lat=550000000, lon=370000000)
+    server.pose_at = lambda time_usec: dict(position)
+    commands.handle(command_long(mavlink2.MAV_CMD_DO_SET_CAM_TRIGG_DIST, 50, 0, 1))
+    await asyncio.sleep(0.1)
+    assert server.trigger_distance == 50
+    assert server.camera.counter == 1  # trigger once
+
+    position['lat'] += 5000  # ~56 m
+    await asyncio.sleep(0.15)
+    assert server.camera.counter == 2
+    position['lat'] += 20000  # ~220 m, 3 triggers missed
+    await asyncio.sleep(0.15)
+    assert server.camera.counter == 3
+    assert server.stats.missed == 3
+
+    commands.handle(command_long(mavlink2.MAV_CMD_DO_SET_CAM_TRIGG_DIST, 0))
+    await asyncio.sleep(0.05)
+    assert server.interval_task is None
+    assert server.trigger_distance == 0
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_stop_capture(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path)
+    commands.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 0, 0.05, 0))
+    await asyncio.sleep(0.12)
+    commands.handle(command_long(mavlink2.MAV_CMD_IMAGE_STOP_CAPTURE))
+    await asyncio.sleep(0.01)
+    assert server.interval_task is None
+    shots = server.camera.counter
+    await asyncio.sleep(0.1)
+    assert server.camera.counter == shots
+    await server.close()
+    assert len(link.of_type('CAMERA_IMAGE_CAPTURED')) == shots
+
+
+def test_camera_information(tmp_path):
+    server, commands, scheduler, link = make_server(tmp_path)
+    commands.handle(command_long(mavlink2.MAV_CMD_REQUEST_CAMERA_INFORMATION))
+    info, = link.of_type('CAMERA_INFORMATION')
+    assert bytes(info.model_name).rstrip(b'\0') == b'PowerShot S100'
+    assert (info.resolution_h, info.resolution_v) == (4000, 3000)
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import sys
+import textwrap
+
+import pytest
+
+from lacmus_onboard.camera import Camera, parse_exposure, shoot_server_script
+from lacmus_onboard.camera.chdkptp import ChdkptpChannel, CommandError
+
+# interactive chdkptp as far as the channel and Camera use it
+FAKE_CHDKPTP = textwrap.dedent(r'''
+    import re, sys, time
+    connected = False
+    script = None
+    messages = []
+    while True:
+        sys.stdout.write('con> ' if connected else '___> ')
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line:
+            break
+        line = line.strip()
+        if line.startswith('!con:capture_get_data'):
+            dst = re.search(r"dst='(.*?)'", line).group(1)
+            open(dst + '.jpg', 'wb').write(b'\xff\xd8\xff\xd9')
+        elif line.startswith('!print(con:wait_msg'):
+            print(messages.pop(0))
+        elif line.startswith('!'):
+            for stream, text in re.findall(r'io\.(stdout|stderr):write\("(.*?)"\)', line):
+                getattr(sys, stream).write(text.replace('\\n', '\n'))
+                getattr(sys, stream).flush()
+        elif line.split()[0] == 'connect':
+            connected = True
+            print('connected: Canon PowerShot S100, max packet size 512')
+        elif line.startswith('sleep '):
+            time.sleep(float(line.split()[1]))
+            print('slept')
+        elif line == 'noise':
+            print('unexpected')
+            print('lines')
+        elif line == 'fail':
+            sys.stderr.write('ERROR: failed\n')
+        elif line.startswith('rs '):
+            print('Tv  960')
+            time.sleep(0.05)
+            open(line.split()[1] + '.jpg', 'wb').write(b'\xff\xd8\xff\xd9')
+        elif line == '=return get_zoom()':
+            print('1:return:3')
+        elif line.startswith('lua <'):
+            script = open(line[5:]).read()
+        elif line == 'putm shoot' and script:
+            messages.append('{"status":1,"tv":960,"av":347,"sv":411}')
+        elif line == 'putm get_zoom' and script:
+            messages.append('3')
+        sys.stdout.flush()
+''')
+
+
+def make_chdkptp_root(tmp_path):
+    """
+    Directory with a chdkptp.sh which runs FAKE_CHDKPTP
+    """
+    root = tmp_path / 'chdkptp'
+    root.mkdir(exist_ok=True)
+    (root / 'fake.py').write_text(FAKE_CHDKPTP)
+    script = root / 'chdkptp.sh'
+    script.write_text('#!/bin/sh\nexec {} {} "$@"\n'.format(sys.executable, root / 'fake.py'))
+    os.chmod(script, 0o755)
+    return root
+
+
+async def start_channel():
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', FAKE_CHDKPTP,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    return ChdkptpChannel(proc)
+
+
+async def stop_channel(channel):
+    channel.proc.stdin.close()
+    await channel.proc.wait()
+    await channel.close()
+
+
+@pytest.mark.asyncio
+async def test_responses_are_framed():
+    channel = await start_channel()
+    try:
+        response = await channel.call('connect', 1)
+        assert response.lines == ['connected: Canon PowerShot S100, max packet size 512']
+        assert response.ok
+        assert (await channel.call('noise', 1)).lines == ['unexpected', 'lines']
+        response = await channel.call('fail', 1)
+        assert (response.lines, response.errors) == ([], ['ERROR: failed'])
+        assert not response.ok
+        assert (await channel.call('=return get_zoom()', 1)).text == '1:return:3'
+    finally:
+        await stop_channel(channel)
+
+
+@pytest.mark.asyncio
+async def test_pipelined_commands_and_timeouts():
+    channel = await start_channel()
+    try:
+        futures = [channel.submit(cmd) for cmd in ('sleep 0.2', 'noise', 'connect')]
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(futures[0], 0.05)
+        assert (await asyncio.wait_for(futures[1], 1)).lines == ['unexpected', 'lines']
+        assert (await asyncio.wait_for(futures[2], 1)).text.startswith('connected: Canon')
+        # the late output of the timed out command doesn't leak into the next one
+        assert (await channel.call('noise', 1)).lines == ['unexpected', 'lines']
+    finally:
+        await stop_channel(channel)
+
+
+@pytest.mark.asyncio
+async def test_exit_fails_pending_commands():
+    channel = await start_channel()
+    try:
+        future = channel.submit('sleep 1')
+        channel.proc.kill()
+        with pytest.raises(CommandError):
+            await asyncio.wait_for(future, 1)
+        with pytest.raises(CommandError):
+            channel.submit('connect')
+    finally:
+        await stop_channel(channel)
+
+
+@pytest.mark.asyncio
+async def test_camera_over_channel(tmp_path):
+    root = make_chdkptp_root(tmp_path)
+    camera = Camera(tmp_path / 'captures', chdkptp_root=root)
+    try:
+        assert await camera.init()
+        assert await camera.get_zoom() == 3
+        path = await camera.shoot({'focus_mode': 'MF', 'focus_distance': 10000})
+        assert path == tmp_path / 'captures' / 'image_0.jpg'
+        assert await camera.wait_file(path, timeout=2)
+    finally:
+        await camera.close()
+
+
+def test_shoot_server_script():
+    script = shoot_server_script()
+    assert 'function shoot()' in script
+    assert 'return shoot()' not in script.splitlines()
+    assert script.rstrip().endswith('return "quit"')
+    assert parse_exposure("2:user:'{\"status\":1,\"tv\":960}'") == {'status': 1, 'tv': 960}
+    assert parse_exposure('Tv  960') is None
+
+
+@pytest.mark.asyncio
+async def test_camera_with_persistent_script(tmp_path):
+    root = make_chdkptp_root(tmp_path)
+    camera = Camera(tmp_path / 'captures', chdkptp_root=root, persistent_script=True)
+    try:
+        assert await camera.init()
+        script_file = camera.script_file
+        assert script_file.exists()
+        assert await camera.get_zoom() == 3
+        paths = [await camera.shoot({}) for n in range(3)]
+        for path in paths:
+            assert await camera.wait_file(path, timeout=2)
+        await asyncio.sleep(0.1)
+        assert camera.exposures[paths[-1]] == {'status': 1, 'tv': 960, 'av': 347, 'sv': 411}
+    finally:
+        await camera.close()
+    assert not script_file.exists()
@@ -0,0 +1,122 @@
+import asyncio
+import io
+
+import numpy
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from lacmus_onboard.chips import PACKET_SIZE, ChipSender, make_chip
+from lacmus_onboard.downlink import TokenBucket
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+
+from conftest import Collector, FakeClock
+
+
+@pytest.fixture
+def capture(tmp_path):
+    path = tmp_path / 'image_0.jpg'
+    pixels = numpy.random.RandomState(1).randint(0, 120, (3000, 4000, 3), dtype=numpy.uint8)
+    pixels[1000:1200, 1000:1100, 0] = 255
+    img = Image.fromarray(pixels)
+    img.save(path, quality=90)
+    return path
+
+
+def make_sender(rate=100000, clock=None):
+    clock = clock or FakeClock()
+    mav = mavlink2.MAVLink(Collector(), srcSystem=1, srcComponent=100)
+    return ChipSender(mav, TokenBucket(rate, clock=clock), clock=clock), clock
+
+
+def test_make_chip(capture):
+    data, width, height = make_chip(capture, (1000, 1000, 1100, 1200), size=128, comment='image=0')
+    assert data[:2] == b'\xff\xd8'
+    assert b'\xff\xc2' in data  # progressive
+    assert b'image=0' in data
+    assert max(width, height) <= 128
+    chip = Image.open(io.BytesIO(data))
+    assert chip.size == (width, height)
+    assert chip.getpixel((width // 2, height // 2))[0] > 150
+
+
+@pytest.mark.asyncio
+async def test_transfer(capture):
+    sender, clock = make_sender()
+    sender.add(capture, (1000, 1000, 1100, 1200), 'image=0')
+    transfer = sender.transfer = await sender.next_transfer()
+    while sender.transfer.seqnr < transfer.packets:
+        assert sender.send_next(transfer) == 0
+    handshake = sender.mav.file.msgs[0]
+    assert handshake.get_type() == 'DATA_TRANSMISSION_HANDSHAKE'
+    assert (handshake.size, handshake.packets, handshake.payload) == (len(transfer.data), transfer.packets, PACKET_SIZE)
+    packets = sender.mav.file.of_type('ENCAPSULATED_DATA')
+    assert [packet.seqnr for packet in packets] == list(range(transfer.packets))
+    data = b''.join(bytes(packet.data) for packet in packets)[:handshake.size]
+    assert data == bytes(transfer.data)
+    # one write per frame, sequence numbers and counters kept up
+    link = sender.mav.file
+    assert len(link.writes) == len(link.msgs) == transfer.packets + 1
+    assert [msg.get_seq() for msg in link.msgs] == list(range(transfer.packets + 1))
+    assert sender.mav.total_bytes_sent == sender.sent_bytes == link.bytes
+
+
+@pytest.mark.asyncio
+async def test_pacing_and_resume(capture):
+    sender, clock = make_sender(rate=300)
+    sender.add(capture, (1000, 1000, 1100, 1200))
+    transfer = sender.transfer = await sender.next_transfer()
+    assert transfer.packets > 3
+    sent = 0
+    for step in range(3 * 10):
+        clock.now = step * 0.1
+        while transfer.seqnr < transfer.packets and sender.send_next(transfer) == 0:
+            sent += 1
+    # 300 bytes/s for 3 s: handshake and a 267 byte packet at 0, 0.9, 1.8 and 2.7 s
+    assert transfer.packets > 4
+    assert sent == 5
+    seqnr = transfer.seqnr
+    sender.pause(since=1.5)
+    assert (seqnr, transfer.seqnr) == (4, 2)
+    assert transfer.handshake
+    resent = transfer.seqnr
+    sender.resume()
+    clock.now = 100
+    sender.send_next(transfer)
+    sender.send_next(transfer)
+    msgs = sender.mav.file.msgs
+    assert msgs[-2].get_type() == 'DATA_TRANSMISSION_HANDSHAKE'
+    assert msgs[-1].seqnr == resent
+
+
+@pytest.mark.asyncio
+async def test_waits_for_idle_link(capture):
+    sender, clock = make_sender()
+    sender.IDLE_POLL = 0.01
+    busy = [True]
+    sender.idle = lambda: not busy[0]
+    sender.add(capture, (1000, 1000, 1100, 1200))
+    task = asyncio.ensure_future(sender.run())
+    try:
+        await asyncio.sleep(0.3)
+        assert sender.mav.file.msgs == []
+        busy[0] = False
+        for n in range(100):
+            await asyncio.sleep(0.01)
+            if sender.sent_chips:
+                break
+        assert sender.sent_chips == 1
+    finally:
+        task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_chip_from_memory(capture):
+    sender, clock = make_sender()
+    data = memoryview(capture.read_bytes())
+    sender.image_data = lambda path: data if path == capture else None
+    capture.unlink()
+    sender.add(capture, (1000, 1000, 1100, 1200), 'image=0')
+    transfer = await sender.next_transfer()
+    assert transfer is not None
+    assert b'image=0' in bytes(transfer.data)
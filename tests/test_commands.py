@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from lacmus_onboard.commands import CommandEngine
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+
+from conftest import Collector, FakeClock, command_long
+
+
+def make_engine():
+    mav = mavlink2.MAVLink(Collector(), srcSystem=1, srcComponent=100)
+    clock = FakeClock()
+    return CommandEngine(mav, 1, 100, clock=clock), mav.file, clock
+
+
+def test_sync_handler_and_unsupported():
+    engine, link, clock = make_engine()
+    engine.register(mavlink2.MAV_CMD_REQUEST_MESSAGE, lambda cmd: mavlink2.MAV_RESULT_ACCEPTED, idempotent=True)
+    engine.handle(command_long(mavlink2.MAV_CMD_REQUEST_MESSAGE))
+    engine.handle(command_long(mavlink2.MAV_CMD_REQUEST_MESSAGE))
+    engine.handle(command_long(mavlink2.MAV_CMD_DO_SET_MODE))
+    assert engine.handle(command_long(mavlink2.MAV_CMD_REQUEST_MESSAGE, target_system=2)) is None
+    assert link.acks == [
+        (mavlink2.MAV_CMD_REQUEST_MESSAGE, mavlink2.MAV_RESULT_ACCEPTED, 0),
+        (mavlink2.MAV_CMD_REQUEST_MESSAGE, mavlink2.MAV_RESULT_ACCEPTED, 0),
+        (mavlink2.MAV_CMD_DO_SET_MODE, mavlink2.MAV_RESULT_UNSUPPORTED, 0),
+    ]
+
+
+def test_handler_error_is_failed():
+    engine, link, clock = make_engine()
+
+    def handler(cmd):
+        raise RuntimeError("boom")
+
+    engine.register(mavlink2.MAV_CMD_DO_SET_MODE, handler)
+    engine.handle(command_long(mavlink2.MAV_CMD_DO_SET_MODE))
+    assert link.acks == [(mavlink2.MAV_CMD_DO_SET_MODE, mavlink2.MAV_RESULT_FAILED, 0)]
+
+
+def test_fresh_commands_are_not_retransmissions():
+    engine, link, clock = make_engine()
+    calls = []
+
+    def capture(cmd):
+        calls.append(cmd.confirmation)
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    engine.register(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, capture)
+    engine.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE))
+    clock.now = 1
+    engine.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE))
+    # a retransmission of the second one is answered from the cache
+    engine.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, confirmation=1))
+    assert calls == [0, 0]
+    assert len(link.acks) == 3
+
+
+@pytest.mark.asyncio
+async def test_long_running_command_progress_and_dedup():
+    engine, link, clock = make_engine()
+    release = asyncio.Event()
+    calls = []
+
+    async def capture(cmd):
+        calls.append(cmd.params[0])
+        cmd.progress(50)
+        await release.wait()
+        return mavlink2.MAV_RESULT_ACCEPTED
+
+    engine.register(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, capture, long_running=True)
+    engine.register(mavlink2.MAV_CMD_REQUEST_MESSAGE, lambda cmd: mavlink2.MAV_RESULT_ACCEPTED, idempotent=True)
+
+    engine.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 1))
+    await asyncio.sleep(0)
+    # other commands are served while the capture is running
+    engine.handle(command_long(mavlink2.MAV_CMD_REQUEST_MESSAGE))
+    # retransmission while running
+    assert engine.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 1, confirmation=1)) is None
+
+    release.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    # retransmission after completion gets the cached ACK
+    clock.now = 1
+    assert engine.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 1, confirmation=2)) is None
+
+    assert calls == [1]
+    assert link.acks == [
+        (mavlink2.MAV_CMD_IMAGE_START_CAPTURE, mavlink2.MAV_RESULT_IN_PROGRESS, 0),
+        (mavlink2.MAV_CMD_IMAGE_START_CAPTURE, mavlink2.MAV_RESULT_IN_PROGRESS, 50),
+        (mavlink2.MAV_CMD_REQUEST_MESSAGE, mavlink2.MAV_RESULT_ACCEPTED, 0),
+        (mavlink2.MAV_CMD_IMAGE_START_CAPTURE, mavlink2.MAV_RESULT_IN_PROGRESS, 50),
+        (mavlink2.MAV_CMD_IMAGE_START_CAPTURE, mavlink2.MAV_RESULT_ACCEPTED, 0),
+        (mavlink2.MAV_CMD_IMAGE_START_CAPTURE, mavlink2.MAV_RESULT_ACCEPTED, 0),
+    ]
+
+    # a new command after the dedup timeout is executed again
+    clock.now = 10
+    release.clear()
+    engine.handle(command_long(mavlink2.MAV_CMD_IMAGE_START_CAPTURE, 2))
+    await asyncio.sleep(0)
+    await engine.close()
+    assert calls == [1, 2]
+    assert link.acks[-1] == (mavlink2.MAV_CMD_IMAGE_START_CAPTURE, mavlink2.MAV_RESULT_FAILED, 0)
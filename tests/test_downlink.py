@@ -0,0 +1,271 @@
+import asyncio
+import random
+
+import pytest
+
+from lacmus_onboard.downlink import DetectionDownlink, TokenBucket, iou
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+
+from conftest import Collector, FakeClock
+
+
+def detection(index, confidence, bbox=(0, 0, 10, 10)):
+    return {"time_boot_ms": 0, "time_utc": 0, "camera_id": 1, "lat": 0, "lon": 0, "alt": 0, "relative_alt": 0,
+            "source_image_index": index, "bbox": bbox, "file_url": b'/detections/x.jpg', "confidence": confidence}
+
+
+def ack_all(downlink):
+    for msg in downlink.mav.file.msgs:
+        downlink.ack(msg.detection_id)
+
+
+def make_downlink(rate=1000, **kwargs):
+    clock = FakeClock()
+    mav = mavlink2.MAVLink(Collector(), srcSystem=1, srcComponent=100)
+    return DetectionDownlink(mav, rate, clock=clock, **kwargs), clock
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(100, 200, clock)
+    assert bucket.consume(150)
+    assert not bucket.consume(100)
+    assert bucket.delay(100) == pytest.approx(0.5)
+    clock.now = 0.5
+    assert bucket.consume(100)
+    clock.now = 100
+    assert bucket.tokens <= 200
+    assert bucket.consume(500)  # larger than the bucket, goes out on a full one
+
+
+def test_iou():
+    assert iou((0, 0, 10, 10), (0, 0, 10, 10)) == 1
+    assert iou((0, 0, 10, 10), (20, 20, 30, 30)) == 0
+    assert iou((0, 0, 10, 10), (5, 0, 15, 10)) == pytest.approx(1 / 3)
+
+
+def test_budget_and_confidence_order():
+    downlink, clock = make_downlink(rate=100, burst=100)
+    downlink.resume()
+    downlink.add(detection(0, 0.3))
+    downlink.add(detection(1, 0.9))
+    downlink.add(detection(2, 0.6))
+    delay = downlink.flush()
+    collector = downlink.mav.file
+    assert [msg.source_image_index for msg in collector.msgs] == [1]
+    assert delay > 0
+    assert downlink.backlog == 2
+    ack_all(downlink)
+    clock.now += delay
+    assert downlink.flush() > 0
+    assert len(collector.msgs) == 2
+    ack_all(downlink)
+    clock.now += 1
+    assert downlink.flush() == pytest.approx(downlink.RETRANSMIT_TIMEOUT)  # waiting for the ACK
+    assert [msg.source_image_index for msg in collector.msgs] == [1, 2, 0]
+    ack_all(downlink)
+    assert downlink.flush() is None
+    assert downlink.sent == 3
+    assert downlink.sent_bytes == collector.bytes
+
+
+def test_coalescing_per_image():
+    downlink, clock = make_downlink()
+    downlink.resume()
+    downlink.add(detection(0, 0.5, (0, 0, 10, 10)))
+    downlink.add(detection(0, 0.7, (1, 1, 11, 11)))  # same object
+    downlink.add(detection(0, 0.4, (50, 50, 60, 60)))
+    downlink.add(detection(1, 0.6))
+    assert downlink.coalesced == 1
+    assert downlink.backlog == 3
+    downlink.flush()
+    batch, single = downlink.mav.file.msgs
+    # both detections of the best image go first, in one batch
+    assert (batch.source_image_index, batch.count) == (0, 2)
+    assert (batch.objects[4], batch.objects[10], batch.objects[16]) == (178, 102, 0)
+    assert (single.source_image_index, single.count, single.objects[:6]) == (1, 1, [0, 0, 1, 1, 153, 0])
+    assert (batch.detection_id, single.detection_id) == (1, 2)
+    assert (downlink.sent, downlink.sent_reports) == (3, 2)
+
+
+def test_batch_is_compact():
+    downlink, clock = make_downlink(rate=10000, image_size=(4000, 3000))
+    for n in range(16):
+        downlink.add(detection(5, 0.5, (n * 200, 1500, n * 200 + 100, 1600)))
+    downlink.flush()
+    batch, = downlink.mav.file.msgs
+    assert batch.count == 16
+    assert batch.objects[6:12] == [13, 128, 19, 136, 128, 0]
+    single = dict(detection(5, 0.5))
+    single.pop('confidence')
+    single_size = len(downlink.mav.lacmus_object_detected_encode(**single).pack(downlink.mav))
+    assert downlink.sent_bytes * 5 < single_size * 16
+
+
+def test_paused_backlog_drops_least_confident():
+    downlink, clock = make_downlink(max_backlog=3)
+    downlink.pause()
+    for n, confidence in enumerate((0.5, 0.1, 0.9, 0.7)):
+        downlink.add(detection(n, confidence))
+    assert downlink.flush() is None
+    assert downlink.mav.file.msgs == []
+    assert (downlink.backlog, downlink.dropped) == (3, 1)
+    downlink.resume()
+    downlink.flush()
+    assert [msg.source_image_index for msg in downlink.mav.file.msgs] == [2, 3, 0]
+
+
+def test_retransmission_backoff_until_ack():
+    downlink, clock = make_downlink()
+    downlink.add(detection(0, 0.5))
+    downlink.flush()
+    sent_at = []
+    for step in range(80):
+        clock.now = step * 0.25
+        before = len(downlink.mav.file.msgs)
+        downlink.flush()
+        if len(downlink.mav.file.msgs) > before:
+            sent_at.append(clock.now)
+    assert sent_at == [1, 3, 7, 15]
+    assert downlink.retransmitting
+    assert downlink.ack(1)
+    assert not downlink.ack(1)
+    clock.now = 100
+    assert downlink.flush() is None
+    assert (downlink.retransmitted, downlink.acked) == (4, 1)
+    assert not downlink.retransmitting
+
+
+def test_retransmissions_go_first():
+    downlink, clock = make_downlink(rate=100, burst=100)
+    downlink.add(detection(0, 0.1))
+    downlink.flush()
+    clock.now = 1.0
+    downlink.add(detection(1, 0.9))
+    downlink.flush()
+    assert [msg.source_image_index for msg in downlink.mav.file.msgs] == [0, 0]
+    clock.now = 2.0
+    downlink.flush()
+    assert [msg.detection_id for msg in downlink.mav.file.msgs] == [1, 1, 2]
+
+
+def test_unacked_detections_survive_restart(tmp_path):
+    store = tmp_path / 'downlink.json'
+    downlink, clock = make_downlink(rate=60, burst=60, store=store)
+    downlink.add(detection(0, 0.9))
+    downlink.add(detection(1, 0.5))
+    downlink.flush()
+    assert (len(downlink.unacked), downlink.backlog) == (1, 1)
+
+    restarted, clock = make_downlink(store=store)
+    assert (len(restarted.unacked), restarted.backlog, restarted.next_id) == (1, 1, 2)
+    restarted.flush()
+    msgs = restarted.mav.file.msgs
+    assert [(msg.detection_id, msg.source_image_index) for msg in msgs] == [(1, 0), (2, 1)]
+    ack_all(restarted)
+    # the store was written a moment ago, the next save waits for SAVE_INTERVAL
+    assert restarted.flush() == pytest.approx(restarted.SAVE_INTERVAL)
+    assert len(make_downlink(store=store)[0].unacked) == 2
+    clock.now = restarted.SAVE_INTERVAL
+    restarted.flush()
+    restarted, clock = make_downlink(store=store)
+    assert (len(restarted.unacked), restarted.backlog) == (0, 0)
+
+    # close() saves what the debounce held back
+    restarted.add(detection(2, 0.7))
+    restarted.flush()
+    restarted.add(detection(3, 0.7))
+    restarted.close()
+    restarted, clock = make_downlink(store=store)
+    assert (len(restarted.unacked), restarted.backlog) == (1, 1)
+
+
+class LossyProxy:
+    """
+    UDP proxy between the service and the GCS dropping a share of datagrams
+    """
+
+    def __init__(self, loss, seed=1):
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.gcs_addr = None
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr != self.service_addr:
+            self.gcs_addr = addr
+            target = self.service_addr
+        else:
+            target = self.gcs_addr
+        if self.random.random() < self.loss:
+            self.dropped += 1
+        elif target is not None:
+            self.transport.sendto(data, target)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        pass
+
+
+class GCSProtocol:
+    def __init__(self):
+        self.mav = mavlink2.MAVLink(None, srcSystem=255, srcComponent=190)
+        self.received = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.mav.file = self
+
+    def write(self, data):
+        self.transport.sendto(data)
+
+    def datagram_received(self, data, addr):
+        for msg in self.mav.parse_buffer(data) or []:
+            if msg.get_type() == 'LACMUS_DETECTION_BATCH':
+                self.received[msg.detection_id] = msg.source_image_index
+                self.mav.lacmus_detection_ack_send(1, 100, msg.detection_id)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_delivery_over_lossy_link():
+    from lacmus_onboard.mavlink_service import MAVLinkService
+
+    service = MAVLinkService(1, 100, ('127.0.0.1', 0), detection_rate=100000)
+    service.downlink.RETRANSMIT_TIMEOUT = 0.02
+    service.downlink.MAX_RETRANSMIT_TIMEOUT = 0.1
+    await service.start()
+    loop = asyncio.get_event_loop()
+    proxy_transport, proxy = await loop.create_datagram_endpoint(
+        lambda: LossyProxy(loss=0.3), local_addr=('127.0.0.1', 0))
+    proxy.service_addr = service.transport.get_extra_info('sockname')
+    gcs_transport, gcs = await loop.create_datagram_endpoint(
+        GCSProtocol, remote_addr=proxy_transport.get_extra_info('sockname'))
+    try:
+        for n in range(10):
+            gcs.mav.heartbeat_send(mavlink2.MAV_TYPE_GCS, mavlink2.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+        for n in range(50):
+            service.send_detection(dict(detection(n, 0.5), lat=n))
+        for n in range(200):
+            gcs.mav.heartbeat_send(mavlink2.MAV_TYPE_GCS, mavlink2.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+            await asyncio.sleep(0.02)
+            if len(gcs.received) == 50 and not service.downlink.unacked:
+                break
+        assert sorted(gcs.received.values()) == list(range(50))
+        assert not service.downlink.unacked
+        assert proxy.dropped > 0
+        assert service.downlink.retransmitted > 0
+    finally:
+        gcs_transport.close()
+        proxy_transport.close()
+        await service.stop()
@@ -0,0 +1,150 @@
+import asyncio
+import struct
+
+import pytest
+
+from lacmus_onboard import benchmark
+from lacmus_onboard.ftp_server import FTPServer, Error, MAX_DATA_SIZE, Opcode, build_payload, crc32, parse_payload
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+
+from conftest import Collector
+
+
+class Client:
+    def __init__(self, server):
+        self.server = server
+        self.mav = mavlink2.MAVLink(None, srcSystem=255, srcComponent=190)
+        self.seq = 0
+
+    def send(self, opcode, session=0, offset=0, data=b'', size=None, seq=None):
+        if seq is None:
+            self.seq += 1
+            seq = self.seq
+        payload = build_payload(seq, session, opcode, 0, offset, data)
+        if size is not None:
+            payload[4] = size
+        packed = self.mav.file_transfer_protocol_encode(0, 1, 100, payload).pack(self.mav)
+        self.server.handle(mavlink2.MAVLink(None).parse_buffer(packed)[0])
+        return parse_payload(self.server.mav.file.msgs[-1].payload)
+
+
+@pytest.fixture
+def files(tmp_path):
+    captures = tmp_path / 'captures'
+    captures.mkdir()
+    (tmp_path / 'detections').mkdir()
+    (captures / 'image_0.jpg').write_bytes(bytes(range(256)) * 10)
+    (tmp_path / 'secret.txt').write_bytes(b'secret')
+    return tmp_path
+
+
+def make_server(files, **kwargs):
+    mav = mavlink2.MAVLink(Collector(), srcSystem=1, srcComponent=100)
+    server = FTPServer(mav, {'captures': files / 'captures', 'detections': files / 'detections'}, **kwargs)
+    return server, Client(server)
+
+
+def test_list_directory(files):
+    server, client = make_server(files)
+    response = client.send(Opcode.LIST_DIRECTORY, data=b'/')
+    assert response.opcode == Opcode.ACK
+    assert response.data == b'Dcaptures\0Ddetections\0'
+    response = client.send(Opcode.LIST_DIRECTORY, data=b'/captures')
+    assert response.data == b'Fimage_0.jpg\t2560\0'
+    assert response.seq == client.seq + 1
+    response = client.send(Opcode.LIST_DIRECTORY, offset=1, data=b'/captures')
+    assert (response.opcode, response.data[0]) == (Opcode.NAK, Error.EOF)
+
+
+def test_read_file(files):
+    server, client = make_server(files)
+    response = client.send(Opcode.OPEN_FILE_RO, data=b'/captures/image_0.jpg')
+    assert response.opcode == Opcode.ACK
+    session, size = response.session, struct.unpack('<I', response.data)[0]
+    assert size == 2560
+    data = b''
+    while True:
+        response = client.send(Opcode.READ_FILE, session, len(data), size=MAX_DATA_SIZE)
+        if response.opcode == Opcode.NAK:
+            assert response.data[0] == Error.EOF
+            break
+        assert response.offset == len(data)
+        data += response.data
+    assert data == (files / 'captures' / 'image_0.jpg').read_bytes()
+    assert client.send(Opcode.TERMINATE_SESSION, session).opcode == Opcode.ACK
+    assert client.send(Opcode.READ_FILE, session, 0).data[0] == Error.INVALID_SESSION
+
+
+def test_paths_outside_roots_and_writes_are_rejected(files):
+    server, client = make_server(files)
+    for path in (b'/secret.txt', b'/captures/../secret.txt', b'/other/image_0.jpg'):
+        response = client.send(Opcode.OPEN_FILE_RO, data=path)
+        assert (response.opcode, response.data[0]) == (Opcode.NAK, Error.FILE_NOT_FOUND)
+    response = client.send(Opcode.REMOVE_FILE, data=b'/captures/image_0.jpg')
+    assert (response.opcode, response.data[0]) == (Opcode.NAK, Error.FILE_PROTECTED)
+    assert (files / 'captures' / 'image_0.jpg').exists()
+
+
+def test_sessions_are_limited(files):
+    server, client = make_server(files)
+    for n in range(server.MAX_SESSIONS):
+        assert client.send(Opcode.OPEN_FILE_RO, data=b'/captures/image_0.jpg').opcode == Opcode.ACK
+    response = client.send(Opcode.OPEN_FILE_RO, data=b'/captures/image_0.jpg')
+    assert response.data[0] == Error.NO_SESSIONS_AVAILABLE
+    assert client.send(Opcode.RESET_SESSIONS).opcode == Opcode.ACK
+    assert not server.sessions
+
+
+def test_retransmitted_request_gets_the_same_response(files):
+    server, client = make_server(files)
+    first = client.send(Opcode.OPEN_FILE_RO, data=b'/captures/image_0.jpg')
+    repeated = client.send(Opcode.OPEN_FILE_RO, data=b'/captures/image_0.jpg', seq=client.seq)
+    assert repeated == first
+    assert len(server.sessions) == 1
+
+
+def table_crc32(data, crc=0):
+    # crc32part of PX4
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xEDB88320 if crc & 1 else crc >> 1
+    return crc
+
+
+def test_crc32(files):
+    # check value of ArduPilot crc_crc32(0, "123456789")
+    assert crc32(b'123456789') == 0x2DFD2D88
+    assert crc32(b'56789', crc32(b'1234')) == 0x2DFD2D88
+    (files / 'captures' / 'image_1.jpg').write_bytes(bytes(range(256)) * 100)
+    server, client = make_server(files)
+    server.READ_AHEAD = 4096
+    for name in ('image_0.jpg', 'image_1.jpg'):
+        response = client.send(Opcode.CALC_FILE_CRC32, data='/captures/{}'.format(name).encode())
+        expected = table_crc32((files / 'captures' / name).read_bytes())
+        assert struct.unpack('<I', response.data)[0] == expected
+
+
+@pytest.mark.asyncio
+async def test_burst_read(files):
+    server, client = make_server(files)
+    session = client.send(Opcode.OPEN_FILE_RO, data=b'/captures/image_0.jpg').session
+    link = server.mav.file
+    start = len(link.msgs)
+    server.handle(mavlink2.MAVLink(None).parse_buffer(
+        client.mav.file_transfer_protocol_encode(
+            0, 1, 100, build_payload(10, session, Opcode.BURST_READ_FILE, 0)).pack(client.mav))[0])
+    await asyncio.wait_for(server.sessions[session].burst_task, 1)
+    chunks = [parse_payload(msg.payload) for msg in link.msgs[start:]]
+    assert [chunk.seq for chunk in chunks] == list(range(11, 11 + len(chunks)))
+    assert [chunk.burst_complete for chunk in chunks] == [0] * (len(chunks) - 1) + [1]
+    assert b''.join(chunk.data for chunk in chunks) == (files / 'captures' / 'image_0.jpg').read_bytes()
+
+
+@pytest.mark.asyncio
+async def test_download_over_emulated_link(tmp_path):
+    path = tmp_path / 'image.jpg'
+    path.write_bytes(bytes(range(256)) * 40)
+    results = await benchmark.measure_ftp(path, baudrate=5760000)
+    assert set(results) == {'ReadFile', 'BurstReadFile'}
+    assert results['BurstReadFile']['efficiency'] > 0
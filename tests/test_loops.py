@@ -0,0 +1,33 @@
+import asyncio
+import builtins
+
+import pytest
+
+from lacmus_onboard import benchmark
+from lacmus_onboard.loops import loop_factory, run_in_loop
+
+
+def test_uvloop_fallback(monkeypatch):
+    real_import = builtins.__import__
+
+    def fake_import(name, *args, **kwargs):
+        if name == 'uvloop':
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', fake_import)
+    name, factory = loop_factory('uvloop')
+    assert name == 'asyncio'
+    assert factory is asyncio.new_event_loop
+
+
+def test_unknown_loop():
+    with pytest.raises(ValueError):
+        loop_factory('trio')
+
+
+def test_benchmark_measure():
+    result = run_in_loop(benchmark.measure(50, 8), 'asyncio')
+    assert result['lost'] == 0
+    assert result['rate_msg_s'] > 0
+    assert result['rtt_median_us'] > 0
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+
+import pytest
+
+from lacmus_onboard import benchmark
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+from lacmus_onboard.parser_thread import ParserThread
+
+
+@pytest.mark.asyncio
+async def test_messages_are_delivered_on_the_loop_in_batches():
+    loop = asyncio.get_event_loop()
+    received = []
+    threads = set()
+    done = asyncio.Event()
+
+    def deliver(msgs):
+        threads.add(threading.get_ident())
+        received.extend(msgs)
+        if len(received) == 20:
+            done.set()
+
+    parser_thread = ParserThread(mavlink2.MAVLink(None), loop, deliver)
+    parser_thread.start()
+    sender = mavlink2.MAVLink(None, srcSystem=2, srcComponent=1)
+    try:
+        for n in range(20):
+            parser_thread.submit(sender.heartbeat_encode(6, 8, 0, n, 0).pack(sender))
+        await asyncio.wait_for(done.wait(), 1)
+    finally:
+        parser_thread.stop()
+    assert [msg.custom_mode for msg in received] == list(range(20))
+    assert threads == {threading.get_ident()}
+    assert parser_thread.messages == 20
+    assert parser_thread.batches <= 20
+
+
+def test_parser_error_does_not_stop_the_thread():
+    loop = asyncio.new_event_loop()
+    sender = mavlink2.MAVLink(None, srcSystem=2, srcComponent=1)
+    bad = bytearray(sender.heartbeat_encode(6, 8, 0, 1, 0).pack(sender))
+    bad[-1] ^= 0xFF
+    try:
+        received = []
+        parser_thread = ParserThread(mavlink2.MAVLink(None), loop, received.extend)
+        parser_thread.start()
+        parser_thread.submit(bytes(bad))
+        parser_thread.submit(sender.heartbeat_encode(6, 8, 0, 2, 0).pack(sender))
+        loop.run_until_complete(asyncio.sleep(0.1))
+        parser_thread.stop()
+    finally:
+        loop.close()
+    assert [msg.custom_mode for msg in received] == [2]
+
+
+@pytest.mark.parametrize('mode', ('loop', 'thread'))
+def test_receive_benchmark(mode):
+    results = benchmark.run_receive(modes=(mode,), count=500, rate=5000)
+    assert results[mode]['rate_msg_s'] > 0
+    assert results[mode]['lost'] < 500
@@ -0,0 +1,61 @@
+import math
+
+import numpy as np
+
+from lacmus_onboard.pose_history import PoseHistory, TimeSeriesRing, slerp
+
+
+def test_position_linear_interpolation():
+    history = PoseHistory(capacity=8)
+    assert history.position_at(1.0) is None
+    history.add_position(1.0, 100, 200, 1000, 500)
+    history.add_position(2.0, 200, 400, 3000, 700)
+
+    np.testing.assert_allclose(history.position_at(1.5), [[150, 300, 2000, 600]])
+    np.testing.assert_allclose(history.position_at([0.0, 1.25, 5.0]),
+                               [[100, 200, 1000, 500], [125, 250, 1500, 550], [200, 400, 3000, 700]])
+
+
+def test_ring_wraps_and_keeps_latest_samples():
+    ring = TimeSeriesRing(4, 1)
+    for t in range(10):
+        ring.append(float(t), (t * 10,))
+    assert not ring.append(7.0, (0,))
+    times, values = ring.ordered()
+    np.testing.assert_array_equal(times, [6, 7, 8, 9])
+    np.testing.assert_array_equal(values[:, 0], [60, 70, 80, 90])
+
+
+def test_clock_reset_starts_over():
+    history = PoseHistory(capacity=8)
+    for t in range(100, 110):
+        history.add_position(float(t), t, t, 0, 0)
+    # autopilot reboot, time_boot_ms starts from zero again
+    assert history.add_position(0.5, 1, 1, 0, 0)
+    assert history.add_position(1.5, 3, 3, 0, 0)
+    assert len(history.positions) == 2
+    np.testing.assert_allclose(history.position_at(1.0), [[2, 2, 0, 0]])
+
+
+def test_attitude_slerp():
+    history = PoseHistory()
+    half = math.sqrt(0.5)
+    history.add_attitude(0.0, (1, 0, 0, 0))
+    history.add_attitude(1.0, (half, 0, 0, half))  # 90 deg yaw
+
+    q = history.attitude_at(0.5)[0]
+    expected = (math.cos(math.pi / 8), 0, 0, math.sin(math.pi / 8))
+    np.testing.assert_allclose(q, expected, atol=1e-9)
+
+
+def test_slerp_takes_short_path():
+    q0 = np.array([[1.0, 0, 0, 0]])
+    q1 = np.array([[-1.0, 0, 0, 0]])
+    np.testing.assert_allclose(slerp(q0, q1, np.array([0.5])), [[1, 0, 0, 0]])
+
+
+def test_pose_at_single_sample():
+    history = PoseHistory()
+    history.add_position(1.0, 557000000, 376000000, 150000, 100000)
+    pose = history.pose_at(3.0)
+    assert pose == {"lat": 557000000, "lon": 376000000, "alt": 150000, "relative_alt": 100000}
@@ -0,0 +1,68 @@
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+from lacmus_onboard.scheduler import MessageScheduler
+
+from conftest import Collector, FakeClock
+
+
+def make_scheduler():
+    mav = mavlink2.MAVLink(Collector(), srcSystem=1, srcComponent=100)
+    clock = FakeClock()
+    scheduler = MessageScheduler(mav, tick=0.01, clock=clock)
+    heartbeat = lambda: mav.heartbeat_encode(mavlink2.MAV_TYPE_ONBOARD_CONTROLLER,
+                                             mavlink2.MAV_AUTOPILOT_INVALID, 0, 0, mavlink2.MAV_STATE_ACTIVE)
+    status = lambda: mav.camera_capture_status_encode(0, 0, 0, 0, 0, 0)
+    scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_HEARTBEAT, heartbeat, 1.0)
+    scheduler.add_stream(mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS, status)
+    return scheduler, clock, mav
+
+
+def due_ids(scheduler, now):
+    return sorted(stream.msg_id for stream in scheduler.pop_due(now))
+
+
+def test_intervals_and_disabled_streams():
+    scheduler, clock, mav = make_scheduler()
+    assert due_ids(scheduler, 0) == [mavlink2.MAVLINK_MSG_ID_HEARTBEAT]
+    assert due_ids(scheduler, 0.5) == []
+    assert due_ids(scheduler, 0.995) == [mavlink2.MAVLINK_MSG_ID_HEARTBEAT]
+    assert scheduler.get_interval(mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS) == -1
+    assert scheduler.get_interval(mavlink2.MAVLINK_MSG_ID_SYS_STATUS) == 0
+
+
+def test_set_interval_reschedules_stream():
+    scheduler, clock, mav = make_scheduler()
+    scheduler.pop_due(0)
+    clock.now = 0.2
+    assert scheduler.set_interval(mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS, 250000) == mavlink2.MAV_RESULT_ACCEPTED
+    assert scheduler.set_interval(mavlink2.MAVLINK_MSG_ID_HEARTBEAT, 500000) == mavlink2.MAV_RESULT_ACCEPTED
+    assert due_ids(scheduler, 0.2) == [mavlink2.MAVLINK_MSG_ID_HEARTBEAT, mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS]
+    assert due_ids(scheduler, 0.45) == [mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS]
+    assert due_ids(scheduler, 0.7) == [mavlink2.MAVLINK_MSG_ID_HEARTBEAT, mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS]
+
+    assert scheduler.set_interval(mavlink2.MAVLINK_MSG_ID_HEARTBEAT, 0) == mavlink2.MAV_RESULT_ACCEPTED
+    assert scheduler.get_interval(mavlink2.MAVLINK_MSG_ID_HEARTBEAT) == 1000000
+    assert scheduler.set_interval(mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS, -1) == mavlink2.MAV_RESULT_ACCEPTED
+    # stale heap entries of the old schedule are ignored
+    assert due_ids(scheduler, 0.95) == [mavlink2.MAVLINK_MSG_ID_HEARTBEAT]
+    assert due_ids(scheduler, 1.5) == [mavlink2.MAVLINK_MSG_ID_HEARTBEAT]
+    assert due_ids(scheduler, 2.0) == []
+    assert scheduler.set_interval(mavlink2.MAVLINK_MSG_ID_SYS_STATUS, 1000) == mavlink2.MAV_RESULT_UNSUPPORTED
+
+
+def test_batch_is_one_write():
+    scheduler, clock, mav = make_scheduler()
+    msgs = [stream.builder() for stream in scheduler.streams.values()]
+    scheduler.send_batch(msgs)
+    assert len(mav.file.writes) == 1
+    parsed = mavlink2.MAVLink(None).parse_buffer(mav.file.writes[0])
+    assert [msg.get_msgId() for msg in parsed] == [mavlink2.MAVLINK_MSG_ID_HEARTBEAT,
+                                                   mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS]
+    assert [msg.get_seq() for msg in parsed] == [0, 1]
+    assert mav.seq == 2
+
+
+def test_request_message():
+    scheduler, clock, mav = make_scheduler()
+    assert scheduler.request(mavlink2.MAVLINK_MSG_ID_CAMERA_CAPTURE_STATUS) == mavlink2.MAV_RESULT_ACCEPTED
+    assert len(mav.file.writes) == 1
+    assert scheduler.request(mavlink2.MAVLINK_MSG_ID_SYS_STATUS) == mavlink2.MAV_RESULT_UNSUPPORTED
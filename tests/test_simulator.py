@@ -0,0 +1,177 @@
+import io
+import sys
+import time
+
+import pytest
+
+from lacmus_onboard.camera import SIMULATOR_ROOT, Camera
+from lacmus_onboard.camera.simulator import MINIMAL_JPEG, Simulator
+
+
+def run_simulator(commands, **kwargs):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    kwargs = dict(dict(command_time=0, script_time=0, shoot_time=0, download_time=0), **kwargs)
+    simulator = Simulator(stdin=io.StringIO('\n'.join(commands) + '\n'), stdout=stdout, stderr=stderr, **kwargs)
+    simulator.run()
+    return simulator, stdout.getvalue(), stderr.getvalue()
+
+
+def use_simulator(monkeypatch, **times):
+    monkeypatch.setenv('CHDKPTP_SIM_PYTHON', sys.executable)
+    for name in ('COMMAND_TIME', 'SCRIPT_TIME', 'SHOOT_TIME', 'DOWNLOAD_TIME'):
+        monkeypatch.setenv('CHDKPTP_SIM_' + name, str(times.get(name.lower(), 0)))
+
+
+def test_simulator_dialogue(tmp_path):
+    simulator, out, err = run_simulator([
+        'imrm', 'connect', 'rec', '=set_zoom(4)', '=return get_zoom()',
+        'rs {} -script=shoot.lua'.format(tmp_path / 'a'), 'frobnicate',
+        '!io.stdout:write("\\nmark\\n") io.stderr:write("mark\\n")',
+    ])
+    assert out.startswith('___> ___> connected: Canon')
+    assert '1:return:4' in out
+    assert '"zoom": 4' in out
+    assert out.endswith('\nmark\ncon> ')
+    assert err == 'ERROR: not connected\nERROR: unknown command frobnicate\nmark\n'
+    assert (tmp_path / 'a.jpg').read_bytes() == MINIMAL_JPEG
+
+
+def test_simulator_images_and_failures(tmp_path):
+    images = tmp_path / 'images'
+    images.mkdir()
+    for n in range(2):
+        (images / '{}.jpg'.format(n)).write_bytes(b'image %d' % n)
+    commands = ['connect', 'rec'] + ['rs {} -script=x'.format(tmp_path / str(n)) for n in range(3)]
+    run_simulator(commands, images=images)
+    assert [(tmp_path / '{}.jpg'.format(n)).read_bytes() for n in range(3)] == [b'image 0', b'image 1', b'image 0']
+
+    simulator, out, err = run_simulator(commands, fail_rate=1)
+    assert err.count('ERROR: remote shoot failed') == 3
+    assert simulator.shots == 0
+
+
+@pytest.mark.asyncio
+async def test_camera_on_simulator(tmp_path, monkeypatch):
+    use_simulator(monkeypatch, shoot_time=0.01, download_time=0.02)
+    camera = Camera(tmp_path, chdkptp_root=SIMULATOR_ROOT)
+    try:
+        assert await camera.init()
+        await camera.set_zoom(3)
+        assert await camera.get_zoom() == 3
+        for n in range(3):
+            path = await camera.capture({'focus_mode': 'MF', 'focus_distance': 5000})
+            assert path.read_bytes() == MINIMAL_JPEG
+    finally:
+        await camera.close()
+
+
+@pytest.mark.asyncio
+async def test_persistent_script_on_simulator(tmp_path, monkeypatch):
+    use_simulator(monkeypatch, shoot_time=0.01, download_time=0.02)
+    camera = Camera(tmp_path, chdkptp_root=SIMULATOR_ROOT, persistent_script=True)
+    try:
+        assert await camera.init()
+        await camera.set_zoom(2)
+        assert await camera.get_zoom() == 2
+        paths = [await camera.shoot({}) for n in range(3)]
+        for path in paths:
+            assert await camera.wait_file(path, timeout=2)
+        assert camera.exposures[paths[0]]['zoom'] == 2
+    finally:
+        await camera.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('persistent_script', [False, True])
+async def test_shoot_returns_at_shutter_release(tmp_path, monkeypatch, persistent_script):
+    use_simulator(monkeypatch, shoot_time=0.2, download_time=0.3)
+    camera = Camera(tmp_path, chdkptp_root=SIMULATOR_ROOT, persistent_script=persistent_script)
+    try:
+        assert await camera.init()
+        start = time.monotonic()
+        path = await camera.shoot({})
+        assert 0.2 <= time.monotonic() - start < 0.45
+        assert not path.exists()
+        assert await camera.wait_file(path, timeout=2)
+    finally:
+        await camera.close()
+
+
+@pytest.mark.asyncio
+async def test_failure_injection(tmp_path, monkeypatch):
+    use_simulator(monkeypatch)
+    monkeypatch.setenv('CHDKPTP_SIM_FAIL_RATE', '1')
+    camera = Camera(tmp_path, chdkptp_root=SIMULATOR_ROOT)
+    try:
+        assert await camera.init()
+        path = await camera.shoot({})
+        assert not await camera.wait_file(path, timeout=0.2)
+    finally:
+        await camera.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('persistent_script', [False, True])
+async def test_in_memory_capture(tmp_path, monkeypatch, persistent_script):
+    images = tmp_path / 'images'
+    images.mkdir()
+    (images / 'a.jpg').write_bytes(b'\xff\xd8' + b'\0' * 300000 + b'\xff\xd9')
+    use_simulator(monkeypatch, shoot_time=0.01, download_time=0.02)
+    monkeypatch.setenv('CHDKPTP_SIM_IMAGES', str(images))
+    camera = Camera(tmp_path / 'captures', chdkptp_root=SIMULATOR_ROOT, persistent_script=persistent_script,
+                    in_memory=True)
+    try:
+        assert await camera.init()
+        stream_path = camera.stream_path
+        paths = [await camera.capture({}) for n in range(3)]
+        data = camera.image_data(paths[-1])
+        assert isinstance(data, memoryview)
+        assert data == (images / 'a.jpg').read_bytes()
+    finally:
+        await camera.close()
+    # saved in the background, written completely by close()
+    assert all(path.read_bytes() == data for path in paths)
+    assert not stream_path.exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('persistent_script', [False, True])
+async def test_state_mirror(tmp_path, monkeypatch, persistent_script):
+    use_simulator(monkeypatch)
+    camera = Camera(tmp_path, chdkptp_root=SIMULATOR_ROOT, persistent_script=persistent_script)
+    sent = []
+    send_command = camera.send_command
+
+    async def record(cmd, timeout=None):
+        sent.append(cmd)
+        return await send_command(cmd, timeout)
+
+    camera.send_command = record
+    try:
+        assert await camera.init()
+        assert camera.state.mode == 'rec'
+        sent.clear()
+        assert await camera.get_zoom() == 0
+        assert await camera.get_zoom() == 0
+        await camera.set_zoom(3)
+        await camera.set_zoom('3')
+        assert await camera.get_zoom() == 3
+        mf = {'focus_mode': 'MF', 'focus_distance': 5000}
+        for params in (mf, mf, dict(mf, focus_distance=3000), {}, {}):
+            await camera.prepare(params)
+        calls = [cmd for cmd in sent if cmd.startswith(('=', 'putm'))]
+        if persistent_script:
+            assert calls == ['putm get_zoom', 'putm zoom 3', 'putm mf 1', 'putm focus 5000', 'putm focus 3000',
+                             'putm mf 0']
+        else:
+            assert calls == ['=return get_zoom()', '=set_zoom(3)', '=set_mf(1)', '=set_focus(5000)',
+                             '=set_focus(3000)', '=set_mf(0)']
+
+        # reconnect forgets the state
+        assert await camera.init()
+        assert (camera.state.mf, camera.state.zoom) == (None, None)
+        sent.clear()
+        assert await camera.get_zoom() == 0
+        assert sent
+    finally:
+        await camera.close()
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+import pytest
+
+from lacmus_onboard.camera.stream import FifoReader, write_file
+
+
+@pytest.mark.asyncio
+async def test_fifo_reader(tmp_path):
+    path = tmp_path / 'image_0.jpg'
+    reader = FifoReader(path)
+    await asyncio.sleep(0.05)
+    assert not reader.future.done()  # no writer yet
+
+    data = bytes(range(256)) * 10000  # larger than the initial buffer
+    writer = threading.Thread(target=path.write_bytes, args=(data,))
+    writer.start()
+    image = await asyncio.wait_for(reader.future, 2)
+    writer.join()
+    assert isinstance(image, memoryview)
+    assert image == data
+    assert not path.exists()
+
+
+@pytest.mark.asyncio
+async def test_fifo_reader_close(tmp_path):
+    path = tmp_path / 'image_0.jpg'
+    reader = FifoReader(path)
+    reader.close()
+    assert reader.future.cancelled()
+    assert not path.exists()
+
+
+def test_write_file(tmp_path):
+    path = tmp_path / 'image_0.jpg'
+    write_file(path, memoryview(b'\xff\xd8\xff\xd9'))
+    assert path.read_bytes() == b'\xff\xd8\xff\xd9'
+    assert [p.name for p in tmp_path.iterdir()] == ['image_0.jpg']
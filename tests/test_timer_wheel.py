@@ -0,0 +1,81 @@
+import random
+
+from lacmus_onboard.link_monitor import LinkMonitor
+from lacmus_onboard.timer_wheel import TimerWheel
+
+from conftest import FakeClock
+
+
+def test_timers_fire_in_order_across_levels():
+    clock = FakeClock()
+    wheel = TimerWheel(resolution=0.1, bits=2, levels=3, clock=clock)
+    fired = []
+    delays = [0.05, 0.3, 0.4, 1.7, 6.3, 12.5]  # the last one is beyond the top level range
+    for delay in delays:
+        wheel.call_later(delay, fired.append, delay)
+    assert len(wheel) == len(delays)
+
+    for step in range(200):
+        clock.now = step * 0.1
+        wheel.advance()
+        assert all(delay <= clock.now + 1e-9 for delay in fired)
+    assert fired == delays
+    assert len(wheel) == 0
+
+
+def test_random_timers_never_fire_early_or_late():
+    clock = FakeClock()
+    wheel = TimerWheel(resolution=0.01, bits=3, levels=3, clock=clock)
+    fired = {}
+    expected = {}
+    rnd = random.Random(1)
+    for n in range(500):
+        when = rnd.uniform(0, 8)
+        expected[n] = when
+        wheel.call_at(when, lambda n=n: fired.__setitem__(n, clock.now))
+
+    while clock.now < 9:
+        clock.now += rnd.uniform(0.001, 0.05)
+        wheel.advance()
+    assert fired.keys() == expected.keys()
+    for n, when in expected.items():
+        assert when <= fired[n] + 0.01
+        assert fired[n] - when < 0.07
+
+
+def test_cancel():
+    clock = FakeClock()
+    wheel = TimerWheel(clock=clock)
+    fired = []
+    timer = wheel.call_later(1, fired.append, 1)
+    wheel.call_later(2, fired.append, 2)
+    timer.cancel()
+    clock.now = 3
+    assert wheel.advance() == 1
+    assert fired == [2]
+
+
+def test_link_monitor_state_changes():
+    clock = FakeClock()
+    wheel = TimerWheel(clock=clock)
+    monitor = LinkMonitor(wheel, timeout=3)
+    events = []
+    monitor.add_listener(lambda peer, alive: events.append(((peer.system_id, peer.component_id), alive)))
+
+    monitor.seen(1, 1)
+    monitor.seen(255, 190)
+    assert monitor.link_alive
+    for t in (1, 2, 3, 4, 5):
+        clock.now = t
+        monitor.seen(1, 1)
+        wheel.advance()
+    assert events == [((1, 1), True), ((255, 190), True), ((255, 190), False)]
+    assert monitor.link_alive
+
+    clock.now = 9
+    wheel.advance()
+    assert not monitor.link_alive
+    assert events[-1] == ((1, 1), False)
+
+    monitor.seen(1, 1)
+    assert events[-1] == ((1, 1), True)
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+from lacmus_onboard.mavlink_service import TransportFile
+
+
+class FakeTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+
+class FakeProtocol:
+    remote_addr = None
+
+
+def make_file():
+    proto = FakeProtocol()
+    transport = FakeTransport()
+    mav = mavlink2.MAVLink(None, srcSystem=1, srcComponent=100)
+    mav.file = TransportFile(transport, proto)
+    return mav, proto, transport
+
+
+def parse(datagram):
+    return mavlink2.MAVLink(None).parse_buffer(datagram)
+
+
+@pytest.mark.asyncio
+async def test_writes_of_one_iteration_are_coalesced():
+    mav, proto, transport = make_file()
+    proto.remote_addr = ('127.0.0.1', 14550)
+    for n in range(3):
+        mav.heartbeat_send(6, 8, 0, n, 0)
+    assert transport.sent == []
+    await asyncio.sleep(0)
+    (datagram, addr), = transport.sent
+    assert addr == proto.remote_addr
+    assert [msg.custom_mode for msg in parse(datagram)] == [0, 1, 2]
+    assert (mav.file.writes, mav.file.datagrams) == (3, 1)
+
+
+@pytest.mark.asyncio
+async def test_datagrams_are_limited_to_mtu():
+    mav, proto, transport = make_file()
+    proto.remote_addr = ('127.0.0.1', 14550)
+    for n in range(20):
+        mav.file_transfer_protocol_send(0, 255, 190, [n] * 251)
+    await asyncio.sleep(0)
+    assert all(len(datagram) <= TransportFile.MAX_DATAGRAM_SIZE for datagram, addr in transport.sent)
+    assert len(transport.sent) == 4
+    msgs = [msg for datagram, addr in transport.sent for msg in parse(datagram)]
+    assert [msg.payload[0] for msg in msgs] == list(range(20))
+
+
+@pytest.mark.asyncio
+async def test_preconnect_buffer_is_bounded_and_sent_to_the_first_peer():
+    mav, proto, transport = make_file()
+    for n in range(TransportFile.MAX_PRECONNECT + 10):
+        mav.heartbeat_send(6, 8, 0, n, 0)
+    await asyncio.sleep(0)
+    assert transport.sent == []
+    assert mav.file.dropped == 10
+    proto.remote_addr = ('127.0.0.1', 14550)
+    mav.heartbeat_send(6, 8, 0, 1000, 0)
+    await asyncio.sleep(0)
+    msgs = [msg for datagram, addr in transport.sent for msg in parse(datagram)]
+    assert [msg.custom_mode for msg in msgs] == list(range(10, TransportFile.MAX_PRECONNECT + 10)) + [1000]
+
+
+@pytest.mark.asyncio
+async def test_close_sends_pending_frames():
+    mav, proto, transport = make_file()
+    proto.remote_addr = ('127.0.0.1', 14550)
+    mav.heartbeat_send(6, 8, 0, 0, 0)
+    mav.file.close()
+    assert len(transport.sent) == 1
+    await asyncio.sleep(0)
+    assert len(transport.sent) == 1
@@ -0,0 +1,66 @@
+import math
+
+from lacmus_onboard.mavlink.dialects import lacmus as mavlink2
+from lacmus_onboard.vehicle_state import VehicleStateCache, euler_to_quaternion
+
+
+def make_msg(msg, system_id=1, component_id=1):
+    mav = mavlink2.MAVLink(None, srcSystem=system_id, srcComponent=component_id)
+    msg.pack(mav)
+    return msg
+
+
+def test_position_and_time():
+    cache = VehicleStateCache(clock=lambda: 42.0)
+    assert cache.get(1) is None
+
+    cache.update(make_msg(mavlink2.MAVLink_system_time_message(1600000000000000, 1000)))
+    cache.update(make_msg(mavlink2.MAVLink_global_position_int_message(
+        1500, 557000000, 376000000, 150000, 100000, 0, 0, 0, 0)))
+
+    state = cache.get(1)
+    assert (state.lat, state.lon, state.alt, state.relative_alt) == (557000000, 376000000, 150000, 100000)
+    assert state.time_boot_ms == 1500
+    assert state.time_utc == 1600000000500000
+    assert state.position_received == 42.0
+    assert cache.get(2) is None
+
+
+def test_snapshot_is_shared_until_update():
+    cache = VehicleStateCache()
+    cache.update(make_msg(mavlink2.MAVLink_attitude_quaternion_message(10, 1, 0, 0, 0, 0, 0, 0)))
+    first = cache.get(1)
+    assert first is cache.get(1)
+    assert first.q == (1, 0, 0, 0)
+
+    cache.update(make_msg(mavlink2.MAVLink_attitude_message(20, 0, 0, math.pi / 2, 0, 0, 0)))
+    second = cache.get(1)
+    assert second is not first
+    assert first.q == (1, 0, 0, 0)
+    assert all(math.isclose(a, b, abs_tol=1e-6) for a, b in zip(second.q, euler_to_quaternion(0, 0, math.pi / 2)))
+
+
+def test_ignores_unrelated_messages():
+    cache = VehicleStateCache()
+    msg = make_msg(mavlink2.MAVLink_heartbeat_message(1, 2, 0, 0, 4, 3))
+    assert cache.update(msg) is False
+    assert 1 not in cache
+
+
+def test_pose_at_interpolates_trigger_time():
+    cache = VehicleStateCache()
+    assert cache.pose_at(1, 1000) is None
+    cache.update(make_msg(mavlink2.MAVLink_system_time_message(1600000000000000, 1000)))
+    cache.update(make_msg(mavlink2.MAVLink_global_position_int_message(1000, 100, 200, 1000, 500, 0, 0, 0, 0)))
+    cache.update(make_msg(mavlink2.MAVLink_global_position_int_message(2000, 300, 400, 3000, 700, 0, 0, 0, 0)))
+
+    pose = cache.pose_at(1, 1500000)  # time since boot
+    assert (pose["lat"], pose["lon"], pose["alt"], pose["relative_alt"]) == (200, 300, 2000, 600)
+    assert pose["time_boot_ms"] == 1500
+    assert pose["time_utc"] == 1600000000500000
+
+    pose = cache.pose_at(1, 1600000000250000)  # UNIX time
+    assert (pose["lat"], pose["time_boot_ms"]) == (150, 1250)
+
+    pose = cache.pose_at(1)
+    assert (pose["lat"], pose["time_boot_ms"]) == (300, 2000)
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from lacmus_onboard.camera.watcher import InotifyWatcher, PollingWatcher, file_watcher
+
+
+@pytest.mark.asyncio
+async def test_inotify_signals_closed_file(tmp_path):
+    watcher = InotifyWatcher(tmp_path)
+    path = tmp_path / 'image_0.jpg'
+    try:
+        waiter = asyncio.ensure_future(watcher.wait(path, 1))
+        f = open(path, 'wb')
+        f.write(b'\xff\xd8')
+        f.flush()
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        f.write(b'\xff\xd9')
+        f.close()
+        assert await waiter
+    finally:
+        watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_inotify_remembers_completed_and_ignores_stale_files(tmp_path):
+    stale = tmp_path / 'image_1.jpg'
+    stale.write_bytes(b'old')
+    watcher = InotifyWatcher(tmp_path)
+    try:
+        (tmp_path / 'image_0.jpg').write_bytes(b'new')
+        await asyncio.sleep(0.05)
+        assert await watcher.wait(tmp_path / 'image_0.jpg', 0.1)
+        assert not await watcher.wait(stale, 0.1)
+        assert not watcher.waiters
+    finally:
+        watcher.close()
+
+
+@pytest.mark.asyncio
+async def test_polling_waits_for_stable_size(tmp_path):
+    watcher = PollingWatcher(tmp_path)
+    path = tmp_path / 'image_0.jpg'
+    loop = asyncio.get_event_loop()
+    loop.call_later(0.05, path.write_bytes, b'\xff\xd8')
+    assert await watcher.wait(path, 1)
+    assert not await watcher.wait(tmp_path / 'missing.jpg', 0.1)
+
+
+def test_fallback_to_polling(tmp_path):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        assert isinstance(file_watcher(tmp_path / 'missing'), PollingWatcher)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()